@@ -0,0 +1,861 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+import os, re, math, glob
+from lexicon2fst import Lexicon
+
+#Tolerance of the printed weights when matching composed arcs
+DELTA = 1e-3
+#Arcs looked ahead to tell apart composed states that look alike
+LOOKAHEAD = 16
+
+class TextFst( ):
+    """
+       An FST in OpenFst text format, with the arcs of each state indexed
+       by input label for composition.  Acceptor arcs get the label on 
+       both sides.  'closure' adds the star closure of fstclosure, a new
+       final start state and epsilon arcs from the final states back to
+       the old start.
+    """
+
+    def __init__( self, lines=[], eps="<eps>", acceptor=False, closure=False ):
+        self.eps    = eps
+        self.start  = None
+        self.out    = {}
+        self.finals = {}
+        self.index  = {}
+        for line in lines:
+            parts = line.split()
+            if not parts:
+                continue
+            if self.start==None:
+                self.start = parts[0]
+            if acceptor and len(parts)>=3:
+                parts.insert( 3, parts[2] )
+            if len(parts)>=4:
+                weight = 0.0
+                if len(parts)>4:
+                    weight = float(parts[4])
+                self.out.setdefault( parts[0], [] ).append( (parts[2], parts[3], weight, parts[1]) )
+            elif len(parts)==2:
+                self.finals[parts[0]] = float(parts[1])
+            else:
+                self.finals[parts[0]] = 0.0
+        if closure and not self.start==None:
+            for state, weight in self.finals.items():
+                self.out.setdefault( state, [] ).append( (eps, eps, weight, self.start) )
+            self.out["closure"] = [ (eps, eps, 0.0, self.start) ]
+            self.finals["closure"] = 0.0
+            self.start = "closure"
+
+    def copy( self ):
+        """A copy that shares the arc lists, replace them to change a state."""
+        fst = TextFst( eps=self.eps )
+        fst.start  = self.start
+        fst.out    = dict( self.out )
+        fst.finals = dict( self.finals )
+        return fst
+
+    def arcs( self, state ):
+        return self.out.get( state, [] )
+
+    def final( self, state ):
+        return self.finals.get( state )
+
+    def matches( self, state, label ):
+        """The arcs of 'state' with input 'label'."""
+        index = self.index.get( state )
+        if index==None:
+            index = {}
+            for arc in self.out.get( state, [] ):
+                index.setdefault( arc[0], [] ).append( arc )
+            self.index[state] = index
+        return index.get( label, [] )
+
+    def changed( self, other ):
+        """The states whose arcs or final weight differ in 'other'."""
+        states = set( self.out ) | set( other.out ) | set( self.finals ) | set( other.finals )
+        return set( s for s in states if not self.final(s)==other.final(s) 
+                    or not sorted(self.arcs(s))==sorted(other.arcs(s)) )
+
+    def write( self, ofp ):
+        """Write in text format, the start state first."""
+        states = [ self.start ] + [ s for s in self.out if not s==self.start ]
+        for state in states:
+            for ilabel, olabel, weight, next in self.out.get( state, [] ):
+                ofp.write( "%s\t%s\t%s\t%s\t%f\n" % (state, next, ilabel, olabel, weight) )
+        for state, weight in self.finals.iteritems():
+            ofp.write( "%s\t%f\n" % (state, weight) )
+        return
+
+class Composition( ):
+    """
+       Lazy composition of two TextFsts.  It follows the sequence filter 
+       of fstcompose, so its states, (state1, state2, filter) tuples, are 
+       those of the file fstcompose writes for the same two FSTs.
+    """
+
+    def __init__( self, fst1, fst2 ):
+        self.fst1  = fst1
+        self.fst2  = fst2
+        self.eps   = fst1.eps
+        self.start = ( fst1.start, fst2.start, 0 )
+
+    def final( self, state ):
+        weight1 = self.fst1.final( state[0] )
+        weight2 = self.fst2.final( state[1] )
+        if weight1==None or weight2==None:
+            return None
+        return weight1 + weight2
+
+    def arcs( self, state ):
+        """The (ilabel, olabel, weight, state) arcs of 'state'."""
+        s1, s2, fs = state
+        arcs1 = self.fst1.arcs( s1 )
+        neps  = 0
+        arcs  = []
+        for ilabel, olabel, weight, next1 in arcs1:
+            if olabel==self.eps:
+                neps += 1
+                #FST1 moves alone, unless FST2 already did
+                if fs==0:
+                    arcs.append( (ilabel, self.eps, weight, (next1, s2, 0)) )
+                continue
+            for ilabel2, olabel2, weight2, next2 in self.fst2.matches( s2, olabel ):
+                arcs.append( (ilabel, olabel2, weight+weight2, (next1, next2, 0)) )
+        #FST2 moves alone, unless FST1 can only move on epsilons
+        if neps<len(arcs1) or not self.fst1.final( s1 )==None:
+            for ilabel2, olabel2, weight2, next2 in self.fst2.matches( s2, self.eps ):
+                arcs.append( (self.eps, olabel2, weight2, (s1, next2, int(neps>0))) )
+        return arcs
+
+def same_weight( weight1, weight2 ):
+    return abs(weight1-weight2)<=DELTA*max(1.0, abs(weight1))
+
+def _explains( xfst, xstate, model, mstate, depth, memo ):
+    """Whether 'xstate' can be the state 'mstate' of 'model', looking 'depth' arcs ahead."""
+    key = ( xstate, mstate, depth )
+    if key in memo:
+        return memo[key]
+    memo[key] = xfst.final( xstate )==None or not model.final( mstate )==None
+    arcs = model.arcs( mstate )
+    for ilabel, olabel, weight, xnext in xfst.arcs( xstate ):
+        if not memo[key]:
+            break
+        for i, arc in enumerate( arcs ):
+            if arc[:2]==(ilabel, olabel) and same_weight( arc[2], weight ) and \
+                    ( depth==0 or _explains( xfst, xnext, model, arc[3], depth-1, memo ) ):
+                del arcs[i]
+                break
+        else:
+            memo[key] = False
+    return memo[key]
+
+def map_composition( xfst, model ):
+    """
+       Recover the state of the Composition 'model' behind each state of
+       the composed TextFst 'xfst', walking both from the start.  Arcs 
+       with the same labels and weight are told apart by the arcs that 
+       follow them, up to LOOKAHEAD arcs ahead.  Raises ValueError if an
+       arc of 'xfst' has no counterpart in 'model'.
+    """
+    xmap  = { xfst.start : model.start }
+    queue = [ xfst.start ]
+    memo  = {}
+    while queue:
+        xstate = queue.pop()
+        mstate = xmap[xstate]
+        if not _explains( xfst, xstate, model, mstate, 0, memo ):
+            raise ValueError, "Composed state %s does not fit its components." % xstate
+        candidates = {}
+        for arc in model.arcs( mstate ):
+            candidates.setdefault( arc[:2], [] ).append( arc )
+        #Arcs into states that are already mapped first
+        xarcs = sorted( xfst.arcs( xstate ), key=lambda arc: arc[3] not in xmap )
+        for ilabel, olabel, weight, xnext in xarcs:
+            arcs = [ arc for arc in candidates.get( (ilabel, olabel), [] ) if same_weight( arc[2], weight ) ]
+            if xnext in xmap:
+                arcs = [ arc for arc in arcs if arc[3]==xmap[xnext] ]
+            else:
+                depth = 0
+                arcs  = [ arc for arc in arcs if _explains( xfst, xnext, model, arc[3], depth, memo ) ]
+                while len(arcs)>1 and depth<LOOKAHEAD:
+                    depth += 1
+                    arcs   = [ arc for arc in arcs if _explains( xfst, xnext, model, arc[3], depth, memo ) ] or arcs
+            if len(arcs)==0:
+                raise ValueError, "Composed arc %s -> %s %s:%s has no counterpart." % (xstate, xnext, ilabel, olabel)
+            candidates[(ilabel, olabel)].remove( arcs[0] )
+            if xnext not in xmap:
+                xmap[xnext] = arcs[0][3]
+                queue.append( xnext )
+    return xmap
+
+def patch_composition( xfst, xmap, old, new, changed1, changed2 ):
+    """
+       Patch the composed TextFst 'xfst' of the 'old' Composition into 
+       that of the 'new' one, whose components differ in the states 
+       'changed1' and 'changed2'.  Only the composed states over a changed
+       component state are recomputed, the states that only the 'new' 
+       composition reaches are added and the result is connected as 
+       fstcompose does.  The states keep their numbers, so the trimmed 
+       ones leave gaps.  Returns the patched TextFst, 'xmap' is updated
+       in place.
+    """
+    patched = xfst.copy( )
+    rmap    = dict( (mstate, xstate) for xstate, mstate in xmap.iteritems() )
+    last    = [ max( int(xstate) for xstate in xmap ) ]
+    added   = []
+    def state( mstate ):
+        if mstate not in rmap:
+            last[0] += 1
+            rmap[mstate] = str(last[0])
+            xmap[rmap[mstate]] = mstate
+            added.append( rmap[mstate] )
+        return rmap[mstate]
+    def update( xstate, mstate, arcs ):
+        patched.out[xstate] = [ (i, o, w, state( next )) for i, o, w, next in arcs ]
+        patched.finals.pop( xstate, None )
+        if not new.final( mstate )==None:
+            patched.finals[xstate] = new.final( mstate )
+
+    for xstate, mstate in xmap.items():
+        if mstate[0] not in changed1 and mstate[1] not in changed2:
+            continue
+        #Keep the arcs that are still there, fstcompose may have trimmed some
+        removed = old.arcs( mstate )
+        arcs    = []
+        for arc in new.arcs( mstate ):
+            for i, old_arc in enumerate( removed ):
+                if old_arc[:2]==arc[:2] and old_arc[3]==arc[3] and same_weight( old_arc[2], arc[2] ):
+                    del removed[i]
+                    break
+            else:
+                arcs.append( arc )
+        for ilabel, olabel, weight, xnext in xfst.arcs( xstate ):
+            for i, arc in enumerate( removed ):
+                if arc[:2]==(ilabel, olabel) and arc[3]==xmap[xnext] and same_weight( arc[2], weight ):
+                    del removed[i]
+                    break
+            else:
+                arcs.append( (ilabel, olabel, weight, xmap[xnext]) )
+        update( xstate, mstate, arcs )
+    while len(added)>0:
+        xstate = added.pop()
+        update( xstate, xmap[xstate], new.arcs( xmap[xstate] ) )
+
+    #Connect, as fstcompose does, patching can strand existing states too
+    reverse = {}
+    forward = [ patched.start ]
+    access  = set( forward )
+    while forward:
+        xstate = forward.pop()
+        for arc in patched.arcs( xstate ):
+            reverse.setdefault( arc[3], [] ).append( xstate )
+            if arc[3] not in access:
+                access.add( arc[3] )
+                forward.append( arc[3] )
+    backward = [ xstate for xstate in patched.finals if xstate in access ]
+    live     = set( backward )
+    while backward:
+        for xstate in reverse.get( backward.pop(), [] ):
+            if xstate not in live:
+                live.add( xstate )
+                backward.append( xstate )
+    for xstate in set( patched.out ) | set( patched.finals ) | set( xmap ):
+        if xstate not in live:
+            patched.out.pop( xstate, None )
+            patched.finals.pop( xstate, None )
+            xmap.pop( xstate, None )
+        elif any( arc[3] not in live for arc in patched.out.get( xstate, [] ) ):
+            patched.out[xstate] = [ arc for arc in patched.out[xstate] if arc[3] in live ]
+    return patched
+
+class WordAdder( ):
+    """
+       Add new words to the components of an already built cascade.
+
+       The text components PREFIX.l.fst.txt, PREFIX.g.fst.txt and, if
+       present, PREFIX.t.fst.txt are patched in place together with 
+       PREFIX.word.syms, PREFIX.l.isyms and PREFIX.aux, and the patched 
+       components are recompiled.  H and C are not touched unless a new
+       aux symbol is needed.
+
+       NOTE: Only the standard lexicon, a separate chain per entry, can 
+             be patched.  A lexicon built with --minimal must be rebuilt.
+       NOTE: The plain compositions of C, HC, L and G, such as PREFIX.lg.fst
+             or PREFIX.clg.fst, are patched as well.  The state tuple 
+             behind each composed state is recovered once and kept in 
+             PREFIX.NAME.fst.map, then only the composed states over a 
+             changed L or G state are recomposed and the new word paths
+             are added to them.  A composition of an intermediate cascade,
+             (C*L)*G, is patched through the patched intermediate.
+             Determinization and minimization keep no state tuples, so a
+             cascade derived from a patched one by det, min, push or 
+             rmeps alone is derived again with just those steps.  Any 
+             other composed file found for PREFIX is reported as stale,
+             rerun transducersaurus.py to rebuild it.
+       NOTE: New words enter G either with an explicit unigram probability,
+             as a loop on the state that holds the existing unigram arcs,
+             or as members of an existing class word.  The probability of
+             each class word arc is then split evenly over the class word
+             and all of its members, which are listed in PREFIX.members.
+             A JFSG style G has no unigram state and only takes class 
+             members.
+    """
+
+    def __init__( self, prefix="test", eps="<eps>", failure=None, lextype="htk", sil="<sil>", wclass=None, wordbound=None ):
+        self.prefix   = prefix
+        self.eps      = eps
+        self.failure  = failure
+        self.lextype  = lextype
+        self.sil      = sil
+        self.wclass   = wclass
+        self.wordbound = wordbound
+        self.words    = self._read_syms( "PREFIX.word.syms".replace("PREFIX",self.prefix) )
+        self.lisyms   = self._read_syms( "PREFIX.l.isyms".replace("PREFIX",self.prefix) )
+        self.aux      = self._read_list( "PREFIX.aux".replace("PREFIX",self.prefix) )
+        self.new_aux  = []
+        self.old_text = {}
+
+    def _read_syms( self, symfile ):
+        syms = {}
+        sym_fp = open(symfile,"r")
+        for line in sym_fp:
+            parts = line.split()
+            if len(parts)==2:
+                syms[parts[0]] = int(parts[1])
+        sym_fp.close()
+        return syms
+
+    def _read_list( self, listfile ):
+        items = set([])
+        if not os.path.exists(listfile):
+            return items
+        list_fp = open(listfile,"r")
+        for line in list_fp:
+            line = line.strip()
+            if line:
+                items.add(line)
+        list_fp.close()
+        return items
+
+    def _append_syms( self, symfile, syms, new ):
+        sym_fp = open(symfile,"a")
+        last   = max(syms.itervalues())
+        for sym in new:
+            last += 1
+            syms[sym] = last
+            sym_fp.write("%s\t%d\n" % (sym, syms[sym]))
+        sym_fp.close()
+        return
+
+    def to_tropical( self, val ):
+        return math.log(10.0) * float(val) * -1.0
+
+    def _read_lexicon( self, lines ):
+        """
+           Recover the entries of the standard lexicon from its text form.
+           Returns the list of (word, phones, aux, end) entries in file 
+           order, where 'end' is the final state of the entry, and the 
+           largest state ID.
+        """
+        arcs   = {}
+        finals = set([])
+        nstates = 0
+        for line in lines:
+            parts = line.split()
+            if len(parts)==1:
+                finals.add(int(parts[0]))
+                nstates = max(nstates, int(parts[0]))
+            elif len(parts)>=4:
+                src, dst = int(parts[0]), int(parts[1])
+                arcs.setdefault(src,[]).append( (dst, parts[2], parts[3]) )
+                nstates = max(nstates, src, dst)
+        if 0 in finals:
+            raise ValueError, "PREFIX.l.fst.txt is a closed minimal lexicon.  Rebuild it with lexicon2fst.py instead.".replace("PREFIX",self.prefix)
+        entries = []
+        for dst, isym, word in arcs.get(0,[]):
+            if word==self.failure:
+                continue
+            phones = [isym]
+            aux    = None
+            while dst not in finals:
+                dst, isym, osym = arcs[dst][0]
+                if isym in self.aux:
+                    aux = isym
+                elif isym==self.wordbound:
+                    continue
+                else:
+                    phones.append(isym)
+            entries.append( (word, phones, aux, dst) )
+        return entries, nstates
+
+    def add_words( self, dictfile, unigrams={} ):
+        """
+           Add the entries of 'dictfile' to L and the new words to G and T.
+           'unigrams' maps new words to log10 unigram probabilities.  New
+           words without one are added as members of the class word.
+        """
+        new = Lexicon( dictfile, lextype=self.lextype )._read_entries( )
+        known  = set( self.lisyms )
+        usable = []
+        for word, phones, aux in new:
+            unknown = [ p for p in phones if p not in known ]
+            if unknown:
+                print "WARNING: Skipping \"%s\", phones %s are not in the cascade." % (word, " ".join(unknown))
+                continue
+            usable.append( (word, phones) )
+        if not usable:
+            return
+        words = []
+        for word, phones in usable:
+            if word not in self.words and word not in words:
+                words.append(word)
+
+        self._patch_lexicon( usable )
+        new_ctx = self._patch_contexts( usable )
+        self._append_syms( "PREFIX.word.syms".replace("PREFIX",self.prefix), self.words, words )
+        self._patch_grammar( words, unigrams )
+        self._patch_silclass( words )
+        print "Added %d entries and %d new words." % (len(usable), len(words))
+        if self.new_aux:
+            print "WARNING: New aux symbols %s were added to PREFIX.aux.  C and H must be rebuilt.".replace("PREFIX",self.prefix) % " ".join(self.new_aux)
+        if new_ctx>0:
+            print "WARNING: %d new phone contexts were added to PREFIX.ctx.  A reachable-only C must be rebuilt.".replace("PREFIX",self.prefix) % new_ctx
+        return
+
+    def _composed( self ):
+        """List the names of the compiled cascades of PREFIX other than the single components."""
+        names = [ f[len(self.prefix)+1:-4] for f in glob.glob( "PREFIX.*.fst".replace("PREFIX",self.prefix) ) ]
+        return sorted( name for name in names if name not in ("h","c","l","g","t","hc") )
+
+    def report_stale( self, names ):
+        if names:
+            print "WARNING: The composed cascades %s do not contain the new words.  Rebuild them with transducersaurus.py." % \
+                " ".join( "PREFIX.NAME.fst".replace("PREFIX",self.prefix).replace("NAME",name) for name in names )
+        return
+
+    def _patch_lexicon( self, usable ):
+        """
+           Append the new entries to L.  Aux symbols are reassigned over 
+           the old and new entries together, and old entries that became
+           a homophone or a prefix of a new entry get an aux arc as well.
+        """
+        lexfile = "PREFIX.l.fst.txt".replace("PREFIX",self.prefix)
+        lex_fp  = open(lexfile,"r")
+        lines   = lex_fp.readlines()
+        lex_fp.close()
+        old, nstates = self._read_lexicon( lines )
+        self.old_text["l"] = lines
+
+        combined = Lexicon( None, lextype=self.lextype )._assign_aux( 
+            [ (w, p) for w, p, a, e in old ] + usable )
+        extend = {}
+        for (word, phones, aux, end), (w, p, new_aux) in zip( old, combined ):
+            if not new_aux==aux:
+                extend[end] = new_aux
+        for word, phones, aux in combined:
+            if aux and aux not in self.aux:
+                self.aux.add(aux)
+                self.new_aux.append(aux)
+
+        lex_ofp = open(lexfile,"w")
+        for line in lines:
+            parts = line.split()
+            if len(parts)==1 and int(parts[0]) in extend:
+                nstates += 1
+                lex_ofp.write("%s\t%d\t%s\t%s\n" % (parts[0], nstates, extend[int(parts[0])], self.eps))
+                lex_ofp.write("%d\n" % nstates)
+            else:
+                lex_ofp.write(line)
+        for word, phones, aux in combined[len(old):]:
+            nstates += 1
+            lex_ofp.write("%d\t%d\t%s\t%s\n" % (0, nstates, phones[0], word))
+            for p in phones[1:] + [ a for a in [self.wordbound, aux] if a ]:
+                lex_ofp.write("%d\t%d\t%s\t%s\n" % (nstates, nstates+1, p, self.eps))
+                nstates += 1
+            lex_ofp.write("%d\n" % nstates)
+        lex_ofp.close()
+
+        self._append_syms( "PREFIX.l.isyms".replace("PREFIX",self.prefix), self.lisyms, self.new_aux )
+        aux_fp = open("PREFIX.aux".replace("PREFIX",self.prefix),"a")
+        for aux in self.new_aux:
+            aux_fp.write("%s\n" % aux)
+        aux_fp.close()
+        return
+
+    def _patch_contexts( self, usable ):
+        """
+           Append the phone contexts of the new entries that are missing 
+           from PREFIX.ctx, if the lexicon printed one.  Returns the 
+           number of new contexts.
+        """
+        ctxfile = "PREFIX.ctx".replace("PREFIX",self.prefix)
+        if not os.path.exists(ctxfile):
+            return 0
+        ctx_fp = open(ctxfile,"r")
+        known  = set( tuple(line.split()) for line in ctx_fp )
+        ctx_fp.close()
+        lexicon = Lexicon( None, lextype=self.lextype )
+        for word, phones in usable:
+            lexicon._add_contexts( phones )
+        new = [ ("I",p) for p in sorted(lexicon.initial) ] + [ ("F",p) for p in sorted(lexicon.final) ] \
+            + [ ("B",lp,rp) for lp, rp in sorted(lexicon.bigrams) ]
+        new = [ ctx for ctx in new if ctx not in known ]
+        ctx_fp = open(ctxfile,"a")
+        for ctx in new:
+            ctx_fp.write("%s\n" % " ".join(ctx))
+        ctx_fp.close()
+        return len(new)
+
+    def _unigram_state( self, lines ):
+        """
+           Find the G state that holds the unigram arcs: the state whose
+           outgoing arcs carry every word of G, apart from the words 
+           leaving the start state.  This is the back-off state of an 
+           N-gram G, or its sentence state if G is a unigram model.
+           Returns None if there is no such state, as for a JFSG.
+        """
+        start = lines[0].split()[0]
+        skip  = set([ self.eps, self.failure ])
+        for line in lines:
+            parts = line.split()
+            if len(parts)>=3 and parts[0]==start:
+                skip.add( parts[2] )
+        counts = {}
+        words  = set([])
+        for line in lines:
+            parts = line.split()
+            if len(parts)<3 or parts[2] in skip:
+                continue
+            words.add( parts[2] )
+            counts[parts[0]] = counts.get(parts[0],0) + 1
+        if not counts:
+            return None
+        state  = max( counts, key=counts.get )
+        labels = set([])
+        for line in lines:
+            parts = line.split()
+            if len(parts)>=3 and parts[0]==state and parts[2] not in skip:
+                labels.add( parts[2] )
+        if not labels==words:
+            return None
+        return state
+
+    def _patch_grammar( self, words, unigrams ):
+        """
+           Add the new words to G.  Words with a unigram probability loop
+           on the unigram state, the other words copy the class word arcs.
+           The class word and its old and new members share the original
+           probability of each class word arc evenly.
+        """
+        gfile  = "PREFIX.g.fst.txt".replace("PREFIX",self.prefix)
+        g_fp   = open(gfile,"r")
+        lines  = g_fp.readlines()
+        g_fp.close()
+        self.old_text["g"] = list(lines)
+        members = [ w for w in words if w not in unigrams ]
+        if members and not self.wclass:
+            print "WARNING: No unigram probability or class for %s.  They are not added to G." % " ".join(members)
+            members = []
+        arcs = []
+        uwords = [ w for w in words if w in unigrams ]
+        if uwords:
+            state = self._unigram_state( lines )
+            if state==None:
+                print "WARNING: G has no unigram state.  %s can only be added with --wclass." % " ".join(uwords)
+                uwords = []
+        for word in uwords:
+            arcs.append( "%s\t%s\t%s\t%f\n" % (state, state, word, self.to_tropical(unigrams[word])) )
+        if members:
+            memberfile = "PREFIX.members".replace("PREFIX",self.prefix)
+            current = [ line.split()[1] for line in self._read_list( memberfile ) if line.split()[0]==self.wclass ]
+            share   = math.log( float(len(current)+len(members)+1) / (len(current)+1) )
+            split   = set( current + [self.wclass] )
+            for i, line in enumerate( lines ):
+                parts = line.split()
+                if len(parts)==4 and parts[2] in split:
+                    weight   = float(parts[3]) + share
+                    lines[i] = "%s\t%s\t%s\t%f\n" % (parts[0], parts[1], parts[2], weight)
+                    if parts[2]==self.wclass:
+                        for word in members:
+                            arcs.append( "%s\t%s\t%s\t%f\n" % (parts[0], parts[1], word, weight) )
+            member_fp = open(memberfile,"a")
+            for word in members:
+                member_fp.write("%s\t%s\n" % (self.wclass, word))
+            member_fp.close()
+        #Keep the final state line last
+        g_ofp = open(gfile,"w")
+        g_ofp.write( "".join(lines[:-1]) )
+        g_ofp.write( "".join(arcs) )
+        g_ofp.write( lines[-1] )
+        g_ofp.close()
+        return
+
+    def _patch_silclass( self, words ):
+        """Add an arc to the shared optional silence state of T for each new word."""
+        tfile = "PREFIX.t.fst.txt".replace("PREFIX",self.prefix)
+        if not os.path.exists(tfile) or not words:
+            return
+        t_fp  = open(tfile,"r")
+        lines = t_fp.readlines()
+        t_fp.close()
+        if not [ line for line in lines if line.split()[:4]==["1","1",self.eps,self.sil] ]:
+            raise ValueError, "PREFIX.t.fst.txt has no shared silence state.  Rebuild it with silclass2fst.py instead.".replace("PREFIX",self.prefix)
+        t_ofp = open(tfile,"w")
+        t_ofp.write( "".join(lines[:-1]) )
+        for word in words:
+            t_ofp.write("%d %d %s %s\n" % (0, 1, word, word))
+        t_ofp.write( lines[-1] )
+        t_ofp.close()
+        return
+
+    def compile( self, semiring="log" ):
+        """Recompile the patched components, then patch the composed cascades."""
+        commands = [
+            "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.l.isyms --osymbols=PREFIX.word.syms PREFIX.l.fst.txt | fstclosure - | fstarcsort --sort_type=olabel - > PREFIX.l.fst",
+            "fstcompile --arc_type=SEMIRING --acceptor=true --isymbols=PREFIX.word.syms PREFIX.g.fst.txt | fstarcsort --sort_type=ilabel - > PREFIX.g.fst"
+            ]
+        if os.path.exists("PREFIX.t.fst.txt".replace("PREFIX",self.prefix)):
+            commands.append( "fstcompile --isymbols=PREFIX.word.syms --osymbols=PREFIX.word.syms --arc_type=SEMIRING PREFIX.t.fst.txt | fstarcsort --sort_type=ilabel - > PREFIX.t.fst" )
+        for command in commands:
+            command = command.replace("SEMIRING",semiring).replace("PREFIX",self.prefix)
+            print command
+            os.system( command )
+        self.report_stale( self._patch_composed( semiring ) )
+        return
+
+    def _leaves( self, name ):
+        """Split the name of a plain composition into its components, or return None."""
+        leaves = []
+        while name:
+            for leaf in ("hc","c","l","g"):
+                if name.startswith(leaf):
+                    leaves.append( leaf )
+                    name = name[len(leaf):]
+                    break
+            else:
+                return None
+        if len(leaves)<2:
+            return None
+        return leaves
+
+    def _read_text( self, leaf ):
+        text_fp = open("PREFIX.X.fst.txt".replace("PREFIX",self.prefix).replace("X",leaf),"r")
+        lines   = text_fp.readlines()
+        text_fp.close()
+        return lines
+
+    def _leaf_fst( self, leaf, lines ):
+        """A component as compiled: G is an acceptor and L is closed."""
+        return TextFst( lines, eps=self.eps, acceptor=(leaf=="g"), closure=(leaf=="l") )
+
+    def _syms( self, leaf, fst ):
+        """The input and output symbol tables a component was compiled with."""
+        words  = "PREFIX.word.syms".replace("PREFIX",self.prefix)
+        lisyms = "PREFIX.l.isyms".replace("PREFIX",self.prefix)
+        if leaf=="l":
+            return lisyms, words
+        elif leaf=="g":
+            return words, words
+        elif leaf=="hc":
+            return "PREFIX.h.isyms".replace("PREFIX",self.prefix), lisyms
+        #C takes the HMM symbols unless it was built with aux outputs
+        labels = set( arc[0] for arcs in fst.out.itervalues() for arc in arcs )
+        for symfile in ("PREFIX.c.isyms", "PREFIX.hmm.syms"):
+            symfile = symfile.replace("PREFIX",self.prefix)
+            if os.path.exists(symfile) and labels<=set( self._read_syms( symfile ) ):
+                return symfile, lisyms
+        return None, lisyms
+
+    def _patch_composed( self, semiring ):
+        """
+           Patch the plain compositions of the components of PREFIX and 
+           derive the cascades optimized from them again.  Shorter names
+           come first, so the operands are patched before their cascades.
+           Returns the names of the composed cascades left stale.
+        """
+        names = sorted( self._composed( ), key=len )
+        if not self.old_text:
+            return names
+        fsts = {}
+        for leaf in ("l","g"):
+            old = self._leaf_fst( leaf, self.old_text[leaf] )
+            new = self._leaf_fst( leaf, self._read_text( leaf ) )
+            fsts[leaf] = ( old, new, old.changed( new ) )
+        for leaf in ("c","hc"):
+            #C has no loops for new aux symbols
+            if not self.new_aux and os.path.exists("PREFIX.X.fst.txt".replace("PREFIX",self.prefix).replace("X",leaf)):
+                fst = self._leaf_fst( leaf, self._read_text( leaf ) )
+                fsts[leaf] = ( fst, fst, set([]) )
+        stale = []
+        for name in names:
+            if self._leaves( name ):
+                patched = self._patch_plain( name, fsts, semiring )
+            else:
+                patched = self._derive( name, fsts, semiring )
+            if not patched:
+                stale.append( name )
+        return stale
+
+    def _patch_plain( self, name, fsts, semiring ):
+        """
+           Patch the composition PREFIX.NAME.fst of two operands from 'fsts',
+           components or patched compositions, and add it to 'fsts'.  The 
+           state map is recovered by walking the composition unless a map 
+           newer than the cascade is found.  Returns False if no split of 
+           NAME into two operands explains the composed file.
+        """
+        leaves  = self._leaves( name )
+        if leaves[0] not in fsts or leaves[-1] not in fsts:
+            return False
+        isyms   = self._syms( leaves[0], fsts[leaves[0]][0] )[0]
+        osyms   = self._syms( leaves[-1], fsts[leaves[-1]][0] )[1]
+        if isyms==None:
+            return False
+        xfile   = "PREFIX.NAME.fst".replace("PREFIX",self.prefix).replace("NAME",name)
+        mapfile = xfile+".map"
+        command = "fstprint --isymbols=%s --osymbols=%s %s" % (isyms, osyms, xfile)
+        print command
+        xfst    = TextFst( os.popen( command ).readlines(), eps=self.eps )
+        saved   = None
+        if os.path.exists(mapfile) and os.path.getmtime(mapfile)>=os.path.getmtime(xfile):
+            saved = self._read_map( mapfile )
+        #Left to right, as transducersaurus.py groups C*L*G
+        for k in xrange( len(leaves)-1, 0, -1 ):
+            left, right = "".join(leaves[:k]), "".join(leaves[k:])
+            if left not in fsts or right not in fsts:
+                continue
+            old = Composition( fsts[left][0], fsts[right][0] )
+            if saved and saved[0]==(left, right):
+                xmap = saved[1]
+            else:
+                try:
+                    xmap = map_composition( xfst, old )
+                except ValueError:
+                    continue
+            new = Composition( fsts[left][1], fsts[right][1] )
+            patched = patch_composition( xfst, xmap, old, new, fsts[left][2], fsts[right][2] )
+            text_ofp = open(xfile+".txt","w")
+            patched.write( text_ofp )
+            text_ofp.close()
+            command = "fstcompile --arc_type=%s --keep_state_numbering=true --isymbols=%s --osymbols=%s %s.txt > %s" % \
+                (semiring, isyms, osyms, xfile, xfile)
+            print command
+            os.system( command )
+            self._write_map( mapfile, (left, right), xmap )
+            fsts[name] = ( xfst, patched, xfst.changed( patched ) )
+            return True
+        return False
+
+    def _derive( self, name, fsts, semiring ):
+        """
+           Derive PREFIX.NAME.fst again if it is a single det, min, push or 
+           rmeps step, without options, of a patched cascade.
+        """
+        steps = ( ("det","fstdeterminize"), ("min","fstminimize"), ("pu","fstpush --push_weights=true"), ("rm","fstrmepsilon") )
+        for step, command in steps:
+            if name.startswith(step) and name[len(step):] in fsts:
+                operand = name[len(step):]
+                command = "%s PREFIX.OPERAND.fst > PREFIX.NAME.fst" % command
+                if step=="det" and operand=="l" and semiring=="log":
+                    #As transducersaurus.py does for the unweighted lexicon
+                    command = "fstprint PREFIX.OPERAND.fst | fstcompile - | fstdeterminize - | fstprint - | fstcompile --arc_type=log - > PREFIX.NAME.fst"
+                command = command.replace("PREFIX",self.prefix).replace("OPERAND",operand).replace("NAME",name)
+                print command
+                os.system( command )
+                fsts[name] = None
+                return True
+        return False
+
+    def _read_map( self, mapfile ):
+        """Load the operands and the composed state to tuple map saved with a cascade."""
+        map_fp = open(mapfile,"r")
+        split  = tuple( map_fp.readline().split() )
+        xmap   = {}
+        for line in map_fp:
+            xstate, s1, s2, fs = line.split()
+            xmap[xstate] = ( s1, s2, int(fs) )
+        map_fp.close()
+        return split, xmap
+
+    def _write_map( self, mapfile, split, xmap ):
+        map_ofp = open(mapfile,"w")
+        map_ofp.write("%s\t%s\n" % split)
+        for xstate, (s1, s2, fs) in xmap.iteritems():
+            map_ofp.write("%s\t%s\t%s\t%d\n" % (xstate, s1, s2, fs))
+        map_ofp.close()
+        return
+
+def load_unigrams( unigramfile ):
+    """Load 'WORD log10prob' lines."""
+    unigrams = {}
+    uni_fp = open(unigramfile,"r")
+    for line in uni_fp:
+        parts = line.split()
+        if len(parts)==2:
+            unigrams[parts[0]] = float(parts[1])
+    uni_fp.close()
+    return unigrams
+
+
+if __name__=="__main__":
+    import sys, argparse
+
+    example = "%s --dict new.dic --unigrams new.probs --prefix test" % sys.argv[0]
+
+    parser  = argparse.ArgumentParser( description=example )
+    parser.add_argument('--dict',      "-d", help='Pronunciation dictionary with the new entries.', required=True )
+    parser.add_argument('--prefix',    "-p", help='Prefix of the existing cascade components.', default="test" )
+    parser.add_argument('--unigrams',  "-u", help='File of "WORD log10prob" unigram probabilities for the new words.', default=None )
+    parser.add_argument('--wclass',    "-c", help='Existing G word that new words without a unigram probability are added as members of.', default=None )
+    parser.add_argument('--type',      "-t", help='"htk" or "sphinx" format lexicon.  Sphinx format adds positional information.', default="htk" )
+    parser.add_argument('--eps',       "-e", help='Epsilon symbol, defaults to <eps>.', default="<eps>" )
+    parser.add_argument('--sil',       "-s", help='Silence word of the T transducer.  Defaults to <sil>.', default="<sil>" )
+    parser.add_argument('--failure',   "-f", help="Failure symbol used by the cascade.  Defaults to 'None'.", default=None )
+    parser.add_argument('--semiring',  "-r", help='Semiring used to recompile the components.  Defaults to "log".', default="log" )
+    parser.add_argument('--wordbound', "-b", help='Word-boundary marker of a lexicon built for a word-internal C.', default=None )
+    parser.add_argument('--no_compile',"-z", help='Only patch the text components.', default=False, action="store_true" )
+    parser.add_argument('--verbose',   "-v", help='Verbose mode.', default=False, action="store_true" )
+    args = parser.parse_args()
+
+    if args.verbose==True:
+        print "Running with the following arguments."
+        for attr, value in args.__dict__.iteritems():
+            print attr, "=", value
+
+    unigrams = {}
+    if args.unigrams:
+        unigrams = load_unigrams( args.unigrams )
+    adder = WordAdder( prefix=args.prefix, eps=args.eps, failure=args.failure, lextype=args.type, sil=args.sil, wclass=args.wclass, wordbound=args.wordbound )
+    adder.add_words( args.dict, unigrams )
+    if args.no_compile==False:
+        adder.compile( semiring=args.semiring )
+    else:
+        adder.report_stale( adder._composed( ) )
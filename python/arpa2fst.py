@@ -27,32 +27,97 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 #########################################
-import re, math
+import math, multiprocessing
+from collections import deque
+from array import array
+from ngramindex import HistoryIndex, NGramTrie
+from arpareader import ArpaReader, SortedSection, read_range, file_hash
+from quantize import Codebook
+
+#The LM being converted by the worker processes of a parallel conversion.
+_shard_lm = None
+
+def _index_chunk( chunk ):
+    """Resolve the history keys of one (order, start, end) chunk in a worker process."""
+    order, start, end = chunk
+    return _shard_lm._index_range( order, start, end )
+
+def _convert_chunk( chunk ):
+    """Convert one (order, start, end) chunk in a worker process."""
+    order, start, end = chunk
+    return _shard_lm._convert_range( order, start, end )
 
 class ArpaLM( ):
     """
        Class to convert an ARPA-format LM to WFST format.
        
-       NOTE: This class will convert arbitrary length n-gram models, but
-             it does not perform special handling of missing back-off NODES.
+       NOTE: This class will convert arbitrary length n-gram models.  By
+             default it does not perform special handling of missing back-off 
+             NODES, the 'exact' construction loads the model into an NGramTrie,
+             redirects arcs to the longest existing suffix of a missing history 
+             and trims unreachable and dead-end states.
              It does add default back-off ARCS for missing back-off WEIGHTS.
+             A non-zero 'prune' threshold applies relative-entropy pruning 
+             to the trie before it is written, and implies 'exact'.
+             With 'cache' set the parsed trie is saved to PREFIX.g.cache,
+             keyed on what the parsed trie depends on: the LM file hashes,
+             the order, the sentence begin symbol and the interpolation
+             weights.  Later runs with the same key reload it instead of 
+             parsing the LM again.  The cache holds the trie, so it 
+             requires the 'exact' construction and does not change G.
+       NOTE: 'arpaifile' may be a list of LMs, which are then linearly
+             interpolated with 'lmweights' (equal weights by default) into
+             a single G.  This uses the trie and implies 'exact'.  Only 
+             the lower orders of each LM are held in tries.  The highest 
+             order sections are sorted and merged straight into the arcs,
+             unless the trie is pruned or cached.
+       NOTE: With 'normalize' set to "log" or "tropical" the weights are 
+             pushed towards the start state in that semiring before they 
+             are quantized.  Every sentence keeps its LM score up to one 
+             constant, the total weight of G, and each state becomes 
+             stochastic.  In the log semiring this holds with the back-off
+             arcs read as failure transitions, as the LM reads them; the
+             sum over all epsilon paths of a back-off G is not finite.
+       NOTE: With 'quantize' set to K>0 the log10 probabilities and back-off
+             weights are each mapped to a K level codebook before they are
+             written, so that encoded determinization and minimization
+             find more shared weights.
+             Both options hold the arcs in memory until G is written, so
+             the codebooks are fit and the weights pushed without a 
+             second pass over the LM or over G.
        NOTE: If your model contains '<eps>' as a regular symbol, make sure you
              change the epsilon symbol or you will be in for a world of hurt!
+       NOTE: States are written as dense integer IDs drawn from a 
+             HistoryIndex, so no state symbols table is needed to compile G.
     """
 
-    def __init__( self, arpaifile, arpaofile, eps="<eps>", maxorder=0, sil="<sil>", prefix="test", sb="<s>", se="</s>", boff=None ):
-        self.arpaifile = arpaifile
+    START = 1
+    #Relative precision and limits of the pushing potentials
+    DELTA = 1e-6
+    MAXSWEEPS = 10000
+    MAXMASS = 1e6
+
+    def __init__( self, arpaifile, arpaofile, eps="<eps>", maxorder=0, sil="<sil>", prefix="test", sb="<s>", se="</s>", boff=None, progress=False, jobs=1, exact=False, prune=0.0, cache=False, quantize=0, qmethod="kmeans", lmweights=None, normalize=None ):
+        if isinstance( arpaifile, basestring ):
+            arpaifile = [ arpaifile ]
+        self.arpaifiles = arpaifile
+        self.arpaifile = arpaifile[0]
+        if not lmweights:
+            lmweights = [ 1.0 ] * len(arpaifile)
+        if not len(lmweights)==len(arpaifile):
+            raise ValueError, "Got %d interpolation weights for %d LMs." % (len(lmweights), len(arpaifile))
+        self.lmweights = [ float(w)/sum(lmweights) for w in lmweights ]
         self.arpaofile = arpaofile
-        self.ssyms    = set([])
         self.isyms    = set([])
         self.osyms    = set([])
+        self.wordids  = {}
+        self.histories = HistoryIndex( first=self.START+1 )
         self.eps      = eps
         self.sil      = sil
         self.sb       = sb
         self.se       = se
         if boff: 
             self.boff = boff
-            self.ssyms.add(self.boff)
             self.isyms.add(self.boff)
         else:    self.boff = self.eps
         #Just in case
@@ -63,9 +128,56 @@ class ArpaLM( ):
         self.tropical = True
         self.max_order = int(maxorder)
         self.prefix    = prefix
+        self.progress  = progress
+        self.jobs      = int(jobs)
+        self.prune     = float(prune)
+        self.cache     = cache
+        self.exact     = exact or self.prune>0.0 or len(self.arpaifiles)>1
+        if cache and not self.exact:
+            raise ValueError, "Caching the LM requires the exact construction."
+        self.trie      = None
+        self.chunksize = 1<<20
+        self.vocab     = None
+        self.oov       = []
+        self.quantize  = int(quantize)
+        self.qmethod   = qmethod
+        self.codebooks = None
+        if normalize not in (None, "log", "tropical"):
+            raise ValueError, "Unknown normalization semiring: %s" % normalize
+        self.normalize = normalize
+        self.buffer    = None
         if maxorder==0: self.auto_order = True
         else:           self.auto_order = False
 
+    def check_vocab( self, vocab, vocabfile, lastid ):
+        """
+           Check the LM words against a lexicon word set while G is 
+           generated.  Words that are missing from 'vocab' are appended
+           to the 'vocabfile' symbols table, numbered from 'lastid'.
+        """
+        self.vocab     = vocab
+        self.vocabfile = vocabfile
+        self.lastid    = lastid
+        return
+
+    def _check_word( self, word ):
+        if self.vocab!=None and word not in self.vocab:
+            self.oov.append( word )
+        return
+
+    def _extend_vocab( self ):
+        """Append the words missing from the lexicon to the symbols table."""
+        if self.vocab==None or len(self.oov)==0:
+            return
+        vocab_afp = open(self.vocabfile,"a")
+        for word in self.oov:
+            print "WARNING: Word \"%s\" from LM file %s does not have a corresponding entry in the pronunciation dictionary!"%(word,",".join(self.arpaifiles))
+            print "Adding \"%s\" to %s symbols list." %(word,self.vocabfile)
+            vocab_afp.write("%s\t%d\n"%(word,self.lastid))
+            self.lastid += 1
+        vocab_afp.close()
+        return
+
     def to_tropical( self, val ):
         """
            Convert values to the tropical semiring. 
@@ -74,106 +186,653 @@ class ArpaLM( ):
         logval = math.log(10.0) * float(val) * -1.0
         return logval
 
+    def _wid( self, word ):
+        """Return the integer ID of a word, assigning a new one if necessary."""
+        wid = self.wordids.get(word)
+        if wid==None:
+            wid = len(self.wordids)
+            self.wordids[word] = wid
+        return wid
+
+    def _state( self, words ):
+        """Return the integer state ID for a history of words."""
+        return self.histories.insert( [ self._wid(w) for w in words ] )
+
+    def _child( self, state, word ):
+        """Return the integer state ID for a history extended by a word."""
+        return self.histories.child( state, self._wid(word) )
+
+    def _find( self, words ):
+        """Return the state ID for a history of words, or -1 if it is not indexed."""
+        history = [ self.wordids.get(w, -1) for w in words ]
+        if -1 in history:
+            return -1
+        return self.histories.find( history )
+
+    def _lookup( self, state, word ):
+        """Return the state ID for a history extended by a word, or -1 if it is not indexed."""
+        wid = self.wordids.get(word, -1)
+        if wid<0:
+            return -1
+        return self.histories.lookup( state, wid )
+
     def make_arc( self, istate, ostate, isym, osym, weight=0.0 ):
         """
            Build a single arc.  Add symbols to the symbol tables
            as necessary, but ignore epsilons.
+           While arcs are buffered the arc is stored with its log10 
+           weight and an empty string is returned.
         """
-        if not istate==self.boff: self.ssyms.add(istate)
-        if not ostate==self.boff: self.ssyms.add(ostate)
-        
         if not isym==self.boff: self.isyms.add(isym)
         if not osym==self.boff: self.osyms.add(osym)
+        if self.buffer:
+            src, dst, lab, wgt = self.buffer
+            src.append(istate); dst.append(ostate); wgt.append(float(weight))
+            if isym==self.boff: lab.append(-1)
+            else:               lab.append(self._wid(isym))
+            return ""
+        if self.codebooks:
+            weight = self.codebooks[isym==self.boff].quantize( float(weight) )
 
         if self.tropical:
-            arc = "%s\t%s\t%s\t%f\n" % (istate, ostate, isym, self.to_tropical(weight))
+            weight = self.to_tropical(weight)
         else:
-            arc = "%s\t%s\t%s\t%f\n" % (istate, ostate, isym, float(weight))
+            weight = float(weight)
+        arc = "%d\t%d\t%s\t%f\n" % (istate, ostate, isym, weight)
         return arc
 
+    def _push_weights( self, arcs, final, live ):
+        """
+           Weight pushing towards the start state.  Each arc weight is 
+           reweighted with the log10 potentials of its ends, w+d(t)-d(s),
+           so every complete path changes by the same constant, the 
+           potential of the start state, and each state is stochastic
+           with respect to the potentials.
+           In the tropical semiring the potential is the shortest 
+           distance to the final state.  In the log semiring the sum 
+           over the paths of an epsilon back-off G diverges, so it is 
+           the LM probability of reaching the final state, with the 
+           back-off arcs read as failure transitions.  
+           Returns the potentials as probabilities, or None if they did
+           not converge.  States that cannot reach the final state have 
+           the potential 0.0.
+        """
+        src, dst, lab, wgt = arcs
+        nstates = max( max(src), max(dst), final ) + 1
+        if self.normalize=="log":
+            dist = self._lm_distance( arcs, final, live, nstates )
+        else:
+            dist = self._shortest_distance( arcs, final, live, nstates )
+        if dist==None:
+            return None
+        for i in live( ):
+            if dist[dst[i]]>0.0:
+                wgt[i] += math.log10( dist[dst[i]] ) - math.log10( dist[src[i]] )
+        return dist
+
+    def _shortest_distance( self, arcs, final, live, nstates ):
+        """
+           Tropical shortest distance of every state to the final state,
+           as a probability.  Generic single-source shortest distance 
+           over the reversed arcs, to a relative precision of DELTA.
+        """
+        src, dst, lab, wgt = arcs
+        preds  = [ [] for state in xrange(nstates) ]
+        for i in live( ):
+            preds[dst[i]].append( (src[i], 10.0**wgt[i]) )
+        dist   = [ 0.0 ] * nstates
+        resid  = [ 0.0 ] * nstates
+        queued = bytearray( nstates )
+        dist[final] = resid[final] = 1.0
+        queue  = deque( [final] )
+        queued[final] = 1
+        while queue:
+            state = queue.popleft()
+            queued[state] = 0
+            r = resid[state]
+            resid[state] = 0.0
+            for pred, prob in preds[state]:
+                mass = prob * r
+                if mass<=(1.0+self.DELTA)*dist[pred]:
+                    continue
+                dist[pred]  = mass
+                resid[pred] = max( resid[pred], mass )
+                if not queued[pred]:
+                    queued[pred] = 1
+                    queue.append( pred )
+        return dist
+
+    def _lm_distance( self, arcs, final, live, nstates ):
+        """
+           Probability of reaching the final state from every state under
+           the LM, where a back-off arc only covers the words without an
+           arc of their own:
+             d(s) = sum_w p(w|s)d(t) + bow(s)( d(b) - sum_w P_b(w)d(t_b) )
+           with t_b the state that the backed-off probability P_b(w) of 
+           an explicit word leads to from the back-off state b.  Solved
+           by Gauss-Seidel sweeps, starting from the normalized value 1.
+           A mass above MAXMASS is taken as divergence.
+           Only the arcs into states that can reach the final state count,
+           as the others are dropped when G is written.
+        """
+        src, dst, lab, wgt = arcs
+        preds  = [ [] for state in xrange(nstates) ]
+        for i in live( ):
+            preds[dst[i]].append( src[i] )
+        coacc  = bytearray( nstates )
+        coacc[final] = 1
+        queue  = [ final ]
+        while queue:
+            for pred in preds[queue.pop()]:
+                if not coacc[pred]:
+                    coacc[pred] = 1
+                    queue.append( pred )
+        preds  = None
+        index  = {}
+        boff   = [ -1 ] * nstates
+        out    = [ [] for state in xrange(nstates) ]
+        prob   = {}
+        for i in live( ):
+            if not coacc[dst[i]]:
+                continue
+            prob[i] = 10.0**wgt[i]
+            if lab[i]<0:
+                boff[src[i]] = i
+            else:
+                index[ (src[i]<<32) | lab[i] ] = i
+                out[src[i]].append( i )
+        #The backed-off probability and state of each explicit word
+        shadow = [ [] for state in xrange(nstates) ]
+        for state in xrange( nstates ):
+            if boff[state]<0:
+                continue
+            for i in out[state]:
+                j = boff[state]; weight = 1.0
+                while j>=0:
+                    k = index.get( (dst[j]<<32) | lab[i], -1 )
+                    if k>=0:
+                        shadow[state].append( (weight*prob[k], dst[k]) )
+                        break
+                    j = boff[dst[j]]
+                    if j>=0: weight *= prob[j]
+        states = [ state for state in xrange(nstates) if out[state] or boff[state]>=0 ]
+        dist   = [ 0.0 ] * nstates
+        for state in states:
+            dist[state] = 1.0
+        dist[final] = 1.0
+        for it in xrange( self.MAXSWEEPS ):
+            change = 0.0
+            for state in states:
+                d = 0.0
+                if state==final:
+                    d = 1.0
+                for i in out[state]:
+                    d += prob[i] * dist[dst[i]]
+                j = boff[state]
+                if j>=0:
+                    rest = dist[dst[j]]
+                    for p, t in shadow[state]:
+                        rest -= p * dist[t]
+                    d += prob[j] * rest
+                if not d<=self.MAXMASS:
+                    return None
+                if d!=dist[state]:
+                    change = max( change, abs(d-dist[state]) / max(abs(d), abs(dist[state])) )
+                dist[state] = d
+            if change<=self.DELTA:
+                break
+        else:
+            return None
+        #A divergent LM can settle on negative masses
+        if min( dist )<-self.DELTA:
+            return None
+        return [ max( d, 0.0 ) for d in dist ]
+
+    def _unigram_arcs( self, parts, sb_state, se_state ):
+        """Build the arcs for a single unigram entry."""
+        root = self.histories.ROOT
+        if self.max_order==1:
+            return self.make_arc( sb_state, sb_state, parts[1], parts[1], float(parts[0]) )
+        elif parts[1]==self.se:
+            return self.make_arc( root, se_state, self.se, self.se, parts[0] )
+        elif parts[1]==self.sb:
+            return self.make_arc( sb_state, root, self.boff, self.boff, parts[2] )
+        state  = self._state( parts[1:2] )
+        weight = "0.0"
+        if len(parts)==3: weight = parts[2]
+        return self.make_arc( state, root, self.boff, self.boff, weight ) \
+            + self.make_arc( root, state, parts[1], parts[1], parts[0] )
+
+    def _ngram_arcs( self, parts, se_state, state, child ):
+        """
+           Build the arcs for a single N-gram entry of order self.order>1.
+           History states are resolved with 'state' and 'child', which 
+           either insert missing histories or return -1 for them.  None is 
+           returned if any of the states could not be resolved.
+        """
+        order  = self.order
+        word   = parts[order]
+        istate = state( parts[1:order] )
+        if istate<0:
+            return None
+        #Handle N-grams ending in the sentence end marker
+        if word==self.se:
+            return self.make_arc( istate, se_state, word, word, parts[0] )
+        #Handle middle-order N-grams
+        if order<self.max_order:
+            ostate = child( istate, word )
+            bstate = state( parts[2:order+1] )
+            if ostate<0 or bstate<0:
+                return None
+            weight = "0.0"
+            if len(parts)==order+2: weight = parts[-1]
+            return self.make_arc( ostate, bstate, self.boff, self.boff, weight ) \
+                + self.make_arc( istate, ostate, word, word, parts[0] )
+        #Handle N-order N-grams
+        ostate = state( parts[2:order+1] )
+        if ostate<0:
+            return None
+        return self.make_arc( istate, ostate, word, word, parts[0] )
+
     def arpa2fst( self ):
         """
            Convert an arbitrary length ARPA-format n-gram LM to WFST format.
         """
 
-        arpa_ifp = open(self.arpaifile, "r")
+        readers  = [ ArpaReader( f, progress=self.progress ) for f in self.arpaifiles ]
+        if self.auto_order:
+            self.max_order = max( r.max_order for r in readers )
+        if self.exact:
+            return self._arpa2fst_exact( readers )
+        reader   = readers[0]
+        if self.quantize>0 or self.normalize:
+            self.buffer = ( array('i'), array('i'), array('i'), array('d') )
         arpa_ofp = open(self.arpaofile, "w")
-        arpa_ofp.write(self.make_arc( "<start>", self.sb, self.sb, self.sb, 0.0 ))
-        for line in arpa_ifp:
-            line = line.strip()
-            #Process based on n-gram order
-            #print self.order
-            if self.order>0 and not line=="" and not line.startswith("\\"):
-                parts = re.split(r"\s+",line)
-                #Handle unigrams
-                if self.order==1:
-                    if self.max_order==1:
-                        arpa_ofp.write( self.make_arc( self.sb, self.sb, parts[1], parts[1], float(parts[0]) ) )
-                    elif parts[1]==self.se:
-                        arpa_ofp.write( self.make_arc( self.boff, self.se, self.se, self.se, parts[0] ) )
-                        #arpa_ofp.write( self.make_arc( self.se, self.boff, self.boff, self.boff, 0.0 ) )
-                    elif parts[1]==self.sb:
-                        arpa_ofp.write( self.make_arc( self.sb, self.boff, self.boff, self.boff, parts[2] ) )
-                    else:
-                        weight = "0.0"
-                        if len(parts)==3: weight = parts[2]
-                        arpa_ofp.write( self.make_arc( parts[1], self.boff, self.boff, self.boff, weight ) )
-                        arpa_ofp.write( self.make_arc( self.boff, parts[1], parts[self.order], parts[self.order], parts[0] ) )
-                #Handle middle-order N-grams
-                elif self.order<self.max_order:
-                    if parts[self.order]==self.se:
-                        arpa_ofp.write( self.make_arc( ",".join(parts[1:self.order]), parts[self.order], parts[self.order], parts[self.order], parts[0] ) )
-                    else :
-                        weight = "0.0"
-                        if len(parts)==self.order+2: weight = parts[-1]
-                        arpa_ofp.write( self.make_arc( ",".join(parts[1:self.order+1]), ",".join(parts[2:self.order+1]), self.boff, self.boff, weight ) )
-                        arpa_ofp.write( self.make_arc( ",".join(parts[1:self.order]), ",".join(parts[1:self.order+1]), parts[self.order], parts[self.order], parts[0] ) )
-                #Handle N-order N-grams
-                elif self.order==self.max_order:
-                    if parts[self.order]==self.se:
-                        arpa_ofp.write( self.make_arc( ",".join(parts[1:self.order]), parts[self.order], parts[self.order], parts[self.order], parts[0] ) )
-                    else:
-                        arpa_ofp.write( self.make_arc( ",".join(parts[1:self.order]), ",".join(parts[2:self.order+1]), parts[self.order], parts[self.order], parts[0] ) )
-                else:
-                    pass
-            #Check the current n-gram order and other LM meta-data
-            #NOTE: NOT super robust!!!
-            if line.startswith("ngram "):
-                line = line.replace("ngram ","")
-                line = re.sub(r"=.*","", line)
-                if self.auto_order:
-                    self.max_order = int(line)
-            elif line.startswith("\\data"):
-                pass
-            elif line.startswith("\\end"):
+        sb_state = self._state( [self.sb] )
+        se_state = self._state( [self.se] )
+        arpa_ofp.write(self.make_arc( self.START, sb_state, self.sb, self.sb, 0.0 ))
+        sections = None
+        if self.jobs>1:
+            sections = reader.sections( )
+            if sections==None:
+                print "Parallel conversion requires an uncompressed ARPA file.  Using a single process."
+        for self.order, parts in reader.ngrams( self.max_order ):
+            if self.order==1:
+                self._check_word( parts[1] )
+                arpa_ofp.write( self._unigram_arcs( parts, sb_state, se_state ) )
+            elif sections:
                 break
-            elif line.startswith("\\"):
-                self.order = int(line.replace("\\","").replace("-grams:",""))
-                
-        arpa_ifp.close()
+            else:
+                arpa_ofp.write( self._ngram_arcs( parts, se_state, self._state, self._child ) )
+        if sections:
+            self._arpa2fst_parallel( reader, sections, arpa_ofp, se_state )
+        reader.close()
         if self.max_order==1:
-            arpa_ofp.write("%s\n" % self.sb)
+            final = sb_state
         else:
-            arpa_ofp.write("%s\n" % self.se)
+            final = se_state
+        if self.buffer:
+            arcs, self.buffer = self.buffer, None
+            words = [ None ] * len(self.wordids)
+            for word, wid in self.wordids.iteritems():
+                words[wid] = word
+            self._write_weighted( arpa_ofp, arcs, words, final )
+        else:
+            arpa_ofp.write("%d\n" % final)
         arpa_ofp.close()
+        self._extend_vocab( )
         return
 
-    def print_all_syms( self ):
-        """Macro to print all symbols tables."""
-        self.print_ssyms( )
-        self.print_isyms( )
-        self.print_osyms( )
+    def _write_weighted( self, arpa_ofp, arcs, words, final, ids=None, keep=None ):
+        """
+           Write in-memory arcs with log10 weights and the final state.  
+           The weights are pushed, then quantized, as requested.  
+           States are renumbered with 'ids' and arcs that touch a state
+           which is not in 'keep' are dropped.  Pushing also drops the 
+           arcs into states that cannot reach the final state.
+        """
+        src, dst, lab, wgt = arcs
+        def live( ):
+            for i in xrange( len(src) ):
+                if keep==None or ( keep[src[i]] and keep[dst[i]] ):
+                    yield i
+        fweight = 0.0
+        if self.normalize:
+            dist = self._push_weights( arcs, final, live )
+            if dist==None:
+                print "WARNING: The G potentials did not converge.  G is not normalized."
+            else:
+                keep    = [ d>0.0 for d in dist ]
+                fweight = -math.log10( dist[final] )
+        if self.quantize>0:
+            self._fit_codebooks( (wgt[i], lab[i]<0) for i in live( ) )
+        for i in live( ):
+            if lab[i]<0:
+                sym = self.boff
+            else:
+                sym = words[lab[i]]
+            if ids:
+                arpa_ofp.write( self.make_arc( ids[src[i]], ids[dst[i]], sym, sym, wgt[i] ) )
+            else:
+                arpa_ofp.write( self.make_arc( src[i], dst[i], sym, sym, wgt[i] ) )
+        if ids:
+            final = ids[final]
+        if fweight==0.0:
+            arpa_ofp.write( "%d\n" % final )
+        else:
+            arpa_ofp.write( "%d\t%f\n" % (final, self.to_tropical(fweight)) )
         return
 
-    def print_ssyms( self ):
+    def _fit_codebooks( self, weights ):
         """
-           Print out a symbols table.
+           Fit separate codebooks for the probabilities and the back-off 
+           weights.  Indexed by whether the arc is a back-off arc.
         """
-        ofp = open("%s.g.ssyms"%self.prefix,"w")
-        ofp.write("%s 0\n"%self.eps)
-        for i,sym in enumerate(self.ssyms):
-            ofp.write("%s %d\n"%(sym,i+1))
-        ofp.close()
+        self.codebooks = ( Codebook( self.quantize, self.qmethod ), Codebook( self.quantize, self.qmethod ) )
+        for weight, isboff in weights:
+            self.codebooks[isboff].add( weight )
+        for codebook in self.codebooks:
+            codebook.fit( )
+        print "Quantized G weights to %d probability and %d back-off levels." % \
+            (len(self.codebooks[0].centers), len(self.codebooks[1].centers))
+        return
+
+    def _arpa2fst_parallel( self, reader, sections, arpa_ofp, se_state ):
+        """
+           Convert the N-gram sections with order>1 in a process pool.
+           
+           Every section is split into chunks.  The history states of 
+           the middle orders are indexed order by order: the workers 
+           resolve the HistoryIndex keys of the states of their chunk
+           and the new keys are numbered in file order, as the serial
+           conversion would number them.  The chunks are then converted
+           by the workers and written back in file order.  Entries that 
+           refer to a history missing from the index are deferred and 
+           converted serially, so the result is deterministic.
+        """
+        global _shard_lm
+        orders = [ order for order in sorted(sections) if 1<order<=self.max_order ]
+        chunks = {}
+        for order in orders:
+            start, end = sections[order]
+            size = max( self.chunksize, (end-start)/(self.jobs*8) )
+            chunks[order] = [ (order,) + chunk for chunk in reader.chunks( start, end, size ) ]
+
+        _shard_lm = self
+        index = self.histories.index
+        for self.order in orders:
+            if self.order==self.max_order:
+                break
+            #Fork after the lower orders are indexed, so the workers see them
+            pool = multiprocessing.Pool( self.jobs )
+            for keys, deferred in pool.imap( _index_chunk, chunks[self.order] ):
+                start = 0
+                for pos, parts in deferred + [ (len(keys), None) ]:
+                    for key in keys[start:pos]:
+                        if key not in index:
+                            index[key] = self.histories.nstates
+                            self.histories.nstates += 1
+                    start = pos
+                    if parts:
+                        istate = self._state( parts[1:self.order] )
+                        if not parts[self.order]==self.se:
+                            self._child( istate, parts[self.order] )
+                            self._state( parts[2:self.order+1] )
+            pool.close( )
+            pool.join( )
+
+        pool = multiprocessing.Pool( self.jobs )
+        deferred = []
+        for order in orders:
+            for arcs, missing, buffer in pool.imap( _convert_chunk, chunks[order] ):
+                arpa_ofp.write( arcs )
+                deferred.extend( missing )
+                if buffer:
+                    for column, values in zip( self.buffer, buffer ):
+                        column.extend( values )
+        pool.close( )
+        pool.join( )
+        _shard_lm = None
+
+        for self.order, parts in deferred:
+            arpa_ofp.write( self._ngram_arcs( parts, se_state, self._state, self._child ) )
+        return
+
+    def _index_range( self, order, start, end ):
+        """
+           Resolve the HistoryIndex keys of the history and back-off 
+           states that the middle-order N-grams of one chunk add, in 
+           file order, without modifying the index.  Entries with a 
+           prefix that is not indexed yet are returned with the number
+           of keys that precede them, to be indexed serially in place.
+        """
+        keys     = array('l')
+        deferred = []
+        for parts in read_range( self.arpaifile, start, end ):
+            word = parts[order]
+            if word==self.se:
+                if self._find( parts[1:order] )<0:
+                    deferred.append( (len(keys), parts) )
+                continue
+            parent  = self._find( parts[1:order] )
+            bparent = self._find( parts[2:order] )
+            wid     = self.wordids.get( word, -1 )
+            if parent<0 or bparent<0 or wid<0:
+                deferred.append( (len(keys), parts) )
+            else:
+                keys.append( (parent<<32) | wid )
+                keys.append( (bparent<<32) | wid )
+        return keys, deferred
+
+    def _convert_range( self, order, start, end ):
+        """
+           Convert the N-grams of one chunk without modifying the index.
+           Returns the arcs, the list of deferred (order, fields) entries 
+           and the arcs buffered for the chunk, if arcs are buffered.
+        """
+        self.order = order
+        if self.buffer:
+            self.buffer = ( array('i'), array('i'), array('i'), array('d') )
+        se_state = self._find( [self.se] )
+        arcs     = []
+        deferred = []
+        for parts in read_range( self.arpaifile, start, end ):
+            arc = self._ngram_arcs( parts, se_state, self._find, self._lookup )
+            if arc==None:
+                deferred.append( (order, parts) )
+            else:
+                arcs.append( arc )
+        return "".join(arcs), deferred, self.buffer
+
+    def _arpa2fst_exact( self, readers ):
+        """
+           Exact construction.  Load the model into an NGramTrie, build 
+           the arcs in memory, repair missing back-off nodes and trim
+           the result before writing it.  The trie is pruned first if a
+           threshold was given.
+        """
+        if self.jobs>1:
+            print "The exact construction runs in a single process."
+        self.trie, ngrams = self._load_trie( readers )
+        if self.prune>0.0:
+            pruned, total = self.trie.prune( self.prune )
+            print "Pruned %d of %d higher order N-grams." % (pruned, total)
+        for word in self.trie.words:
+            self._check_word( word )
+            self.isyms.add(word)
+            self.osyms.add(word)
+        self._extend_vocab( )
+        self._write_arcs( self._trie_arcs( ngrams ) )
+        return
+
+    def _load_trie( self, readers ):
+        """
+           Parse the LM into an NGramTrie, or load it from the cache 
+           file if one was written for the same LM and settings.
+           Several LMs are parsed separately and interpolated.  Only 
+           their lower orders are parsed into tries, the highest order
+           sections are sorted and merged as the arcs are built, unless
+           the whole trie is needed to prune or cache it.
+           Returns the trie and the merged highest order N-grams, if 
+           they are not in the trie.
+        """
+        trie = NGramTrie( sb=self.sb )
+        if self.cache:
+            cachefile = "PREFIX.g.cache".replace("PREFIX",self.prefix)
+            key = "%s:%d:%s" % ("+".join( file_hash(f) for f in self.arpaifiles ), self.max_order, self.sb)
+            if len(self.arpaifiles)>1:
+                key += ":" + "+".join( "%g" % w for w in self.lmweights )
+            if trie.load( cachefile, key ):
+                print "Loaded the parsed LM from %s." % cachefile
+                for reader in readers: reader.close()
+                return trie, None
+        ngrams = None
+        if len(readers)==1:
+            trie.load_arpa( readers[0], self.max_order )
+        else:
+            lower = self.max_order
+            if lower>1 and not self.cache and not self.prune>0.0:
+                lower -= 1
+            models = []
+            for reader in readers:
+                model = NGramTrie( sb=self.sb )
+                model.load_arpa( reader, lower )
+                models.append( model )
+            print "Interpolating %d LMs with weights %s." % (len(models), " ".join( "%g" % w for w in self.lmweights ))
+            trie.interpolate( models, self.lmweights )
+            if lower<self.max_order:
+                sections = [ SortedSection( reader, self.max_order ) for reader in readers ]
+                ngrams   = trie.interpolate_ngrams( models, self.lmweights, sections )
+        for reader in readers: reader.close()
+        trie.max_order = self.max_order
+        if self.cache:
+            trie.save( cachefile, key )
+        return trie, ngrams
+
+    def _trie_arcs( self, ngrams=None ):
+        """
+           Build the G arcs from the trie.  Missing back-off nodes that 
+           are the prefix of a longer N-gram become states, entered with 
+           the backed-off probability and left with a zero weight back-off
+           arc.  Arcs entering any other missing history are redirected to
+           its longest existing suffix.  The 'ngrams' merged from several 
+           LMs, (history, word ID, log10 probability) triples of the 
+           highest order, are added first, as they complete the back-off 
+           weights of their histories.
+           Returns parallel arrays of source, destination, word ID and 
+           log10 weight.  Back-off arcs use the word ID -1.
+        """
+        trie = self.trie
+        root = trie.ROOT
+        src  = array('i'); dst = array('i'); lab = array('i'); wgt = array('d')
+        def add( istate, ostate, wid, weight ):
+            src.append(istate); dst.append(ostate); lab.append(wid); wgt.append(weight)
+            return
+
+        start    = trie.nstates
+        sb, se   = trie.wid(self.sb), trie.wid(self.se)
+        sb_state = trie.find( [sb] )
+        se_state = trie.find( [se] )
+        add( start, sb_state, sb, 0.0 )
+        for parent, wid, prob in ngrams or []:
+            if wid==se:
+                add( parent, se_state, se, prob )
+            else:
+                add( parent, trie.suffix_state( trie.history(parent)[1:] + [wid] ), wid, prob )
+        for node in xrange( 1, trie.nstates ):
+            prob = trie.prob[node]
+            if prob==trie.NOPROB:
+                #Repair a missing back-off node.  Enter it with the backed-off
+                # probability and leave it with a zero weight back-off arc.
+                if trie.is_state( node ):
+                    history = trie.history( node )
+                    score   = trie.score( history[:-1], history[-1] )
+                    add( node, trie.suffix_state( history[1:] ), -1, 0.0 )
+                    if not score==None:
+                        add( trie.parent[node], node, history[-1], score )
+                continue
+            wid    = trie.word[node]
+            parent = trie.parent[node]
+            order  = trie.order[node]
+            if order==1:
+                if self.max_order==1:
+                    add( sb_state, sb_state, wid, prob )
+                elif wid==se:
+                    add( root, se_state, se, prob )
+                elif wid==sb:
+                    add( sb_state, root, -1, trie.bow[node] )
+                else:
+                    add( node, root, -1, trie.bow[node] )
+                    add( root, node, wid, prob )
+                continue
+            if wid==se:
+                add( parent, se_state, se, prob )
+            elif order<self.max_order:
+                add( node, trie.suffix_state( trie.history(node)[1:] ), -1, trie.bow[node] )
+                add( parent, node, wid, prob )
+            else:
+                add( parent, trie.suffix_state( trie.history(node)[1:] ), wid, prob )
+        if self.max_order==1:
+            self.final = sb_state
+        else:
+            self.final = se_state
+        self.start = start
+        return src, dst, lab, wgt
+
+    def _connected( self, nstates, src, dst ):
+        """
+           Find the states that are both reachable from the start 
+           state and able to reach the final state.
+        """
+        def visit( begin, end, first ):
+            succ = [ [] for i in xrange(nstates) ]
+            for i in xrange( len(begin) ):
+                succ[begin[i]].append( end[i] )
+            seen  = bytearray( nstates )
+            seen[first] = 1
+            queue = [ first ]
+            while queue:
+                state = queue.pop()
+                for next in succ[state]:
+                    if not seen[next]:
+                        seen[next] = 1
+                        queue.append( next )
+            return seen
+        accessible   = visit( src, dst, self.start )
+        coaccessible = visit( dst, src, self.final )
+        return [ accessible[i] and coaccessible[i] for i in xrange(nstates) ]
+
+    def _write_arcs( self, arcs ):
+        """
+           Trim and write the in-memory arcs.  States are renumbered 
+           densely, keeping ROOT and START at their usual IDs.
+        """
+        src, dst, lab, wgt = arcs
+        nstates = self.start+1
+        keep    = self._connected( nstates, src, dst )
+        ids     = [ -1 ] * nstates
+        ids[self.trie.ROOT] = self.histories.ROOT
+        ids[self.start]     = self.START
+        next = self.START+1
+        for state in xrange( 1, self.start ):
+            if keep[state]:
+                ids[state] = next
+                next += 1
+        used    = bytearray( nstates )
+        for state in src: used[state] = 1
+        for state in dst: used[state] = 1
+        if self.progress:
+            print "Trimmed G: kept %d of %d states." % (sum(keep), sum(used))
+
+        arpa_ofp = open(self.arpaofile, "w")
+        self._write_weighted( arpa_ofp, arcs, self.trie.words, self.final, ids, keep )
+        arpa_ofp.close()
+        return
+
+    def print_all_syms( self ):
+        """Macro to print all symbols tables."""
+        self.print_isyms( )
+        self.print_osyms( )
         return
 
     def print_isyms( self ):
@@ -206,7 +865,8 @@ if __name__=="__main__":
     # /arpa2fst.py train.arpa train.fst.txt train
     example = "%s --arpa LM --eps '<eps>' --prefix test" % sys.argv[0]
     parser  = argparse.ArgumentParser( description=example )
-    parser.add_argument('--arpa',      "-a", help='ARPA format language model.', required=True )
+    parser.add_argument('--arpa',      "-a", help='ARPA format language model.  May be gzip, bzip2 or xz compressed.  Several LMs are linearly interpolated into one G.', required=True, nargs="+" )
+    parser.add_argument('--lmweights', "-w", help='Interpolation weights, one per LM given to --arpa.  Defaults to equal weights.', default=None, nargs="+", type=float )
     parser.add_argument('--prefix',    "-p", help='Prefix to be appended to all output files.', default="test" )
     parser.add_argument('--maxorder',  "-o", help='Explicitly specify the order of the output N-gram model.', default=0 )
     parser.add_argument('--eps',       "-e", help='Epsilon symbol, defaults to <eps>.', default="<eps>" )
@@ -214,9 +874,19 @@ if __name__=="__main__":
     parser.add_argument('--se',        "-l", help='Specify the sentence end marker.  Defaults to </s>.', default="</s>" )
     parser.add_argument('--boff',      "-f", help='Specify explicit backoff marker.  Defaults to None, in which case the epsilon marker is used. <f> is common.', default=None)
     parser.add_argument('--sil',       "-s", help='Specify the optional silence marker.  Defaults to <sil>.', default="<sil>" )
-    parser.add_argument('--verbose',   "-v", help='Verbose mode.', default=False, action="store_true" )
+    parser.add_argument('--jobs',      "-j", help='Convert the N-gram sections in parallel with this many processes.  Requires an uncompressed LM.  Defaults to 1.', default=1, type=int )
+    parser.add_argument('--exact',     "-x", help='Exact construction.  Repairs missing back-off nodes and trims unreachable and dead-end states.  Holds the model in memory.', default=False, action="store_true" )
+    parser.add_argument('--prune-threshold', "-t", help='Relative-entropy pruning threshold.  N-grams that raise the perplexity by less than this relative amount are pruned.  Implies --exact.  Defaults to 0, no pruning.', default=0.0, type=float )
+    parser.add_argument('--cache',     "-c", help='Save the parsed LM to PREFIX.g.cache and reuse it in later runs with the same LM and settings.  Requires --exact.', default=False, action="store_true" )
+    parser.add_argument('--quantize',  "-q", help='Quantize the probabilities and back-off weights to codebooks of this many levels.  Defaults to 0, no quantization.', default=0, type=int )
+    parser.add_argument('--qmethod',   "-m", help='Codebook fitting method for --quantize, "kmeans" or "uniform".  Defaults to "kmeans".', default="kmeans" )
+    parser.add_argument('--normalize', "-n", help='Normalize the outgoing weights of each G state in this semiring, "log" or "tropical".  Defaults to None.', default=None )
+    parser.add_argument('--verbose',   "-v", help='Verbose mode.  Also reports progress while reading the LM.', default=False, action="store_true" )
     args = parser.parse_args()
 
+    if args.cache and not (args.exact or args.prune_threshold>0.0 or len(args.arpa)>1):
+        print "--cache stores the parsed trie of the exact construction.  Please also specify --exact."
+        sys.exit()
     if args.verbose==True:
         print "Running with the following arguments:"
         for attr, value in args.__dict__.iteritems():
@@ -231,7 +901,16 @@ if __name__=="__main__":
         sil=args.sil,
         maxorder=args.maxorder,
         eps=args.eps,
-        boff=args.boff
+        boff=args.boff,
+        progress=args.verbose,
+        jobs=args.jobs,
+        exact=args.exact,
+        prune=args.prune_threshold,
+        cache=args.cache,
+        quantize=args.quantize,
+        qmethod=args.qmethod,
+        lmweights=args.lmweights,
+        normalize=args.normalize
         )
     arpa.arpa2fst( )
     arpa.print_all_syms( )
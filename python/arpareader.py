@@ -0,0 +1,277 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+import os, mmap, gzip, bz2, io, subprocess, hashlib, heapq, tempfile
+try:
+    import lzma
+except ImportError:
+    #Python 2 has no lzma module, fall back to the xz binary.
+    lzma = None
+
+class XZPipe( ):
+    """
+       An 'xz -dc' child process.  close() reaps the child and raises 
+       an IOError if xz failed, so a corrupt or truncated file cannot 
+       pass for a short LM.  A child that is stopped before the end of
+       its output is killed instead.
+    """
+    def __init__( self, filename ):
+        self.filename = filename
+        self.proc   = subprocess.Popen( ["xz", "-dc", filename], stdout=subprocess.PIPE, bufsize=1<<20 )
+        self.stdout = self.proc.stdout
+
+    def close( self ):
+        finished = self.stdout.read(1)==""
+        self.stdout.close()
+        if not finished:
+            self.proc.kill()
+            self.proc.wait()
+            return
+        if not self.proc.wait()==0:
+            raise IOError, "xz failed with exit status %d on %s" % (self.proc.returncode, self.filename)
+        return
+
+def open_arpa( filename ):
+    """
+       Open a possibly compressed ARPA file for reading.
+       Plain files are memory-mapped, .gz, .bz2 and .xz files are 
+       decompressed on the fly.  Returns a (handle, lines) pair where 
+       'lines' iterates over the raw lines of the file.
+    """
+    if filename.endswith(".gz"):
+        fp = io.BufferedReader( gzip.open(filename, "rb"), 1<<20 )
+        return fp, fp
+    elif filename.endswith(".bz2"):
+        fp = bz2.BZ2File(filename, "r", 1<<20)
+        return fp, fp
+    elif filename.endswith(".xz"):
+        if lzma:
+            fp = lzma.open(filename, "rb")
+            return fp, fp
+        fp = XZPipe( filename )
+        return fp, iter(fp.stdout.readline, "")
+    fp = open(filename, "rb")
+    if os.path.getsize(filename)==0:
+        return fp, fp
+    mm = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+    fp.close()
+    return mm, iter(mm.readline, "")
+
+def file_hash( filename, blocksize=1<<20 ):
+    """Return the MD5 hex digest of the raw bytes of a file."""
+    digest = hashlib.md5( )
+    fp = open( filename, "rb" )
+    block = fp.read( blocksize )
+    while block:
+        digest.update( block )
+        block = fp.read( blocksize )
+    fp.close()
+    return digest.hexdigest()
+
+def read_range( arpafile, start, end ):
+    """
+       Generate the split fields of every N-gram entry between the
+       byte offsets 'start' and 'end' of an uncompressed ARPA file.
+    """
+    fp = open(arpafile, "rb")
+    mm = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+    fp.close()
+    mm.seek(start)
+    while mm.tell()<end:
+        fields = mm.readline().split()
+        if fields:
+            yield fields
+    mm.close()
+    return
+
+class ArpaReader( ):
+    """
+       Shared reader for ARPA-format N-gram models.
+       
+       Reads the \\data\\ header on construction, then yields the N-gram
+       entries section by section from ngrams().  Each entry is split 
+       into its whitespace separated fields with str.split(), so that 
+       fields[0] is the log-probability, fields[1:order+1] the words, 
+       and fields[order+1] the back-off weight, if present.
+    """
+
+    def __init__( self, arpafile, progress=False ):
+        self.arpafile  = arpafile
+        self.progress  = progress
+        self.counts    = {}
+        self.max_order = 0
+        self.order     = 0
+        self.fp, self.lines = open_arpa( arpafile )
+        self._read_header( )
+
+    def _read_header( self ):
+        """Read the \\data\\ section and the N-gram counts."""
+        for line in self.lines:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0].startswith("\\"):
+                if fields[0]=="\\data\\":
+                    continue
+                self.order = self._section_order( fields[0] )
+                break
+            if fields[0]=="ngram":
+                order, count = "".join(fields[1:]).split("=")
+                self.counts[int(order)] = int(count)
+                self.max_order = max(self.max_order, int(order))
+        return
+
+    def _section_order( self, header ):
+        """Convert a section header like \\3-grams: to an order, 0 for \\end\\."""
+        if header.startswith("\\end"):
+            return 0
+        return int(header.strip("\\:").replace("-grams",""))
+
+    def _report( self, order, count ):
+        total = self.counts.get(order, 0)
+        if total>0:
+            print "Reading %d-grams: %3d%% (%d/%d)" % (order, 100*count/total, count, total)
+        return
+
+    def ngrams( self, maxorder=0 ):
+        """
+           Generate (order, fields) pairs for every N-gram entry.
+           Reading stops at the \\end\\ marker or at the header of the 
+           first section with an order greater than 'maxorder', if 
+           specified.  Another call then continues with that section.
+        """
+        if maxorder==0:
+            maxorder = self.max_order
+        if self.order==0 or self.order>maxorder:
+            return
+        count = 0
+        total = self.counts.get(self.order, 0)
+        next  = total/10 or 1
+        for line in self.lines:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0].startswith("\\"):
+                if self.progress:
+                    self._report( self.order, count )
+                self.order = self._section_order( fields[0] )
+                #Stop at the header, so a later call resumes with this section
+                if self.order==0 or self.order>maxorder:
+                    break
+                count = 0
+                total = self.counts.get(self.order, 0)
+                next  = total/10 or 1
+                continue
+            count += 1
+            if self.progress and count==next and count<total:
+                self._report( self.order, count )
+                next += total/10 or 1
+            yield self.order, fields
+        return
+
+    def sections( self ):
+        """
+           Index the N-gram sections of a memory-mapped ARPA file.
+           Returns a dict mapping each order to the (start, end) byte 
+           offsets of its entries, or None if the file is compressed.
+        """
+        if not isinstance(self.fp, mmap.mmap):
+            return None
+        sections = {}
+        for order in sorted(self.counts):
+            header = self.fp.find("\\%d-grams:" % order)
+            if header<0:
+                continue
+            start = self.fp.find("\n", header) + 1
+            end   = self.fp.find("\n\\", start)
+            if end<0:
+                end = len(self.fp)
+            sections[order] = (start, end+1)
+        return sections
+
+    def chunks( self, start, end, size ):
+        """
+           Split the byte range [start, end) into consecutive pieces 
+           of roughly 'size' bytes that begin and end on line breaks.
+        """
+        chunks = []
+        while start<end:
+            stop = self.fp.find("\n", min(start+size, end-1)) + 1
+            if stop<=0 or stop>end:
+                stop = end
+            chunks.append( (start, stop) )
+            start = stop
+        return chunks
+
+    def close( self ):
+        self.fp.close()
+        return
+
+class SortedSection( ):
+    """
+       The entries of one N-gram section of an ArpaReader, sorted by 
+       their words so that the sections of several LMs can be merged.
+       The section is read once and sorted in runs of 'runsize' entries.
+       All but the last run are spilled to temporary files, so only one
+       run is held in memory.  Iterating merges the runs and generates
+       (words, logprob) pairs, the words as a tuple of strings and the 
+       log-probability as the string read from the file.
+    """
+
+    def __init__( self, reader, order, runsize=1<<18 ):
+        self.files = []
+        self.run   = []
+        for o, fields in reader.ngrams( order ):
+            if not o==order:
+                continue
+            self.run.append( (tuple(fields[1:order+1]), fields[0]) )
+            if len(self.run)==runsize:
+                self._spill( )
+        self.run.sort( )
+
+    def _spill( self ):
+        """Sort the current run and write it to a temporary file."""
+        self.run.sort( )
+        ofp = tempfile.TemporaryFile( )
+        ofp.writelines( "%s\t%s\n" % (" ".join(words), logprob) for words, logprob in self.run )
+        self.files.append( ofp )
+        self.run = []
+        return
+
+    def _read( self, ifp ):
+        ifp.seek( 0 )
+        for line in ifp:
+            words, logprob = line.rstrip("\n").split("\t")
+            yield tuple(words.split()), logprob
+        return
+
+    def __iter__( self ):
+        if not self.files:
+            return iter( self.run )
+        return heapq.merge( iter( self.run ), *[ self._read( ifp ) for ifp in self.files ] )
@@ -29,13 +29,136 @@
 #########################################
 import re
 
+def load_contexts( ctxfile, crossword=True ):
+    """
+       Load the phone contexts printed by Lexicon.print_contexts.
+       Returns the word-initial phones, and a map from each phone to
+       the phones that can follow it.  A word-final phone can be 
+       followed by the end of the word or input, which is keyed as 
+       None, and unless 'crossword' is False by any word-initial phone.
+    """
+    initial = set([])
+    final   = set([])
+    follow  = {}
+    ctx_fp  = open(ctxfile,"r")
+    for line in ctx_fp:
+        parts = line.split()
+        if len(parts)==2 and parts[0]=="I":
+            initial.add(parts[1])
+        elif len(parts)==2 and parts[0]=="F":
+            final.add(parts[1])
+        elif len(parts)==3 and parts[0]=="B":
+            follow.setdefault(parts[1],set([])).add(parts[2])
+    ctx_fp.close()
+    for p in final:
+        follow.setdefault(p,set([])).add(None)
+        if crossword:
+            follow[p].update(initial)
+    return initial, follow
+
+def minimize_cd( fstfile ):
+    """
+       Minimize the unweighted, deterministic text format transducer in 
+       'fstfile' in place, treating each (input, output) label pair as a 
+       single label.  States are merged by Moore partition refinement: 
+       starting from the final/non-final split, states stay in the same
+       block while their labels and the blocks of their destinations 
+       agree.  Each block keeps the name of its first state in the file,
+       so the start state is still written first.
+       Reports the state and arc reduction and returns the kept state
+       names.
+    """
+    fst_fp = open(fstfile,"r")
+    ids    = {}
+    names  = []
+    arcs   = []
+    final  = []
+    labels = {}
+    for line in fst_fp:
+        parts = line.split()
+        for name in parts[:2]:
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+                arcs.append([])
+                final.append(0)
+        if len(parts)==1:
+            final[ids[parts[0]]] = 1
+        else:
+            label = labels.setdefault( (parts[2], parts[3]), len(labels) )
+            arcs[ids[parts[0]]].append( (label, ids[parts[1]]) )
+    fst_fp.close()
+    for a in arcs:
+        a.sort()
+
+    block   = final
+    nblocks = len(set(block))
+    while True:
+        sigs = {}
+        new  = [ sigs.setdefault( (block[s], tuple([ (l, block[d]) for l, d in a ])), len(sigs) )
+                 for s, a in enumerate(arcs) ]
+        if len(sigs)==nblocks:
+            break
+        block   = new
+        nblocks = len(sigs)
+
+    rep = {}
+    for s in xrange(len(names)):
+        rep.setdefault( block[s], s )
+    isym = [ None ] * len(labels)
+    for pair, label in labels.iteritems():
+        isym[label] = pair
+    kept  = []
+    narcs = 0
+    fst_fp = open(fstfile,"w")
+    for s in xrange(len(names)):
+        if not rep[block[s]]==s:
+            continue
+        kept.append(names[s])
+        lines = [ "%s %s %s %s\n" % (names[s], names[rep[block[d]]], isym[l][0], isym[l][1]) for l, d in arcs[s] ]
+        if final[s]:
+            lines.append( "%s\n" % names[s] )
+        narcs += len(arcs[s])
+        fst_fp.write( "".join(lines) )
+    fst_fp.close()
+    print "Minimized C: %d -> %d states, %d -> %d arcs." % \
+        (len(names), len(kept), sum( [ len(a) for a in arcs ] ), narcs)
+    return kept
+
+def print_auxmap( prefix, aux, auxclass ):
+    """
+       Print the side table mapping each aux symbol to the class 
+       label, one 'aux class' pair per line.
+    """
+    auxmap_fp = open( "%s.auxmap" % prefix, "w" )
+    for a in sorted(aux):
+        auxmap_fp.write("%s %s\n" % (a, auxclass))
+    auxmap_fp.close()
+    return
+
 class ContextDependency( ):
     """
     Context dependency transducer.
     Use an HTK format tiedlist to handle logical->physical triphone mapping.
     """
 
-    def __init__( self, phons, aux, tiedlist=None, start="<start>", prefix="cd", eps="<eps>", sil="sil", auxout=0 ):
+    def __init__( self, phons, aux, tiedlist=None, start="<start>", prefix="cd", eps="<eps>", sil="sil", auxout=0, contexts=None, auxclass=None, minimize=False, wordbound=None ):
+        """
+           If a 'contexts' file, as printed by Lexicon.print_contexts, is
+           given only the states and arcs for phone sequences that the
+           lexicon can produce are generated.
+           If an 'auxclass' label is given and auxout is 0, every state 
+           gets a single loop for that label instead of one loop per aux
+           symbol.  The right-hand operand of C must then have its aux 
+           symbols relabeled to the class label, see print_auxmap().
+           If 'minimize' is set, states whose outgoing arcs are identical
+           after the tiedlist mapping are merged once C is written.
+           If a 'wordbound' marker, as emitted by Lexicon, is given a
+           word-internal C is built: the marker ends the word with a 
+           right context of <eps> and resets the left context, so words
+           start with a biphone or monophone and no context crosses a 
+           word boundary.
+        """
         self.phons_f  = phons
         self.sil      = sil
         self.auxout   = auxout
@@ -44,7 +167,8 @@ class ContextDependency( ):
         self.aux_f    = aux
         self.eps      = eps
         self.prefix   = prefix
-        self.cd_ofp   = open("PREFIX.c.fst.txt".replace("PREFIX",prefix),"w")
+        self.fst_file = "PREFIX.c.fst.txt".replace("PREFIX",prefix)
+        self.cd_ofp   = open(self.fst_file,"w")
         self.start    = start
         self.ssyms    = set([])
         self.isyms    = set([])
@@ -52,6 +176,12 @@ class ContextDependency( ):
         self.osyms    = set([])
         self._mapper_arcs = set([])
         self.tiedlist = tiedlist
+        self.contexts = contexts
+        self.auxclass = None
+        if self.auxout==0:
+            self.auxclass = auxclass
+        self.minimize = minimize
+        self.wordbound = wordbound
         self.ssyms.add(self.start)
         self._load_list( self.phons_f, "phons" )
         self._load_list( self.aux_f, "aux" )
@@ -175,6 +305,9 @@ class ContextDependency( ):
         """Generate auxiliary symbol arcs."""
         issym = lp+','+rp
 
+        if self.auxclass:
+            self.cd_ofp.write("%s %s %s %s\n" % (issym, issym, self.eps, self.auxclass))
+            return
         for a in self.aux:
             if self.auxout>0:
                 self.cd_ofp.write("%s %s %s %s\n" % (issym, issym, a, a))
@@ -183,37 +316,176 @@ class ContextDependency( ):
                 self.cd_ofp.write("%s %s %s %s\n" % (issym, issym, self.eps, a))
         return
 
+    def _reachable( self, names ):
+        """
+           Return reach[l], the sorted positions in 'names' of the 
+           phones that can follow names[l].  Position 0, the epsilon, 
+           stands for the start of the input, or of the word, in 
+           reach[0] and for the end of it everywhere else.  Without a 
+           contexts file every phone can follow every other one.
+        """
+        n = len(names)
+        if self.contexts==None:
+            return [ range( 1, n ) ] + [ range( n ) for l in xrange( 1, n ) ]
+        initial, follow = load_contexts( self.contexts, crossword=self.wordbound==None )
+        pos   = dict( (p, i) for i, p in enumerate(names) if i>0 )
+        pos[None] = 0
+        reach = [ sorted( [ pos[p] for p in initial if p in pos ] ) ]
+        for lp in names[1:]:
+            reach.append( sorted( [ pos[p] for p in follow.get(lp,[]) if p in pos ] ) )
+        return reach
+
+    def _resolve_contexts( self, names, reach ):
+        """
+           Resolve the input symbol of every reachable (lp, mp, rp) 
+           context once, with the same back-off order as _check_sym.  
+           'names' holds the epsilon followed by the phones, and contexts
+           are addressed by their integer positions in it.  The pair and 
+           single phone lookups are tabled up front, so only the full 
+           triphone needs a lookup per context.  Returns table[l][m][r],
+           which is None for contexts that cannot be reached.
+        """
+        n    = len(names)
+        eps  = self.eps
+        tied = self.tied
+        single = [ tied.get(p) for p in names ]
+        lm  = [ [ tied.get(l+"-"+m) for m in names ] for l in names ]
+        mr  = [ [ tied.get(m+"+"+r) for r in names ] for m in names ]
+        lpm = [ [ tied.get(l+"+"+m) for m in names ] for l in names ]
+        mmr = [ [ tied.get(m+"-"+r) for r in names ] for m in names ]
+        table = []
+        for l in xrange( n ):
+            lrow = [ None ] * n
+            for m in reach[l]:
+                mp = names[m]
+                if m==0:
+                    continue
+                if mp==self.sil:
+                    if self.auxout>0:
+                        self._write_mapper_arc( self.sil, self.sil )
+                    lrow[m] = [ self.sil ] * n
+                    continue
+                prefix = names[l]+"-"+mp+"+"
+                row = [ None ] * n
+                for r in reach[m]:
+                    orig   = prefix+names[r]
+                    mapped = tied.get(orig)
+                    if mapped==None:
+                        mapped = lm[l][m] or mr[m][r] or lpm[l][m] or mmr[m][r] \
+                            or single[m] or single[l] or single[r] or eps
+                    if self.auxout>0:
+                        self._write_mapper_arc( mapped, orig )
+                        row[r] = orig
+                    else:
+                        row[r] = mapped
+                lrow[m] = row
+            table.append( lrow )
+        return table
+
     def generate_deterministic( self ):
         """
            Generate the context dependency transducer.
              lp: left-monophone
              mp: middle-monophone
              rp: right-monophone
+           The input symbols come from a precomputed context table, the 
+           state names are built once per phone pair and the arcs are 
+           written in one block per left phone.  Only the states and 
+           arcs for reachable phone pairs are generated.
+           In word-internal mode the final arcs read the word-boundary 
+           marker and return to the start state, which is the only 
+           final state and the only one that needs aux loops, as the 
+           aux symbols follow the marker.
         """
+        names = [ self.eps ] + list(self.phons)
+        n     = len(names)
+        reach = self._reachable( names )
+        table = self._resolve_contexts( names, reach )
+        sname = [ [ l+","+r for r in names ] for l in names ]
+        if self.auxout>0:
+            auxarcs = [ " %s %s\n" % (a, a) for a in self.aux ]
+            for a in self.aux:
+                self._write_mapper_arc( self.eps, a )
+        elif self.auxclass:
+            auxarcs = [ " %s %s\n" % (self.eps, self.auxclass) ]
+        else:
+            auxarcs = [ " %s %s\n" % (self.eps, a) for a in self.aux ]
+        def aux_loops( state ):
+            loop = state+" "+state
+            return "".join( [ loop+a for a in auxarcs ] )
+        if self.wordbound:
+            endsym = self.wordbound
+            enddst = [ self.start ] * n
+            loops  = lambda state: ""
+        else:
+            endsym = self.eps
+            enddst = [ sname[m][0] for m in xrange( n ) ]
+            loops  = aux_loops
 
-        for lp in self.phons:
-            #Initial arcs
-            self._make_arc( self.start, self.eps, lp )
-            self._make_aux( self.eps, lp )
-            #Monophone arcs
-            self._make_arc( self.eps, lp, self.eps )
-            self._make_final( lp, self.eps )
-            for mp in self.phons:
+        initial = set( reach[0] )
+        #The start state must come first, so the initial phones go first
+        order   = reach[0] + [ l for l in xrange( 1, n ) if l not in initial ]
+        for l in order:
+            lp    = names[l]
+            block = []
+            final = reach[l][:1]==[0]
+            if l in initial:
+                #Initial arcs
+                block.append( "%s %s %s %s\n" % (self.start, sname[0][l], self.eps, lp) )
+                block.append( loops( sname[0][l] ) )
+                #Monophone arcs
+                if final:
+                    block.append( "%s %s %s %s\n" % (sname[0][l], enddst[l], table[0][l][0], endsym) )
+            if final and not self.wordbound:
+                block.append( "%s\n" % sname[l][0] )
+            for m in reach[l]:
+                if m==0:
+                    continue
+                mp = names[m]
                 #Initial to Internal arcs
-                self._make_arc( self.eps, lp, mp )
+                if l in initial:
+                    block.append( "%s %s %s %s\n" % (sname[0][l], sname[l][m], table[0][l][m], mp) )
                 #Internal to Final arcs
-                self._make_arc( lp, mp, self.eps )
-                self._make_aux( lp, mp )
-                for rp in self.phons:
-                    #Internal to Internal arcs
-                    self._make_arc( lp, mp, rp )
+                if reach[m][:1]==[0]:
+                    block.append( "%s %s %s %s\n" % (sname[l][m], enddst[m], table[l][m][0], endsym) )
+                block.append( loops( sname[l][m] ) )
+                #Internal to Internal arcs
+                src = sname[l][m]+" "
+                dst = sname[m]
+                row = table[l][m]
+                block.extend( [ "%s%s %s %s\n" % (src, dst[r], row[r], names[r]) for r in reach[m] if r>0 ] )
+            self.cd_ofp.write( "".join(block) )
+        if self.wordbound:
+            self.cd_ofp.write( aux_loops( self.start ) )
+            self.cd_ofp.write( "%s\n" % self.start )
+        if self.contexts:
+            pairs = sum( [ len( [ m for m in reach[l] if m>0 ] ) for l in xrange( 1, n ) ] )
+            print "Reachable C: %d of %d phone pairs." % (pairs, (n-1)*(n-1))
+
+        self.ssyms.add( self.start+","+self.eps )
+        for l in xrange( n ):
+            for m in reach[l]:
+                if m>0 or not self.wordbound:
+                    self.ssyms.add( sname[l][m] )
+        for l in xrange( n ):
+            for m in reach[l]:
+                if m>0:
+                    self.isyms.update( [ r for r in table[l][m] if not r==None ] )
+        self.isyms.add( self.eps )
+        self.osyms.update( names )
+        if self.wordbound:
+            self.osyms.add( self.wordbound )
         for a in self.aux:
             self.osyms.add(a)
             self.isyms.add(a)
+        if self.auxclass:
+            self.osyms.add(self.auxclass)
         if self.auxout==True:
             self.mapper_ofp.write("0\n")
             self.mapper_ofp.close()
         self.cd_ofp.close()
+        if self.minimize:
+            self.ssyms = set( minimize_cd( self.fst_file ) )
         return
 
     def print_isyms( self ):
@@ -247,6 +519,8 @@ class ContextDependency( ):
         self.print_ssyms()
         self.print_isyms()
         self.print_osyms()
+        if self.auxclass:
+            print_auxmap( self.prefix, self.aux, self.auxclass )
         return
 
 if __name__=="__main__":
@@ -259,7 +533,12 @@ if __name__=="__main__":
     parser.add_argument("--tiedlist", "-t", help="Optional HTK tiedlist.", default=None)
     parser.add_argument("--eps",     "-e", help="Epsilon symbol.", default="<eps>" )
     parser.add_argument("--sil",     "-s", help="Sil token.", default="<sil>" )
+    parser.add_argument("--contexts", "-c", help="Only generate the contexts in this PREFIX.ctx file, printed by lexicon2fst.py.", default=None )
     parser.add_argument("--auxout",  "-o", help="Generate input auxiliary symbols. Set to 0, 1, or 2.", default=0, type=int )
+    parser.add_argument("--auxclass", "-x", help="Use a single loop with this class label for all aux symbols.  Writes the PREFIX.auxmap side table.  Only used with --auxout 0.", default=None )
+    parser.add_argument("--minimize", "-m", help="Merge the C states with identical outgoing arcs after the tiedlist mapping.", default=False, action="store_true" )
+    parser.add_argument("--context",  "-w", help="'cross-word' or 'word-internal' triphones.  Word-internal C expects the --wordbound marker after each pronunciation.", default="cross-word", choices=["cross-word","word-internal"] )
+    parser.add_argument("--wordbound", "-b", help="Word-boundary marker emitted by lexicon2fst.py.", default="#wb" )
     parser.add_argument("--verbose", "-v", help="Verbose mode.", default=False, action="store_true" )
     args = parser.parse_args( )
 
@@ -268,6 +547,9 @@ if __name__=="__main__":
         for attr, value in args.__dict__.iteritems():
             print attr, "=", value        
     
+    wordbound = None
+    if args.context=="word-internal":
+        wordbound = args.wordbound
     C = ContextDependency( 
         args.phons, 
         args.aux, 
@@ -275,7 +557,11 @@ if __name__=="__main__":
         prefix=args.prefix,
         eps=args.eps,
         sil=args.sil,
-        auxout=args.auxout
+        auxout=args.auxout,
+        contexts=args.contexts,
+        auxclass=args.auxclass,
+        minimize=args.minimize,
+        wordbound=wordbound
         )
     C.generate_deterministic()
     C.print_all_syms()
@@ -29,6 +29,7 @@
 #########################################
 import re
 from t3mdef import T3Mdef
+from cd2fst import load_contexts, minimize_cd, print_auxmap
 
 class ContextDependencySphinx( ):
     """
@@ -36,11 +37,23 @@ class ContextDependencySphinx( ):
     Use an HTK format tiedlist to handle logical->physical triphone mapping.
     """
 
-    def __init__( self, mdef, aux, start="<start>", prefix="cd", eps="<eps>", sil="SIL", auxout=0, minimal=True ):
+    def __init__( self, mdef, aux, start="<start>", prefix="cd", eps="<eps>", sil="SIL", auxout=0, minimal=True, contexts=None, auxclass=None, minimize=False, wordbound=None, cache=False ):
+        """
+           If a 'contexts' file, as printed by Lexicon.print_contexts, is
+           given only the states and arcs for phone sequences that the
+           lexicon can produce are generated.
+           If an 'auxclass' label is given and auxout is 0, every state 
+           gets a single loop for that label instead of one loop per aux
+           symbol.  See cd2fst.print_auxmap().
+           If 'minimize' is set, states whose outgoing arcs are identical
+           after the mdef mapping are merged once C is written.
+           If a 'wordbound' marker is given a word-internal C is built.
+           See ContextDependency.
+           If 'cache' is set the parsed mdef is kept in PREFIX.mdef.cache.
+        """
         self.sil      = sil
         self.mdef_file = mdef
         self.mdef     = None
-        self.cd_ofp   = open("PREFIX.c.fst.txt".replace("PREFIX",prefix),"w")
         self.phons    = set([])
         self.aux      = set([])
         self.aux_f    = aux
@@ -48,16 +61,28 @@ class ContextDependencySphinx( ):
         self.eps      = eps
         self.prefix   = prefix
         self.start    = start
+        self.contexts = contexts
+        self.auxclass = None
+        if self.auxout==0:
+            self.auxclass = auxclass
+        self.minimize = minimize
+        self.wordbound = wordbound
+        self.cache    = cache
         self.ssyms    = set([])
         self.isyms    = set([])
         self.osyms    = set([])
         self.tied     = {}
-        self.seen     = set([])
         self._mapper_arcs = set([])
         self.ssyms.add(self.start)
         self._load_list( self.aux_f, "aux" )
         self._load_mdef( minimal=minimal )
+        self.cd_ofp   = self._open_fst( )
         self._init_mapper( )
+
+    def _open_fst( self ):
+        """Open the text format output transducer."""
+        self.fst_file = "PREFIX.c.fst.txt".replace("PREFIX",self.prefix)
+        return open(self.fst_file,"w")
         
     def _init_mapper( self ):
         #if self.auxout==True:
@@ -82,7 +107,10 @@ class ContextDependencySphinx( ):
 
     def _load_mdef( self, minimal ):
         """Load the tiedlist.  Track the ids."""
-        self.mdef = T3Mdef( self.mdef_file )
+        cache = None
+        if self.cache:
+            cache = "PREFIX.mdef.cache".replace("PREFIX",self.prefix)
+        self.mdef = T3Mdef( self.mdef_file, cache )
         if minimal==True:
             fp = open("PREFIX.phons".replace("PREFIX",self.prefix), "r")
             for phon in fp:
@@ -91,95 +119,69 @@ class ContextDependencySphinx( ):
         else:
             for n in xrange(0,self.mdef.n_ci):
                 for pos in ['b','i','e','s']:
-                    self.phons.add(self.mdef.allfields[n][0]+"_"+pos)
+                    self.phons.add(self.mdef.name(n)+"_"+pos)
+        self.index, self.ciphones = self.mdef.context_index( )
+        self.base = {}
+        for phon in self.phons:
+            self.base[phon] = re.sub(r"_[bies]","",phon)
         return
 
-    def _check_sym_condensed( self, lp, mp, rp ):
+    def _lookup( self, lp, mp, rp ):
         """
-          Check a sym against the tiedlist.
-          Keep trying to back off to something reasonable.
-          If all else fails slot in an <eps> arc - however 
-           it is probably better to raise an error in this case.
+          Map a context to its model through the precomputed mdef index.
+          The triphone with the position of 'mp' is preferred, then any
+          other position, then the context-independent model.  If all 
+          else fails slot in an <eps> arc.
+          Returns the model and the logical name of the context.
         """
-        pos = ""
-
-        if (lp,mp,rp,pos) in self.mdef.tiedlist:
-            return lp+"-"+mp+"_"+pos+"+"+rp
-        poslist = set(['b','i','e','s'])
-        if pos: poslist.remove(pos)
-        for pos in poslist:
-            if (lp,mp,rp,pos) in self.mdef.tiedlist:
-                return lp+"-"+mp+"_"+pos+"+"+rp
-        if ('-',mp,'-','-') in self.mdef.tiedlist:
-            return mp
-        return '0'
-        
-    def _check_sym( self, lp, mp, rp ):
-    
-        lp = re.sub(r"_[bies]","",lp)
-        rp = re.sub(r"_[bies]","",rp)
+        lp = self.base.get(lp, lp)
+        rp = self.base.get(rp, rp)
         orig   = lp+"-"+mp+"+"+rp
 
-        def cmpsym( lp, mp, rp ):
-            if lp==self.start:
-                return self.eps
-            mp,pos = mp.split("_")
-            poslist = { 
-                'b':set(['i','s','e']),
-                'i':set(['b','s','e']),
-                's':set(['b','i','e']),
-                'e':set(['i','s','b'])
-                }
-            if (lp,mp,rp,pos) in self.mdef.tiedlist:
-                return lp+"-"+mp+"_"+pos+"+"+rp
-            for p in poslist[pos]:
-                if (lp,mp,rp,p) in self.mdef.tiedlist:
-                    return lp+"-"+mp+"_"+p+"+"+rp
-            if ('-',mp,'-','-') in self.mdef.tiedlist:
-                return mp
-            else:
-                return self.eps
+        if lp==self.start:
+            mapped = self.eps
+        else:
+            mapped = self.index.get((lp,mp,rp))
+            if mapped==None:
+                ci = self.base.get(mp, mp.split("_")[0])
+                if ci in self.ciphones:
+                    mapped = ci
+                else:
+                    mapped = self.eps
+        return mapped, orig
 
-        mapped = cmpsym( lp, mp, rp )
+    def _check_sym( self, lp, mp, rp ):
+        """Map a context and return the input label of its C arc."""
+        mapped, orig = self._lookup( lp, mp, rp )
         self._write_mapper_arc( mapped, orig )
         if self.auxout>0:
             return orig
             
         return mapped
 
-    def _make_condensed_arc( self, lp, mp, rp, pos=None ):
+    def _make_condensed_arc( self, lp, mp, rp, pos ):
         """
-           Generate an arc.
+           Generate an arc of the condensed transducer.
              lp: left-monophone
              mp: middle-monophone
              rp: right-monophone
+             pos: position of the middle-monophone
+           The phones carry no position, so the states only depend on
+           the context-independent phones.  The arc outputs the middle
+           phone with its position and predicts the right phone.
         """
         
         issym = lp+','+mp
         ossym = mp+','+rp
+        if lp==self.eps: 
+            issym = self.start
         self.ssyms.add(issym)
         self.ssyms.add(ossym)
-
-        if mp==self.sil: 
-            isym = self.sil
-            osym = self.sil
-            #Don't make duplicate sil arcs!
-            if (issym,ossym,self.sil) in self.seen:
-                return
-            else:
-                self.seen.add((issym,ossym,self.sil))
-        else:
-            isym = self._check_sym( lp, mp, rp, pos )
-            if pos: 
-                osym = mp+"_"+pos
-            else:   
-                osym = mp
+        osym = mp+"_"+pos
+        isym = self._check_sym( lp, osym, rp )
         self.isyms.add(isym)
         self.osyms.add(osym)
 
-        if lp==self.eps: 
-            issym = self.start
-
         self.cd_ofp.write("%s %s %s %s\n" % (issym, ossym, isym, osym))
         return
         
@@ -205,6 +207,19 @@ class ContextDependencySphinx( ):
         self.cd_ofp.write("%s %s %s %s\n" % (issym, ossym, isym, osym))
         return
 
+    def _make_boundary( self, lp, mp ):
+        """
+           Generate a word-final arc for a word-internal C.  It reads
+           the word-boundary marker and returns to the start state.
+        """
+        issym = lp+','+mp
+        self.ssyms.add(issym)
+        isym  = self._check_sym(lp, mp, self.eps)
+        self.isyms.add(isym)
+        self.osyms.add(self.wordbound)
+        self.cd_ofp.write("%s %s %s %s\n" % (issym, self.start, isym, self.wordbound))
+        return
+
     def _make_final( self, lp, rp ):
         """Make a final state."""
         fssym = lp+','+rp
@@ -214,7 +229,11 @@ class ContextDependencySphinx( ):
     def _make_aux( self, lp, rp ):
         """Generate auxiliary symbol arcs."""
         issym = lp+','+rp
+        if lp==self.start: issym = self.start
         
+        if self.auxclass:
+            self.cd_ofp.write("%s %s %s %s\n" % (issym, issym, self.eps, self.auxclass))
+            return
         for a in self.aux:
             if self.auxout>0:
                 self.cd_ofp.write("%s %s %s %s\n" % (issym, issym, a, a))
@@ -228,64 +247,121 @@ class ContextDependencySphinx( ):
 
     def generate_nondeterministic_condensed( self ):
         """
-           Generate the context dependency transducer.
+           Generate the condensed, non-deterministic context dependency 
+           transducer.
              lp: left-monophone
              mp: middle-monophone
              rp: right-monophone
              pos: position information for sphinx models
+           The states are pairs of context-independent phones and the 
+           word position only appears on the arcs, so C has about 
+           P^2 states and 4P^3 arcs rather than (4P)^2 and (4P)^3.
+           Words begin with a 'b' or 's' phone and end with an 'e' or 
+           's' phone, so the other positions skip the <eps> contexts.
+           The contexts file and the word-boundary marker are not used.
         """
-        for lp in self.phons:
-            #Monophone arcs
-            self._make_arc( self.eps, lp, self.eps )
-            self._make_final( lp, self.eps )
-            for mp in self.phons:
-                for pos in ['b','i','e','s']:
-                    #Initial to Internal arcs
-                    self._make_arc( self.eps, lp, mp, pos )
-                    #Internal to Final arcs
-                    self._make_arc( lp, mp, self.eps, pos )
+        cis = sorted(set(self.base.values()))
+        positions = dict( (ci, []) for ci in cis )
+        for phon in self.phons:
+            if not phon==self.base[phon]:
+                positions[self.base[phon]].append(phon[len(self.base[phon])+1:])
+        for lp in [self.eps] + cis:
+            for mp in cis:
+                if not lp==self.eps:
                     self._make_aux( lp, mp )
-                    for rp in self.phons:
-                        #Internal to Internal arcs
-                        self._make_arc( lp, mp, rp, pos )
-                            
-        for a in self.aux:
-            self.osyms.add(a)
-            self.isyms.add(a)
-
+                for pos in sorted(positions[mp]):
+                    if lp==self.eps and pos in "ie":
+                        continue
+                    for rp in cis:
+                        self._make_condensed_arc( lp, mp, rp, pos )
+                    if pos in "es":
+                        self._make_condensed_arc( lp, mp, self.eps, pos )
+        for mp in cis:
+            self._make_aux( mp, self.eps )
+            self._make_final( mp, self.eps )
+        self._close( )
         return
         
+    def _reachable( self ):
+        """
+           Return the phones that can start the input, and a map from
+           each phone to the phones, or the end of the input keyed as 
+           None, that can follow it.  Without a contexts file every 
+           phone can follow every other one.
+        """
+        if self.contexts==None:
+            follow = set(self.phons)
+            follow.add(None)
+            return self.phons, dict( (p, follow) for p in self.phons )
+        initial, follow = load_contexts( self.contexts, crossword=self.wordbound==None )
+        for p in self.phons:
+            follow.setdefault(p,set([]))
+        return initial, follow
+
     def generate_deterministic( self ):
         """
            Generate the context dependency transducer.
              lp: left-monophone
              mp: middle-monophone
              rp: right-monophone
+           Only the states and arcs for reachable phone pairs are generated.
+           In word-internal mode the final arcs read the word-boundary 
+           marker and return to the start state, which is then the only
+           final state and carries the aux loops.
         """
-
-        for lp in self.phons:
-            #Initial arcs
-            self._make_arc( self.start, self.eps, lp )
-            self._make_aux( self.eps, lp )
-            #Monophone arcs
-            self._make_arc( self.eps, lp, self.eps )
-            self._make_final( lp, self.eps )
+        initial, follow = self._reachable( )
+        if self.wordbound:
+            make_end = self._make_boundary
+            make_aux = lambda lp, rp: None
+        else:
+            make_end = lambda lp, mp: self._make_arc( lp, mp, self.eps )
+            make_aux = self._make_aux
+        #The start state must come first, so the initial phones go first
+        order = [ p for p in self.phons if p in initial ] + [ p for p in self.phons if p not in initial ]
+        for lp in order:
+            final = None in follow[lp]
+            if lp in initial:
+                #Initial arcs
+                self._make_arc( self.start, self.eps, lp )
+                make_aux( self.eps, lp )
+                #Monophone arcs
+                if final:
+                    make_end( self.eps, lp )
+            if final and not self.wordbound:
+                self._make_final( lp, self.eps )
             for mp in self.phons:
+                if mp not in follow[lp]:
+                    continue
                 #Initial to Internal arcs
-                self._make_arc( self.eps, lp, mp )
+                if lp in initial:
+                    self._make_arc( self.eps, lp, mp )
                 #Internal to Final arcs
-                self._make_arc( lp, mp, self.eps )
-                self._make_aux( lp, mp )
-                for rp in self.phons:
+                if None in follow[mp]:
+                    make_end( lp, mp )
+                make_aux( lp, mp )
+                for rp in follow[mp]:
                     #Internal to Internal arcs
-                    self._make_arc( lp, mp, rp )
+                    if rp in self.phons:
+                        self._make_arc( lp, mp, rp )
+        if self.wordbound:
+            self._make_aux( self.start, self.eps )
+            self.cd_ofp.write("%s\n" % self.start)
+        self._close( )
+        return
+
+    def _close( self ):
+        """Register the aux symbols and close the output files."""
         for a in self.aux:
             self.osyms.add(a)
             self.isyms.add(a)
+        if self.auxclass:
+            self.osyms.add(self.auxclass)
         if self.auxout>0:
             self.mapper_ofp.write("0\n")
             self.mapper_ofp.close()
         self.cd_ofp.close()
+        if self.minimize:
+            self.ssyms = set( minimize_cd( self.fst_file ) )
         return
 
     def print_hmmsyms( self ):
@@ -293,11 +369,8 @@ class ContextDependencySphinx( ):
         isyms_fp = open( isym_f,"w" )
         isyms_fp.write("%s %d\n" % (self.eps,0))
         cnt = 0
-        for i,fields in enumerate(self.mdef.allfields):
-            if fields[1] == "-":
-                isyms_fp.write("%s %d\n" % (fields[0], i+1))
-            else:
-                isyms_fp.write("%s-%s_%s+%s %d\n" % (fields[1], fields[0], fields[3], fields[2], i+1))
+        for i in xrange(0,self.mdef.n_phone):
+            isyms_fp.write("%s %d\n" % (self.mdef.name(i), i+1))
             cnt = i+1
         for a in self.aux:
             isyms_fp.write("%s %d\n" %(a, cnt))
@@ -337,6 +410,8 @@ class ContextDependencySphinx( ):
         self.print_isyms()
         self.print_osyms()
         self.print_hmmsyms()
+        if self.auxclass:
+            print_auxmap( self.prefix, self.aux, self.auxclass )
         return
 
 if __name__=="__main__":
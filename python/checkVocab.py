@@ -27,29 +27,19 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 #########################################
-import re
+from arpareader import ArpaReader
+from htkhmmdefs import HTKHmmdefs
 
 def make_hmmsyms( hmmdefs, eps, prefix, aux ):
-    hmm_fp = open(hmmdefs,"r")
-    hmm_ofp = open("PREFIX.hmm.syms".replace("PREFIX",prefix),"w")
-    hmm_ofp.write("EPS 0\n".replace("EPS",eps))
-    cnt = 0
-    for line in hmm_fp:
-        if not line.startswith("~h"):
-            continue
-        cnt +=1
-        line = line.strip()
-        line = re.sub(r"^~h \"","",line)
-        line = re.sub(r"\"$", "", line)
-        hmm_ofp.write("%s %d\n"%(line, cnt))
-    hmm_fp.close()
-    for a in aux:
-        cnt += 1
-        hmm_ofp.write("%s %d\n" % (a, cnt))
-    hmm_ofp.close()
+    """
+       Write PREFIX.hmm.syms from the ~h macros of an HTK hmmdefs file.
+       The macro index is kept in PREFIX.hmmdefs.idx for later builds.
+    """
+    index = HTKHmmdefs( hmmdefs, index="PREFIX.hmmdefs.idx".replace("PREFIX",prefix) )
+    index.write_hmmsyms( "PREFIX.hmm.syms".replace("PREFIX",prefix), eps=eps, aux=aux )
     return
 
-def check_arpa_vocab( arpalm, lexicon, vocabfile, lastid ):
+def check_arpa_vocab( arpalm, lexicon, vocabfile, lastid, progress=False ):
     """
        Read the unigram entries from an ARPA
        LM and check them against a pronunciation lexicon.
@@ -57,48 +47,41 @@ def check_arpa_vocab( arpalm, lexicon, vocabfile, lastid ):
        lexicon for each unigram.
     """
 
-    arpalm_fp = open(arpalm,"r")
-    unigram = False
+    reader  = ArpaReader( arpalm, progress=progress )
     missing = False
     vocab_afp = open(vocabfile,"a")
-    for line in arpalm_fp:
-        line = line.strip()
-        if line=="": continue
-        if line.startswith("\\1-grams"):
-            unigram=True
-            continue
-        if line.startswith("\\2-grams") or line.startswith("\\end"):
-            unigram=False
-            break
-        if unigram:
-            parts = re.split(r"\s+",line)
-            #Skip unk for now.
-            if parts[1] not in lexicon:
-                missing = True
-                print "WARNING: Word \"%s\" from LM file %s does not have a corresponding entry in the pronunciation dictionary!"%(parts[1],arpalm)
-                print "Adding \"%s\" to %s symbols list." %(parts[1],vocabfile)
-                vocab_afp.write("%s\t%d\n"%(parts[1],lastid))
-                lastid += 1
+    for order, parts in reader.ngrams( maxorder=1 ):
+        #Skip unk for now.
+        if parts[1] not in lexicon:
+            missing = True
+            print "WARNING: Word \"%s\" from LM file %s does not have a corresponding entry in the pronunciation dictionary!"%(parts[1],arpalm)
+            print "Adding \"%s\" to %s symbols list." %(parts[1],vocabfile)
+            vocab_afp.write("%s\t%d\n"%(parts[1],lastid))
+            lastid += 1
     vocab_afp.close()
-    arpalm_fp.close()
+    reader.close()
     return missing
 
 def load_vocab_from_lexicon( lexicon, prefix="test", eps="<eps>", failure=None ):
-    """Load vocabulary from a pronunciation lexicon."""
+    """
+       Load vocabulary from a pronunciation lexicon.  Only the set 
+       of words is kept, the pronunciations are not needed here.
+    """
     lexicon_fp = open(lexicon,"r")
     vocabfile = "%s.word.syms"%prefix
     word_ofp   = open(vocabfile, "w")
-    vocab = {}
+    vocab = set([])
     count = 1
     word_ofp.write("%s 0\n"%eps)
     for line in lexicon_fp:
-        line = line.strip()
-        pron = re.split(r"\s+",line)
-        word = pron.pop(0)
+        word = line.split(None,1)
+        if not word:
+            continue
+        word = word[0]
         if not word in vocab:
             word_ofp.write("%s\t%d\n"%(word,count))
             count += 1
-        vocab[word]=pron
+            vocab.add(word)
     if failure:
         word_ofp.write("%s\t%d\n" % (failure,count))
         count += 1
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+from collections import defaultdict
+from cd2fstSphinx import ContextDependencySphinx
+
+class HMMExpander( ):
+    """
+       File-like writer for the text format C transducer, which expands 
+       every arc whose input is an acoustic model into the 3-state HMM 
+       of that model.  The first HMM arc carries the output phone, the 
+       state sequence ends with the model's HMM aux symbol when auxout 
+       is set, and the other arcs are written as they are.  State names
+       are replaced by integers.
+    """
+
+    def __init__( self, filename, hmms, haux, eps="<eps>", auxout=0 ):
+        self.name    = filename
+        self.ofp     = open(filename,"w")
+        self.hmms    = hmms
+        self.haux    = haux
+        self.eps     = eps
+        self.auxout  = auxout
+        self.ids     = {}
+        self.nstates = 0
+        self.senones = set([])
+        self.used_haux = set([])
+
+    def _id( self, state ):
+        if state not in self.ids:
+            self.ids[state] = self.nstates
+            self.nstates += 1
+        return self.ids[state]
+
+    def write( self, text ):
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts)==1:
+                self.ofp.write("%d\n" % self._id(parts[0]))
+                continue
+            src, dst, isym, osym = parts
+            if isym not in self.hmms:
+                self.ofp.write("%d\t%d\t%s\t%s\n" % (self._id(src), self._id(dst), isym, osym))
+                continue
+            s1, s2, s3 = self.hmms[isym]
+            a = self.nstates
+            self.nstates += 3
+            last = self.eps
+            if self.auxout>0:
+                last = self.haux[isym]
+                self.used_haux.add(last)
+            self.senones.update( (s1, s2, s3) )
+            self.ofp.write( 
+                "%d\t%d\t%d\t%s\n" % (self._id(src), a, s1, osym) +
+                "%d\t%d\t%d\t%s\n" % (a, a, s1, self.eps) +
+                "%d\t%d\t%d\t%s\n" % (a, a+1, s2, self.eps) +
+                "%d\t%d\t%d\t%s\n" % (a+1, a+1, s2, self.eps) +
+                "%d\t%d\t%d\t%s\n" % (a+1, a+2, s3, self.eps) +
+                "%d\t%d\t%d\t%s\n" % (a+2, a+2, s3, self.eps) +
+                "%d\t%d\t%s\t%s\n" % (a+2, self._id(dst), last, self.eps)
+                )
+        return
+
+    def close( self ):
+        self.ofp.close()
+        return
+
+class HCSphinx( ContextDependencySphinx ):
+    """
+    Combined HMM and context dependency transducer for Sphinx models.
+    C is generated as by ContextDependencySphinx, but every model arc
+    is written out as the HMM of that model, with the same topology 
+    and symbols as hmm2wfst.mdef2wfst, so H*C is built in the single 
+    mdef pass and neither the H*C composition nor the d mapper is needed.
+    Senone N is written as input symbol N+1, and PREFIX.h.isyms gives
+    it that ID.
+    """
+
+    def _open_fst( self ):
+        """Index the model HMMs and open the expanding writer."""
+        hmms = {}
+        haux = {}
+        stateseqs = defaultdict(int)
+        for n in xrange( 0, self.mdef.n_phone ):
+            name = self.mdef.name( n )
+            hmms[name] = tuple([ i+1 for i in self.mdef.senones( n ) ])
+            stateseqs[hmms[name]] += 1
+            haux[name] = "#2000%d" % (stateseqs[hmms[name]]-1)
+        self.fst_file = "PREFIX.hc.fst.txt".replace("PREFIX",self.prefix)
+        return HMMExpander( self.fst_file, hmms, haux, eps=self.eps, auxout=self.auxout )
+
+    def _init_mapper( self ):
+        """The e mapper of hmm2wfst, which removes the aux symbols."""
+        self.mapper_ofp = None
+        if self.auxout>0:
+            self.mapper_ofp = open("PREFIX.e.fst.txt".replace("PREFIX",self.prefix),"w")
+        return
+
+    def _write_mapper_arc( self, mapped, orig ):
+        return
+
+    def _check_sym( self, lp, mp, rp ):
+        mapped, orig = self._lookup( lp, mp, rp )
+        return mapped
+
+    def _close( self ):
+        if self.auxout>0:
+            for sym in sorted(self.cd_ofp.senones):
+                self.mapper_ofp.write("0\t0\t%d\t%d\n" % (sym, sym))
+            for a in sorted(self.aux | self.cd_ofp.used_haux):
+                self.mapper_ofp.write("0\t0\t0\t%s\n" % (a))
+        ContextDependencySphinx._close( self )
+        return
+
+    def print_isyms( self ):
+        """
+           Print PREFIX.h.isyms.  Senone symbols get their own value 
+           as ID, the aux symbols follow.
+        """
+        isyms_fp = open("PREFIX.h.isyms".replace("PREFIX",self.prefix),"w")
+        isyms_fp.write("%s 0\n" % (self.eps))
+        senones = sorted(self.cd_ofp.senones)
+        for sym in senones:
+            isyms_fp.write("%d %d\n" % (sym, sym))
+        last = max( [0] + senones )
+        for i, a in enumerate(sorted(self.aux | self.cd_ofp.used_haux)):
+            isyms_fp.write("%s %d\n" % (a, last+i+1))
+        isyms_fp.close()
+        return
+
+    def print_all_syms( self ):
+        self.print_isyms()
+        self.print_osyms()
+        return
+
+if __name__=="__main__":
+    import sys
+    HC = HCSphinx( sys.argv[1], sys.argv[2], prefix=sys.argv[3] )
+    HC.generate_deterministic()
+    HC.print_all_syms()
@@ -28,6 +28,7 @@
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 #########################################
 from t3mdef import T3Mdef
+from htkhmmdefs import HTKHmmdefs
 from collections import defaultdict
 import re
 
@@ -38,7 +39,7 @@ class hmm2wfst( ):
        The format should be transparent however, looking at a 
         Sphinx AM mdef file.
     """
-    def __init__( self, hmm_file, prefix="test", amtype="sphinx", aux_file=None, eps="<eps>", auxout=0, isyms_file=None ):
+    def __init__( self, hmm_file, prefix="test", amtype="sphinx", aux_file=None, eps="<eps>", auxout=0, isyms_file=None, cache=False ):
         self.hmm_file  = hmm_file
         self.isyms_map = self._make_isym_map( isyms_file )
         self.aux       = self._read_aux( aux_file )
@@ -49,6 +50,7 @@ class hmm2wfst( ):
         self.amtype    = amtype
         self.eps       = eps
         self.mapsyms   = set([])
+        self.cache     = cache
         self.isyms     = set([a for a in self.aux])
         self.hmm_file_ofp = open( "PREFIX.h.fst.txt".replace("PREFIX",self.prefix), "w" )
 
@@ -86,22 +88,16 @@ class hmm2wfst( ):
         """Read through the tiedlist."""
         ssym = 1
 
-        self.mdef = T3Mdef( self.hmm_file )
+        self.mdef = self._load_mdef( )
 
         self._gen_aux( 0 )
 
         for n in xrange( 0, self.mdef.n_phone ):
-            hisym = ""
-            if n < self.mdef.n_ci:
-                hisym = self.mdef.allfields[n][0]
-            else:
-                hisym = self.mdef.allfields[n][1] + "-" \
-                    + self.mdef.allfields[n][0] + "_" + self.mdef.allfields[n][3] + "+" \
-                    + self.mdef.allfields[n][2]
+            hisym = self.mdef.name( n )
             if not self.isyms_map==None and hisym not in self.isyms_map:
                 continue
 
-            hmms = tuple([ int(i)+1 for i in self.mdef.allfields[n][6:9] ])
+            hmms = tuple([ i+1 for i in self.mdef.senones( n ) ])
             #state 1
             self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (
                     0,
@@ -151,16 +147,124 @@ class hmm2wfst( ):
                     0,
                     self.eps,
                     self.eps ) )
-            self.mapsyms = self.mapsyms.union(hmms)
+            self.mapsyms.update(hmms)
+            self.isyms.update(hmms)
             self.haux.add(haux)
             ssym += 4
 
-        self.isyms = self.isyms.union(self.mapsyms)
         self.hmm_file_ofp.write("0\n")
         self.hmm_file_ofp.close()
 
         return
 
+    def mdef2wfst_shared( self ):
+        """
+           Read through the tiedlist, writing one state chain per 
+           distinct senone sequence.  Each logical model enters the 
+           chain of its sequence with a 'haux:model' arc, the haux 
+           symbol telling apart the models that share the sequence.
+        """
+        ssym   = 1
+        chains = {}
+
+        self.mdef = self._load_mdef( )
+
+        self._gen_aux( 0 )
+
+        for n in xrange( 0, self.mdef.n_phone ):
+            hisym = self.mdef.name( n )
+            if not self.isyms_map==None and hisym not in self.isyms_map:
+                continue
+
+            hmms = tuple([ i+1 for i in self.mdef.senones( n ) ])
+            if hmms not in chains:
+                chains[hmms] = ssym
+                for i in xrange( 0, 3 ):
+                    self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+i, ssym+i+1, hmms[i], self.eps))
+                    self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+i+1, ssym+i+1, hmms[i], self.eps))
+                self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+3, 0, self.eps, self.eps))
+                self.mapsyms.update(hmms)
+                self.isyms.update(hmms)
+                ssym += 4
+
+            self.stateseqs[hmms] += 1
+            haux = "#2000%d"%(self.stateseqs[hmms]-1)
+            if haux not in self.haux:
+                self.haux.add(haux)
+                self.isyms.add(haux)
+            self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (0, chains[hmms], haux, hisym))
+
+        self.hmm_file_ofp.write("0\n")
+        self.hmm_file_ofp.close()
+        print "Shared H: %d chains for %d models." % (len(chains), sum(self.stateseqs.values()))
+
+        return
+
+    def hmmdefs2wfst( self, index=None ):
+        """
+           Read the models of an HTK hmmdefs file through its macro 
+           index and write a state-level H.  The arcs follow the 
+           non-zero entries of each transition matrix, including skips
+           and tee transitions.  The HMM states are numbered from 1 in
+           order of first use, and written to PREFIX.h.states.
+        """
+        ssym = 1
+        hmmdefs = HTKHmmdefs( self.hmm_file, index=index )
+        sids = {}
+
+        self._gen_aux( 0 )
+
+        for hisym in hmmdefs.hmms:
+            if not self.isyms_map==None and hisym not in self.isyms_map:
+                continue
+            states, transp = hmmdefs.hmm( hisym )
+            hmms = []
+            for state in states:
+                if state not in sids:
+                    sids[state] = len(sids)+1
+                hmms.append(sids[state])
+            hmms = tuple(hmms)
+            last = len(transp)-1
+
+            #Emitting state j of the model is H state ssym+j-1
+            for j in xrange( 1, last ):
+                if transp[0][j]>0.0:
+                    self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (0, ssym+j-1, hmms[j-1], hisym))
+                for i in xrange( 1, last ):
+                    if transp[i][j]>0.0:
+                        self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+i-1, ssym+j-1, hmms[j-1], self.eps))
+
+            self.stateseqs[hmms] += 1
+            haux = "#2000%d"%(self.stateseqs[hmms]-1)
+            self.isyms.add(haux)
+            for i in xrange( 1, last ):
+                if transp[i][last]>0.0:
+                    self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+i-1, ssym+last-1, haux, self.eps))
+            if transp[0][last]>0.0:
+                self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (0, ssym+last-1, self.eps, hisym))
+            self.hmm_file_ofp.write("%d\t%d\t%s\t%s\n" % (ssym+last-1, 0, self.eps, self.eps))
+            self.mapsyms.update(hmms)
+            self.isyms.update(hmms)
+            self.haux.add(haux)
+            ssym += last
+
+        self.hmm_file_ofp.write("0\n")
+        self.hmm_file_ofp.close()
+
+        states_ofp = open( "PREFIX.h.states".replace("PREFIX",self.prefix), "w" )
+        for state, sid in sorted( sids.iteritems(), key=lambda x: x[1] ):
+            states_ofp.write("%s %d\n" % (state, sid))
+        states_ofp.close()
+
+        return
+
+    def _load_mdef( self ):
+        """Read the mdef, through PREFIX.mdef.cache if 'cache' is set."""
+        cache = None
+        if self.cache:
+            cache = "PREFIX.mdef.cache".replace("PREFIX",self.prefix)
+        return T3Mdef( self.hmm_file, cache )
+
     def write_isyms( self ):
         """Write the input symbols table."""
 
@@ -217,12 +321,15 @@ if __name__=="__main__":
     import os, sys, argparse
     example = """./hmm2wfst.py --hmm hmm.hmm --aux aux.list --prefix test"""
     parser = argparse.ArgumentParser(description=example)
-    parser.add_argument("--hmm",     "-m", help="hmm.hmm file generated during AM conversion.", required=True )
+    parser.add_argument("--hmm",     "-m", help="hmm.hmm file generated during AM conversion.  The mdef file for 'sphinx', the hmmdefs file for 'htk'.", required=True )
+    parser.add_argument("--index",   "-x", help="Save the hmmdefs macro index to this file and reuse it while hmmdefs is unchanged.  HTK only.", default=None )
     parser.add_argument("--aux",     "-a", help="Auxiliary symbols list.", default=None )
     parser.add_argument("--prefix",  "-p", help="Filename prefix.", default="test" )
     parser.add_argument("--amtype",  "-t", help="Acoustic Model type. 'sphinx', or 'htk'.", default="sphinx" )
     parser.add_argument("--eps",     "-e", help="Epsilon symbol.", default="<eps>" )
     parser.add_argument("--isyms",   "-i", help="Input symbols for C. Used for mapping if supplied.", default=None )
+    parser.add_argument("--cache",   "-c", help="Keep the parsed mdef in PREFIX.mdef.cache and reuse it while the mdef is unchanged.  Sphinx only.", default=False, action="store_true" )
+    parser.add_argument("--shared",  "-s", help="Share one state chain between the models with the same senone sequence.", default=False, action="store_true" )
     parser.add_argument("--auxout",  "-o", help="Generate input auxiliary symbols. Set to 0, 1, or 2.", default=0, type=int )
     parser.add_argument("--verbose", "-v", help="Verbose mode.", default=False, action="store_true" )
     args = parser.parse_args( )
@@ -239,8 +346,14 @@ if __name__=="__main__":
         amtype=args.amtype,
         eps=args.eps,
         isyms_file=args.isyms,
-        auxout=args.auxout
+        auxout=args.auxout,
+        cache=args.cache
         )
-    h2w.mdef2wfst( )
+    if args.amtype=="htk":
+        h2w.hmmdefs2wfst( index=args.index )
+    elif args.shared:
+        h2w.mdef2wfst_shared( )
+    else:
+        h2w.mdef2wfst( )
     h2w.makemapper( )
     h2w.write_isyms( )
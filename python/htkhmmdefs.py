@@ -0,0 +1,184 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+import os, re, mmap
+
+class HTKHmmdefs( ):
+    """
+       Byte-offset index over the '~h', '~s' and '~t' macros of an 
+       HTK hmmdefs file.
+       
+       The macros are located with mmap.find() rather than parsed line
+       by line, skipping the macro references inside each model.  With
+       'index' set the offsets are saved to that file and reused as long
+       as the size and modification time of the hmmdefs file do not 
+       change.  Macro bodies are only parsed on request, by seeking to 
+       their offset.
+    """
+    MACROS = "hst"
+    #HTK keywords are not case sensitive
+    ENDHMM = re.compile( r"<ENDHMM>", re.I )
+
+    def __init__( self, hmmdefs, index=None ):
+        self.hmmdefs = hmmdefs
+        self.offsets = dict( (m, {}) for m in self.MACROS )
+        #The ~h names in file order, as HTK numbers the models
+        self.hmms    = []
+        self.key     = "%d:%d" % (os.path.getsize(hmmdefs), int(os.path.getmtime(hmmdefs)))
+        if index==None or not self._load_index( index ):
+            self._scan( )
+            if not index==None:
+                self._save_index( index )
+        self.tokens  = re.compile(r'"[^"]*"|\S+')
+
+    def _scan( self ):
+        """Find the offset of every macro header line."""
+        #An empty file cannot be mapped, and holds no macros anyway
+        if os.path.getsize(self.hmmdefs)==0:
+            return
+        fp = open( self.hmmdefs, "rb" )
+        mm = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+        fp.close()
+        pos = 0
+        if not mm[:1]=="~":
+            pos = mm.find("\n~")+1 or -1
+        while pos>=0:
+            end = mm.find("\n", pos)
+            if end<0:
+                end = len(mm)
+            macro = mm[pos+1:pos+2]
+            if macro in self.offsets:
+                name = mm[pos:end].split('"')[1]
+                self.offsets[macro][name] = pos
+                if macro=="h":
+                    self.hmms.append(name)
+                    #Skip the ~s and ~t references inside the model
+                    match = self.ENDHMM.search( mm, end )
+                    if match:
+                        end = match.start()
+            pos = mm.find("\n~", end-1)+1 or -1
+        mm.close()
+        return
+
+    def _load_index( self, index ):
+        """Load a saved index.  Returns False if it is missing or stale."""
+        try:
+            ifp = open( index, "r" )
+        except IOError:
+            return False
+        header = ifp.readline().split()
+        if not len(header)==3 or not header[0]=="HMMDEFSINDEX" or not header[1]==self.key:
+            ifp.close()
+            return False
+        for line in ifp:
+            macro, offset, name = line.rstrip("\n").split("\t")
+            self.offsets[macro][name] = int(offset)
+            if macro=="h":
+                self.hmms.append(name)
+        ifp.close()
+        print "Loaded the hmmdefs index from %s." % index
+        return True
+
+    def _save_index( self, index ):
+        """Write the macro offsets, ~h macros first and in file order."""
+        ofp = open( index, "w" )
+        ofp.write( "HMMDEFSINDEX %s %d\n" % (self.key, sum( len(o) for o in self.offsets.values() )) )
+        for name in self.hmms:
+            ofp.write( "h\t%d\t%s\n" % (self.offsets["h"][name], name) )
+        for macro in "st":
+            for name, offset in sorted( self.offsets[macro].iteritems(), key=lambda x: x[1] ):
+                ofp.write( "%s\t%d\t%s\n" % (macro, offset, name) )
+        ofp.close()
+        return
+
+    def _read_macro( self, macro, name ):
+        """Tokenize the body of a macro, up to the next macro header."""
+        if name not in self.offsets[macro]:
+            raise Exception("Macro ~%s \"%s\" is not defined in %s" % (macro, name, self.hmmdefs))
+        fp = open( self.hmmdefs, "rb" )
+        fp.seek( self.offsets[macro][name] )
+        lines = [ fp.readline() ]
+        for line in fp:
+            if macro=="h":
+                lines.append(line)
+                if "<ENDHMM>" in line.upper():
+                    break
+            elif line.startswith("~"):
+                break
+            else:
+                lines.append(line)
+        fp.close()
+        return self.tokens.findall( "".join(lines) )[2:]
+
+    def _transp( self, tokens, i ):
+        """Read the <TRANSP> matrix that starts at tokens[i]."""
+        n = int(tokens[i+1])
+        values = [ float(v) for v in tokens[i+2:i+2+n*n] ]
+        return [ values[r*n:(r+1)*n] for r in xrange(n) ]
+
+    def hmm( self, name ):
+        """
+           Return the states and the transition matrix of model 'name'.
+           The states are the ~s macro names of the emitting states 2..N-1,
+           with inline states named 'name[i]'.  The matrix is indexed 
+           from 0, so row 0 is the non-emitting entry state.
+        """
+        tokens = self._read_macro( "h", name )
+        states = []
+        transp = None
+        i = 0
+        while i<len(tokens):
+            tok = tokens[i].upper()
+            if tok=="<STATE>":
+                if tokens[i+2]=="~s":
+                    states.append( tokens[i+3].strip('"') )
+                else:
+                    states.append( "%s[%s]" % (name, tokens[i+1]) )
+            elif tok=="<TRANSP>":
+                transp = self._transp( tokens, i )
+            elif tokens[i]=="~t":
+                ttokens = self._read_macro( "t", tokens[i+1].strip('"') )
+                transp = self._transp( ttokens, [ t.upper() for t in ttokens ].index("<TRANSP>") )
+            elif tok=="<ENDHMM>":
+                break
+            i += 1
+        if transp==None:
+            raise Exception("Model \"%s\" has no transition matrix in %s" % (name, self.hmmdefs))
+        return states, transp
+
+    def write_hmmsyms( self, filename, eps="<eps>", aux=[] ):
+        """Write the physical model symbols, numbered in file order."""
+        ofp = open( filename, "w" )
+        ofp.write( "%s 0\n" % eps )
+        for i, name in enumerate(self.hmms):
+            ofp.write( "%s %d\n" % (name, i+1) )
+        for i, a in enumerate(aux):
+            ofp.write( "%s %d\n" % (a, len(self.hmms)+i+1) )
+        ofp.close()
+        return
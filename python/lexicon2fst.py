@@ -29,25 +29,71 @@
 #########################################
 import re, math
 from collections import defaultdict
+from arpareader import ArpaReader
+
+def load_vocab( vocabfile ):
+    """
+       Load a G vocabulary.  'vocabfile' may be an ARPA LM, possibly 
+       compressed, in which case the unigrams are used, or a symbols 
+       table such as PREFIX.word.syms, in which case the first column is.
+    """
+    vocab = set([])
+    is_arpa = vocabfile.endswith((".gz",".bz2",".xz"))
+    if not is_arpa:
+        vocab_fp = open(vocabfile,"r")
+        for line in vocab_fp:
+            if line.strip():
+                is_arpa = line.strip()=="\\data\\"
+                break
+        vocab_fp.close()
+    if is_arpa:
+        reader = ArpaReader( vocabfile )
+        for order, parts in reader.ngrams( maxorder=1 ):
+            vocab.add(parts[1])
+        reader.close()
+    else:
+        vocab_fp = open(vocabfile,"r")
+        for line in vocab_fp:
+            parts = line.split()
+            if parts:
+                vocab.add(parts[0])
+        vocab_fp.close()
+    return vocab
 
 class Lexicon( ):
 
     """Build a lexicon transducer."""
 
-    def __init__( self, dictfile, prefix="lexicon", lextype="htk", sil="<sil>", eps="<eps>", weighted=False, failure=None ):
-        """Initialize some basic variables."""
+    def __init__( self, dictfile, prefix="lexicon", lextype="htk", sil="<sil>", eps="<eps>", weighted=False, failure=None, vocab=None, auxclass=None, wordbound=None ):
+        """
+           Initialize some basic variables.  If a 'vocab' set is given,
+           only the dictionary entries for those words are used.  An
+           'auxclass' label is added to the input symbols, so that the 
+           aux symbols can later be relabeled to it.  A 'wordbound' 
+           marker is emitted after every pronunciation, before any aux
+           symbol, for a word-internal C.
+        """
         self.dictfile   = dictfile
+        self.vocab   = vocab
         self.prons   = defaultdict(int)
         self.sil     = sil
         self.eps     = eps
         self.aux     = set([])
         self.phones  = set([])
+        self.initial = set([])
+        self.final   = set([])
+        self.bigrams = set([])
         self.isyms   = set([])
         self.osyms   = set([])
         if failure:
             self.aux.add(failure)
             self.isyms.add(failure)
             self.osyms.add(failure)
+        if auxclass:
+            self.isyms.add(auxclass)
+        if wordbound:
+            self.isyms.add(wordbound)
+        self.wordbound = wordbound
         self.start   = 0
         self.last_s  = 2
         self.failure = failure
@@ -73,20 +119,16 @@ class Lexicon( ):
         pos_pron.append("%s_e"%pron[-1])
         return pos_pron
 
-    def generate_lexicon_transducer( self ):
+    def _read_entries( self ):
         """
-           Generate lexicon entries for a generic dictionary.
-           Format should be:
-           -----------------
-             WORD\tW ER D
-           -----------------
+           Read the dictionary and return a list of (word, phones, aux) 
+           entries, with the aux symbols assigned by _assign_aux.
+           Entries for words outside the vocabulary are dropped.
         """
         dict_fp = open(self.dictfile)
-        lexicon_ofp = open("PREFIX.l.fst.txt".replace("PREFIX",self.prefix),"w")
-        entries = dict_fp.readlines()
-        #The weighted lexicon is still not actually supported.
-        weight = math.log(10.0) * math.log(1./float(len(entries))) * -1
-        for entry in entries:
+        entries = []
+        skipped = 0
+        for entry in dict_fp:
             entry = entry.strip()
             phones = re.split(r"\s+",entry)
             word   = phones.pop(0)
@@ -95,35 +137,98 @@ class Lexicon( ):
             # do it himself the alternatives will be discarded
             # during the L*G composition phase.
             word   = re.sub(r"\([0-9]+\)","",word) 
+            if self.vocab!=None and word not in self.vocab:
+                skipped += 1
+                continue
             if self.lextype=="sphinx":
                 phones = self._positionalize( phones )
-            pron   = " ".join(phones)
-            
-            self.prons[pron] += 1
+            entries.append( (word, phones) )
+        dict_fp.close()
+        if skipped>0:
+            print "Skipped %d dictionary entries for words outside the vocabulary." % skipped
+        return self._assign_aux( entries )
+
+    def _assign_aux( self, entries ):
+        """
+           Assign the fewest aux symbols that keep L determinizable.
+           Only two kinds of entry need one:
+             * Homophones, which are numbered #10000, #10001, ... 
+               in dictionary order.
+             * Pronunciations that are a proper prefix of another 
+               pronunciation, which get #10000.
+           In the sorted list of distinct pronunciations a prefix is 
+           always followed by a pronunciation it is a prefix of, so one 
+           comparison per pronunciation finds them all.
+           All other entries get None.
+        """
+        for word, phones in entries:
+            self.prons[" ".join(phones)] += 1
+        prefixes = set([])
+        prons    = sorted( set( tuple(phones) for word, phones in entries ) )
+        for pron, longer in zip( prons, prons[1:] ):
+            if longer[:len(pron)]==pron:
+                prefixes.add( " ".join(pron) )
+        seen   = defaultdict(int)
+        result = []
+        for word, phones in entries:
+            pron = " ".join(phones)
+            aux_sym = None
+            if self.prons[pron]>1 or pron in prefixes:
+                aux_sym = "#1000%d"%seen[pron]
+                seen[pron] += 1
+            result.append( (word, phones, aux_sym) )
+        return result
+
+    def _add_contexts( self, phones ):
+        """
+           Record the phone contexts an entry can produce: its first and 
+           last phones, which meet other words at a word boundary, and 
+           the phone bigrams inside it.
+        """
+        self.initial.add(phones[0])
+        self.final.add(phones[-1])
+        for lp, rp in zip( phones, phones[1:] ):
+            self.bigrams.add( (lp, rp) )
+        return
+
+    def generate_lexicon_transducer( self ):
+        """
+           Generate lexicon entries for a generic dictionary.
+           Format should be:
+           -----------------
+             WORD\tW ER D
+           -----------------
+        """
+        lexicon_ofp = open("PREFIX.l.fst.txt".replace("PREFIX",self.prefix),"w")
+        entries = self._read_entries( )
+        #The weighted lexicon is still not actually supported.
+        weight = math.log(10.0) * math.log(1./float(len(entries))) * -1
+        for word, phones, aux_sym in entries:
             lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.start, self.last_s, phones[0], word))
             self.isyms.add(phones[0])
             self.phones.add(phones[0])
-            phones.pop(0)
 
             self.osyms.add(word)
-            for p in phones:
+            self._add_contexts( phones )
+            for p in phones[1:]:
                 lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.last_s, self.last_s+1, p, self.eps))
                 self.isyms.add(p)
                 self.phones.add(p)
                 self.last_s += 1
                 
-            #if self.prons[pron]>1:
-            aux_sym = "#1000%d"%(self.prons[pron]-1)
-            self.isyms.add(aux_sym)
-            self.aux.add(aux_sym)
-            lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.last_s, self.last_s+1, aux_sym, self.eps))
-            self.last_s += 1
+            if self.wordbound:
+                lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.last_s, self.last_s+1, self.wordbound, self.eps))
+                self.last_s += 1
+            if aux_sym:
+                self.isyms.add(aux_sym)
+                self.aux.add(aux_sym)
+                lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.last_s, self.last_s+1, aux_sym, self.eps))
+                self.last_s += 1
             lexicon_ofp.write("%d\n" % (self.last_s))
             self.last_s += 1
         if self.failure:
             lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.start, self.last_s, self.failure, self.failure ))
             lexicon_ofp.write("%d\n" % (self.last_s))
-        dict_fp.close()
         lexicon_ofp.close()
 
         if self.lextype=="sphinx":
@@ -131,6 +236,101 @@ class Lexicon( ):
 
         return
 
+    def generate_minimal_lexicon_transducer( self ):
+        """
+           Generate a closed, deterministic and minimal lexicon transducer 
+           in a single pass, so that neither fstclosure nor det(L) is needed.
+
+           The input strings, pronunciation plus any aux symbol, are inserted 
+           in sorted order into a trie whose equivalent suffixes are merged
+           as soon as they are complete (Daciuk et al. incremental 
+           construction).  The word is output on the first arc at which
+           the input string differs from its sorted neighbours, the 
+           earliest point where it is known, so that the rest of the 
+           entry only carries epsilon outputs and can be shared.  Every 
+           entry ends in the start state 0, which is also final.
+        """
+        entries = self._read_entries( )
+        strings = []
+        for word, phones, aux_sym in entries:
+            self.osyms.add(word)
+            self._add_contexts( phones )
+            for p in phones:
+                self.isyms.add(p)
+                self.phones.add(p)
+            if self.wordbound:
+                phones = phones + [self.wordbound]
+            if aux_sym:
+                self.isyms.add(aux_sym)
+                self.aux.add(aux_sym)
+                phones = phones + [aux_sym]
+            strings.append( (phones, word) )
+        strings.sort( )
+
+        def common( a, b ):
+            n = 0
+            for x, y in zip( a, b ):
+                if not x==y: break
+                n += 1
+            return n
+
+        #State 0 is the root, state 1 the shared final state
+        arcs     = [ [], [] ]
+        register = { (): 1 }
+        path     = [ 0 ]
+        def replace_or_register( depth ):
+            while len(path)>depth+1:
+                state  = path.pop()
+                parent = path[-1]
+                key    = tuple(arcs[state])
+                if key in register:
+                    label, child = arcs[parent][-1]
+                    arcs[parent][-1] = (label, register[key])
+                    arcs[state] = None
+                else:
+                    register[key] = state
+            return
+
+        prev = []
+        for i, (string, word) in enumerate( strings ):
+            depth  = common( prev, string )
+            unique = depth
+            if i+1<len(strings):
+                unique = max( unique, common( string, strings[i+1][0] ) )
+            replace_or_register( depth )
+            for j in xrange( depth, len(string) ):
+                label = (string[j], self.eps)
+                if j==unique: label = (string[j], word)
+                if j+1==len(string):
+                    arcs[path[-1]].append( (label, 1) )
+                else:
+                    arcs.append( [] )
+                    arcs[path[-1]].append( (label, len(arcs)-1) )
+                    path.append( len(arcs)-1 )
+            prev = string
+        replace_or_register( 0 )
+
+        #Renumber the reachable states, merging the final state into the start
+        ids   = { 0:0, 1:0 }
+        queue = [ 0 ]
+        lexicon_ofp = open("PREFIX.l.fst.txt".replace("PREFIX",self.prefix),"w")
+        for state in queue:
+            for (isym, osym), child in arcs[state]:
+                if child not in ids:
+                    ids[child] = len(ids)-1
+                    queue.append( child )
+                lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (ids[state], ids[child], isym, osym))
+        if self.failure:
+            lexicon_ofp.write("%d\t%d\t%s\t%s\n" % (self.start, self.start, self.failure, self.failure ))
+        lexicon_ofp.write("%d\n" % (self.start))
+        lexicon_ofp.close()
+        print "Minimal L: %d states for %d entries." % (len(ids)-1, len(entries))
+
+        if self.lextype=="sphinx":
+            self._add_logical_ci_phones( )
+
+        return
+
     def _add_logical_ci_phones( self ):
         """
            Add logical context-independent phones.
@@ -166,12 +366,31 @@ class Lexicon( ):
         return
             
     def print_phones( self ):
+        """Print the phones used by the generated entries."""
         phones_fp = open("%s.phons"%self.prefix,"w")
         for p in self.phones:
             phones_fp.write("%s\n"%p)
         phones_fp.close()
         return
 
+    def print_contexts( self ):
+        """
+           Print the phone contexts used by the generated entries, for
+           building a C that only covers reachable contexts.  One per line:
+             I phone    -- word-initial phone
+             F phone    -- word-final phone
+             B lp rp    -- word-internal phone bigram
+        """
+        ctx_fp = open("%s.ctx"%self.prefix,"w")
+        for p in sorted(self.initial):
+            ctx_fp.write("I %s\n"%p)
+        for p in sorted(self.final):
+            ctx_fp.write("F %s\n"%p)
+        for lp, rp in sorted(self.bigrams):
+            ctx_fp.write("B %s %s\n"%(lp, rp))
+        ctx_fp.close()
+        return
+
     def print_aux( self ):
         aux_fp = open("%s.aux"%self.prefix,"w")
         for a in self.aux:
@@ -196,6 +415,9 @@ if __name__=="__main__":
     parser.add_argument('--type',      "-t", help='"htk" or "sphinx" format output.  Sphinx format adds positional information.', default="htk" )
     parser.add_argument('--eps',       "-e", help='Epsilon symbol, defaults to <eps>.', default="<eps>" )
     parser.add_argument('--sil',       "-s", help='Specify the optional silence marker.  Defaults to <sil>.', default="<sil>" )
+    parser.add_argument('--minimal',   "-m", help='Build a closed, deterministic and minimal lexicon transducer directly.', default=False, action="store_true" )
+    parser.add_argument('--vocab',     "-g", help='Only use entries for the words of this ARPA LM or symbols table.', default=None )
+    parser.add_argument('--wordbound', "-b", help='Emit this word-boundary marker after every pronunciation, for a word-internal C.', default=None )
     parser.add_argument('--weighted',    "-w", help='The dictionary is weighted. Defaults to False.', default=False, action="store_true" )
     parser.add_argument('--verbose',   "-v", help='Verbose mode.', default=False, action="store_true" )
     args = parser.parse_args()
@@ -205,8 +427,15 @@ if __name__=="__main__":
         for attr, value in args.__dict__.iteritems():
             print attr, "=", value
     
-    L = Lexicon( args.dict, prefix=args.prefix, lextype=args.type, eps=args.eps, sil=args.sil, weighted=args.weighted )
-    L.generate_lexicon_transducer()
+    vocab = None
+    if args.vocab:
+        vocab = load_vocab( args.vocab )
+    L = Lexicon( args.dict, prefix=args.prefix, lextype=args.type, eps=args.eps, sil=args.sil, weighted=args.weighted, vocab=vocab, wordbound=args.wordbound )
+    if args.minimal:
+        L.generate_minimal_lexicon_transducer()
+    else:
+        L.generate_lexicon_transducer()
     L.print_all_syms()
     L.print_aux()
     L.print_phones()
+    L.print_contexts()
@@ -0,0 +1,496 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+import math, operator, heapq
+from array import array
+from itertools import izip, imap, repeat, groupby
+
+LN10 = math.log(10.0)
+
+def _mixture( models, weights, ngrams, known ):
+    """
+       Return the log10 of the weighted sum of the model probabilities 
+       of one N-gram, given in the word IDs of each model in 'ngrams'.
+       'known' holds the log10 probabilities already read for some of 
+       the models and None for the others, which are scored with their
+       back-off.  A model that misses the predicted word is left out and
+       the weights of the others are renormalized.
+    """
+    prob  = 0.0
+    total = 0.0
+    for model, words, weight, score in zip( models, ngrams, weights, known ):
+        if words[-1]<0:
+            continue
+        total += weight
+        if score==None:
+            score = model.score( words[:-1], words[-1] )
+        if not score==None:
+            prob += weight * 10.0**score
+    return math.log10( prob/total )
+
+class HistoryIndex( ):
+    """
+       Compact index mapping N-gram histories to dense integer state IDs.
+
+       Histories are stored as a trie encoded in a single dictionary:
+       each entry maps the pair (parent state, word ID) to the state ID
+       of the extended history.  The pair is packed into one integer key,
+       so no per-history strings or tuples are kept alive.  The empty
+       history (the back-off state) is always state ROOT.
+    """
+
+    ROOT = 0
+
+    def __init__( self, first=1 ):
+        self.index  = {}
+        self.nstates = first
+
+    def find( self, history ):
+        """
+           Return the state ID of a tuple of word IDs, 
+           or -1 if the history has not been indexed.
+        """
+        state = self.ROOT
+        for word in history:
+            state = self.index.get( (state<<32) | word, -1 )
+            if state<0:
+                return -1
+        return state
+
+    def lookup( self, parent, word ):
+        """
+           Return the state ID of history 'parent' extended by 
+           'word', or -1 if it has not been indexed.
+        """
+        return self.index.get( (parent<<32) | word, -1 )
+
+    def child( self, parent, word ):
+        """
+           Return the state ID of history 'parent' extended by 
+           'word', adding it to the index if necessary.
+        """
+        key   = (parent<<32) | word
+        state = self.index.get( key, -1 )
+        if state<0:
+            state = self.nstates
+            self.index[key] = state
+            self.nstates += 1
+        return state
+
+    def insert( self, history ):
+        """
+           Return the state ID of a tuple of word IDs, adding 
+           the history and any missing prefixes to the index.
+        """
+        state = self.ROOT
+        for word in history:
+            state = self.child( state, word )
+        return state
+
+    def __len__( self ):
+        return len(self.index)
+
+class NGramTrie( HistoryIndex ):
+    """
+       In-memory N-gram model stored as a trie over word IDs.
+
+       Every N-gram of the model is a node of the trie.  The node 
+       attributes are kept in parallel arrays indexed by node ID: the 
+       parent node, the last word, the order and the log10 probability
+       and back-off weight.  Nodes that were only created as the prefix
+       of a longer N-gram carry the NOPROB marker instead of a probability.
+    """
+
+    NOPROB = 99.0
+
+    def __init__( self, sb="<s>" ):
+        HistoryIndex.__init__( self, first=1 )
+        self.sb      = sb
+        self.words   = []
+        self.wordids = {}
+        self.parent  = array('i', [-1])
+        self.word    = array('i', [-1])
+        self.order   = array('b', [0])
+        self.prob    = array('d', [self.NOPROB])
+        self.bow     = array('d', [0.0])
+        self.max_order = 0
+
+    def wid( self, word ):
+        """Return the integer ID of a word, assigning a new one if necessary."""
+        wid = self.wordids.get(word)
+        if wid==None:
+            wid = len(self.words)
+            self.wordids[word] = wid
+            self.words.append(word)
+        return wid
+
+    def child( self, parent, word ):
+        key  = (parent<<32) | word
+        node = self.index.get( key, -1 )
+        if node<0:
+            node = self.nstates
+            self.index[key] = node
+            self.nstates += 1
+            self.parent.append( parent )
+            self.word.append( word )
+            self.order.append( self.order[parent]+1 )
+            self.prob.append( self.NOPROB )
+            self.bow.append( 0.0 )
+        return node
+
+    def add( self, words, prob, bow=0.0 ):
+        """Add an N-gram with its log10 probability and back-off weight."""
+        node = self.insert( [ self.wid(w) for w in words ] )
+        self.prob[node] = prob
+        self.bow[node]  = bow
+        if len(words)>self.max_order:
+            self.max_order = len(words)
+        return node
+
+    def load_arpa( self, reader, maxorder=0 ):
+        """Load all N-grams up to 'maxorder' from an ArpaReader."""
+        for order, parts in reader.ngrams( maxorder ):
+            bow = 0.0
+            if len(parts)==order+2: bow = float(parts[-1])
+            self.add( parts[1:order+1], float(parts[0]), bow )
+        return
+
+    def interpolate( self, models, weights, unk="<unk>" ):
+        """
+           Fill the trie with the linear interpolation of several models.
+           The N-grams of all models are merged order by order, each 
+           merged N-gram gets the weighted sum of the backed-off model 
+           probabilities, and the back-off weights are recomputed so 
+           that the mixture is normalized.
+           A word missing from a model is mapped to the 'unk' word of 
+           that model.  If the model has none, the word is predicted by
+           the other models only, with their weights renormalized.
+        """
+        for order in xrange( 1, max( m.max_order for m in models )+1 ):
+            for model in models:
+                for node in xrange( 1, model.nstates ):
+                    if not model.order[node]==order or model.prob[node]==model.NOPROB:
+                        continue
+                    node = self.insert( [ self.wid(model.words[w]) for w in model.history(node) ] )
+                    self.prob[node] = 0.0
+            self.max_order = order
+        #Map the merged word IDs to the word IDs of each model
+        wmaps = []
+        for i, model in enumerate( models ):
+            unkid = model.wordids.get(unk, -1)
+            wmap  = [ model.wordids.get(w, unkid) for w in self.words ]
+            missing = sum( 1 for w in self.words if not w in model.wordids )
+            if missing>0 and unkid<0:
+                print "WARNING: %d words are missing from LM %d, which has no %s.  The other LMs predict them." % (missing, i+1, unk)
+            elif missing>0:
+                print "WARNING: %d words are missing from LM %d.  Using its %s probability for them." % (missing, i+1, unk)
+            wmaps.append( wmap )
+        for node in xrange( 1, self.nstates ):
+            if self.prob[node]==self.NOPROB:
+                continue
+            ngram = self.history( node )
+            self.prob[node] = _mixture( models, weights, [ [ wmap[w] for w in ngram ] for wmap in wmaps ], [ None ]*len(models) )
+        self.renormalize( )
+        return
+
+    def interpolate_ngrams( self, models, weights, sections, unk="<unk>" ):
+        """
+           Interpolate the highest order, which is not held in any trie.
+           'models' hold the lower orders, which interpolate() has already
+           merged into this trie, and 'sections' the highest order entries
+           of each model as sorted (words, logprob) pairs.  The histories 
+           of those entries are added to the trie first, so the states the
+           N-grams lead to are all known, and the entries with the 'unk' 
+           word are added to their model.  Returns a generator of the 
+           merged N-grams as (history node, word ID, log10 probability) 
+           triples, which sets the back-off weights of the histories when
+           it is exhausted.
+        """
+        for model, section in zip( models, sections ):
+            for words, logprob in section:
+                self.insert( [ self.wid(w) for w in words[:-1] ] )
+                self.wid( words[-1] )
+                #The model scores the words it misses with these
+                if unk in words:
+                    model.add( words, float(logprob) )
+        return self._merge_ngrams( models, weights, sections, unk )
+
+    def _merge_ngrams( self, models, weights, sections, unk ):
+        """
+           Merge the sorted sections of all models in one pass.  Each 
+           N-gram gets the weighted sum of the explicit probabilities of 
+           the models that list it and the backed-off probabilities of 
+           the others, and is then summed into the back-off weight of 
+           its history as in renormalize().
+        """
+        unkids  = [ model.wordids.get(unk, -1) for model in models ]
+        streams = [ izip( section, repeat(i) ) for i, section in enumerate(sections) ]
+        sums    = {}
+        for words, entries in groupby( heapq.merge( *streams ), lambda entry: entry[0][0] ):
+            known = [ None ] * len(models)
+            for (w, logprob), i in entries:
+                known[i] = float(logprob)
+            ngrams = [ [ model.wordids.get(w, unkid) for w in words ] for model, unkid in zip( models, unkids ) ]
+            prob   = _mixture( models, weights, ngrams, known )
+            ids    = [ self.wordids[w] for w in words ]
+            node   = self.find( ids[:-1] )
+            numer, denom = sums.get( node, (1.0, 1.0) )
+            numer -= 10.0**prob
+            score  = self.score( ids[1:-1], ids[-1] )
+            if not score==None:
+                denom -= 10.0**score
+            sums[node] = (numer, denom)
+            yield node, ids[-1], prob
+        for node, (numer, denom) in sums.iteritems():
+            if self.prob[node]==self.NOPROB or numer<=0.0 or denom<=0.0:
+                continue
+            self.bow[node] = math.log10( numer/denom )
+        return
+
+    def save( self, filename, key="" ):
+        """
+           Write the trie to a binary cache file.  A one line header 
+           carries the 'key', the sizes and the order, followed by the 
+           word list and the raw node arrays.
+        """
+        ofp = open( filename, "wb" )
+        ofp.write( "NGRAMTRIE2 %s %d %d %d\n" % (key, self.nstates, len(self.words), self.max_order) )
+        ofp.write( "".join( w+"\n" for w in self.words ) )
+        for column in (self.parent, self.word, self.order, self.prob, self.bow):
+            column.tofile( ofp )
+        ofp.close()
+        return
+
+    def load( self, filename, key="" ):
+        """
+           Load a trie written by save().  Returns False, leaving the 
+           trie untouched, if the file does not exist or was written
+           with a different 'key'.
+        """
+        try:
+            ifp = open( filename, "rb" )
+        except IOError:
+            return False
+        header = ifp.readline().split()
+        if not len(header)==5 or not header[0]=="NGRAMTRIE2" or not header[1]==key:
+            ifp.close()
+            return False
+        nstates, nwords, max_order = [ int(f) for f in header[2:] ]
+        words = [ ifp.readline().rstrip("\n") for i in xrange(nwords) ]
+        columns = []
+        try:
+            for column in (self.parent, self.word, self.order, self.prob, self.bow):
+                column = array( column.typecode )
+                column.fromfile( ifp, nstates )
+                columns.append( column )
+        except EOFError:
+            ifp.close()
+            return False
+        ifp.close()
+        self.parent, self.word, self.order, self.prob, self.bow = columns
+        self.words     = words
+        self.wordids   = dict( izip( words, xrange(nwords) ) )
+        self.nstates   = nstates
+        self.max_order = max_order
+        #Rebuild the (parent,word) index without a Python level loop
+        keys = imap( operator.or_, imap( operator.lshift, self.parent, repeat(32) ), self.word )
+        keys.next()
+        self.index = dict( izip( keys, xrange(1, nstates) ) )
+        return True
+
+    def history( self, node ):
+        """Return the word IDs of the N-gram represented by a node."""
+        words = []
+        while node>self.ROOT:
+            words.append( self.word[node] )
+            node = self.parent[node]
+        words.reverse()
+        return words
+
+    def is_state( self, node ):
+        """
+           True if the node may act as a G history state.  This includes
+           missing back-off nodes that were only created as a prefix.
+        """
+        return node>=0 and 0<=self.order[node]<self.max_order
+
+    def suffix_state( self, history ):
+        """
+           Return the longest suffix of a list of word IDs 
+           that exists as a history state.  This is the state to 
+           back off to when the history itself is missing.
+        """
+        for i in xrange( len(history) ):
+            node = self.find( history[i:] )
+            if node>=0 and self.is_state( node ):
+                return node
+        return self.ROOT
+
+    def score( self, history, word ):
+        """
+           Return the log10 probability of a word ID following a list
+           of word IDs, backing off through shorter histories as needed.
+           Missing histories have a back-off weight of 0.0.  Returns None
+           if the model has no probability for the word at all.
+        """
+        weight = 0.0
+        for i in xrange( len(history)+1 ):
+            state = self.find( history[i:] )
+            if state<0:
+                continue
+            node = self.lookup( state, word )
+            if node>=0 and not self.prob[node]==self.NOPROB:
+                return weight + self.prob[node]
+            weight += self.bow[state]
+        return None
+
+    def children( self ):
+        """
+           Group the nodes by parent.  Returns (first, kids) arrays such 
+           that the children of node n are kids[first[n]:first[n+1]].
+        """
+        first = array('i', [0]) * (self.nstates+1)
+        for node in xrange( 1, self.nstates ):
+            first[self.parent[node]+1] += 1
+        for node in xrange( self.nstates ):
+            first[node+1] += first[node]
+        fill = array('i', first)
+        kids = array('i', [0]) * (self.nstates-1)
+        for node in xrange( 1, self.nstates ):
+            parent = self.parent[node]
+            kids[fill[parent]] = node
+            fill[parent] += 1
+        return first, kids
+
+    def remove( self, node ):
+        """Remove a node from the index.  An order of -1 marks it as removed."""
+        del self.index[ (self.parent[node]<<32) | self.word[node] ]
+        self.order[node] = -1
+        self.prob[node]  = self.NOPROB
+        return
+
+    def history_prob( self, history ):
+        """
+           Return the natural log probability of a list of word IDs 
+           under the model.  A leading <s> is treated as certain.  
+           Returns None if a word has no probability.
+        """
+        logprob = 0.0
+        for i in xrange( len(history) ):
+            if i==0 and self.words[history[0]]==self.sb:
+                continue
+            score = self.score( history[:i], history[i] )
+            if score==None:
+                return None
+            logprob += score
+        return logprob * LN10
+
+    def prune( self, threshold ):
+        """
+           Relative-entropy (Stolcke) pruning.
+
+           Histories are visited from the highest order down, and each 
+           N-gram that is not itself the history of a surviving higher 
+           order N-gram is removed if doing so increases the perplexity 
+           of the model by a relative amount less than 'threshold'.  All 
+           N-grams of a history are judged against the unpruned model.  
+           The back-off weights are renormalized afterwards.
+        """
+        first, kids = self.children( )
+        alive = lambda node: self.order[node]>0 and not self.prob[node]==self.NOPROB
+        total = 0; pruned = 0
+        for order in xrange( self.max_order, 1, -1 ):
+            for h in xrange( 1, self.nstates ):
+                if not self.order[h]==order-1:
+                    continue
+                history = self.history( h )
+                cands   = []
+                numer   = 1.0; denom = 1.0
+                for c in kids[first[h]:first[h+1]]:
+                    if not alive( c ):
+                        continue
+                    total += 1
+                    p = 10.0**self.prob[c]
+                    q = self.score( history[1:], self.word[c] )
+                    numer -= p
+                    if q==None:
+                        #There is nothing to back off to, so c stays
+                        continue
+                    q = 10.0**q
+                    denom -= q
+                    #N-grams that are the history of a longer N-gram stay
+                    if any( self.order[g]>0 for g in kids[first[c]:first[c+1]] ):
+                        continue
+                    cands.append( (c, p, q) )
+                if not cands or numer<=0.0 or denom<=0.0:
+                    continue
+                hprob = self.history_prob( history )
+                if hprob==None:
+                    continue
+                hprob = math.exp( hprob )
+                bow   = self.bow[h]*LN10
+                for c, p, q in cands:
+                    newbow = math.log( (numer+p) / (denom+q) )
+                    delta  = -hprob * ( p*( math.log(q) + newbow - math.log(p) ) + numer*( newbow - bow ) )
+                    if math.exp( delta ) - 1.0 < threshold:
+                        self.remove( c )
+                        pruned += 1
+        #Drop missing back-off nodes that no longer prefix any N-gram
+        for node in xrange( self.nstates-1, 0, -1 ):
+            if self.order[node]>0 and self.prob[node]==self.NOPROB \
+                    and not any( self.order[g]>0 for g in kids[first[node]:first[node+1]] ):
+                self.remove( node )
+        self.renormalize( first, kids )
+        return pruned, total
+
+    def renormalize( self, first=None, kids=None ):
+        """
+           Recompute the back-off weight of every history so that the 
+           backed-off distribution sums to one.  Lower orders are handled
+           first, as the higher order weights depend on them.
+        """
+        if first==None:
+            first, kids = self.children( )
+        for order in xrange( 1, self.max_order ):
+            for h in xrange( 1, self.nstates ):
+                if not self.order[h]==order or self.prob[h]==self.NOPROB:
+                    continue
+                history = self.history( h )
+                numer = 1.0; denom = 1.0
+                for c in kids[first[h]:first[h+1]]:
+                    if self.order[c]<0 or self.prob[c]==self.NOPROB:
+                        continue
+                    numer -= 10.0**self.prob[c]
+                    score  = self.score( history[1:], self.word[c] )
+                    if not score==None:
+                        denom -= 10.0**score
+                if numer<=0.0 or denom<=0.0:
+                    continue
+                self.bow[h] = math.log10( numer/denom )
+        return
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+#########################################
+# Copyright (c) [2010-2011], Josef Robert Novak
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+#  modification, are permitted #provided that the following conditions
+#  are met:
+#
+# * Redistributions of source code must retain the above copyright 
+#    notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above 
+#    copyright notice, this list of #conditions and the following 
+#    disclaimer in the documentation and/or other materials provided 
+#    with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS 
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE 
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, 
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES 
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, 
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED 
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#########################################
+from bisect import bisect, bisect_left
+
+class Codebook( ):
+    """
+       Scalar codebook for log10 LM weights.
+
+       Values are collected in a histogram with a fixed 'resolution', 
+       then 'levels' centers are fit either by k-means (Lloyd's algorithm
+       run on the histogram) or by uniform binning of the value range.
+       The value 0.0 is never quantized.  It is the weight of certain 
+       arcs and of default back-off arcs, and is left exact.
+    """
+
+    def __init__( self, levels=256, method="kmeans", resolution=1e-4 ):
+        if method not in ("kmeans","uniform"):
+            raise ValueError, "Unknown quantization method: %s" % method
+        self.levels     = int(levels)
+        self.method     = method
+        self.resolution = resolution
+        self.counts     = {}
+        self.centers    = []
+        self.bounds     = []
+
+    def add( self, value ):
+        """Add a value to the histogram."""
+        if value==0.0:
+            return
+        key = int(round(value/self.resolution))
+        self.counts[key] = self.counts.get(key,0) + 1
+        return
+
+    def fit( self ):
+        """Fit the codebook centers to the histogram."""
+        keys = sorted(self.counts)
+        if len(keys)==0:
+            return
+        points = [ k*self.resolution for k in keys ]
+        if len(points)<=self.levels:
+            self._set_centers( points )
+        elif self.method=="uniform":
+            step = (points[-1]-points[0])/self.levels
+            self._set_centers( [ points[0]+(i+0.5)*step for i in xrange(self.levels) ] )
+        else:
+            self._set_centers( self._kmeans( points, [ self.counts[k] for k in keys ] ) )
+        return
+
+    def _kmeans( self, points, counts, iterations=50 ):
+        """
+           Weighted 1-D k-means.  Clusters are contiguous ranges of the 
+           sorted points, so each update only needs the cluster boundaries
+           and prefix sums over the histogram.
+        """
+        mass = [0]; moment = [0.0]
+        for p, c in zip( points, counts ):
+            mass.append( mass[-1]+c )
+            moment.append( moment[-1]+p*c )
+        total = mass[-1]
+        #Start from the quantiles of the histogram
+        centers = []
+        for i in xrange( self.levels ):
+            j = bisect_left( mass, (i+0.5)*total/self.levels ) - 1
+            centers.append( points[max(j,0)] )
+        for it in xrange( iterations ):
+            #Equal quantiles collapse into a single center
+            self._set_centers( centers )
+            centers = self.centers
+            cuts = [0] + [ bisect( points, b ) for b in self.bounds ] + [len(points)]
+            update = []
+            for i in xrange( len(centers) ):
+                n = mass[cuts[i+1]] - mass[cuts[i]]
+                if n>0:
+                    update.append( (moment[cuts[i+1]] - moment[cuts[i]]) / n )
+                else:
+                    update.append( centers[i] )
+            if update==centers:
+                break
+            centers = update
+        return centers
+
+    def _set_centers( self, centers ):
+        self.centers = sorted(set(centers))
+        self.bounds  = [ (a+b)/2.0 for a, b in zip(self.centers, self.centers[1:]) ]
+        return
+
+    def quantize( self, value ):
+        """Return the codebook center closest to 'value'."""
+        if value==0.0 or len(self.centers)==0:
+            return value
+        return self.centers[ bisect( self.bounds, value ) ]
@@ -68,23 +68,27 @@ class Silclass( ):
         return tropval 
 
     def generate_silclass( self ):
-        """Generate the silence class transducer."""
-        count = 1
+        """
+           Generate the silence class transducer.  Every word leads 
+           from the word-loop state 0 to the shared optional-silence 
+           state 1, which returns to 0 with or without silence, so T 
+           has two states whatever the vocabulary size.
+        """
         silclass_fp = open("PREFIX.t.fst.txt".replace("PREFIX",self.prefix),"w")
-        for word in self.vocab:
-            if word==self.sil or word==self.sentb or word==self.sente or word==self.failure:
-                continue
-            silclass_fp.write("%d %d %s %s\n" % (0, count, word, word))
-            silclass_fp.write("%d %d %s %s %f\n" % (count, count, self.eps, self.sil, self.log2tropical(self.silperc)))
-            silclass_fp.write("%d %d %s %s %f\n" % (count, 0, self.eps, self.eps, self.log2tropical(self.nosilperc)))
-            self.isyms.add(word)
-            self.osyms.add(word)
-            count += 1
+        #State 0 comes first, fstcompile takes it as the start state
         silclass_fp.write("0 0 %s %s\n" % (self.sentb, self.sentb))
         silclass_fp.write("0 0 %s %s\n" % (self.sente, self.sente))
         silclass_fp.write("0 0 %s %s\n" % (self.sil, self.sil))
         if self.failure:
             silclass_fp.write("0 0 %s %s\n" % (self.failure, self.failure))
+        for word in self.vocab:
+            if word==self.sil or word==self.sentb or word==self.sente or word==self.failure:
+                continue
+            silclass_fp.write("%d %d %s %s\n" % (0, 1, word, word))
+            self.isyms.add(word)
+            self.osyms.add(word)
+        silclass_fp.write("%d %d %s %s %f\n" % (1, 1, self.eps, self.sil, self.log2tropical(self.silperc)))
+        silclass_fp.write("%d %d %s %s %f\n" % (1, 0, self.eps, self.eps, self.log2tropical(self.nosilperc)))
         silclass_fp.write("0\n")
         silclass_fp.close()
         return
@@ -13,22 +13,77 @@ MODIFIED on 12-22-2010 by Josef Novak
 Added an array of mdef lines for easier processing,
 self.allfields = []
 Probably a better way to do this but I can't tell from the code.
+
+MODIFIED to store the mdef lines as integer columns over interned
+symbols, with an optional binary cache.  allfields and tiedlist are
+kept as read-only views over the columns.
 """
 
 __author__ = "Josef Robert Novak <novakj@gavo.t.u-tokyo.ac.jp>"
 __version__ = "$Revision: $"
 
-#from numpy import ones, empty
+from array import array
+from itertools import izip
+from arpareader import file_hash
+
+def open(file, cache=None):
+    return T3Mdef(file, cache)
+
+class _Rows:
+    "The mdef lines as lists of strings, built on access."
+    def __init__(self, mdef):
+        self.mdef = mdef
+
+    def __len__(self):
+        return self.mdef.n_phone
+
+    def __getitem__(self, n):
+        return self.mdef.fields(n)
+
+    def __iter__(self):
+        for n in xrange(self.mdef.n_phone):
+            yield self.mdef.fields(n)
+
+class _TiedList:
+    "Map (lp, mp, rp, pos) to the 1-based mdef line of the model."
+    def __init__(self, mdef):
+        self.mdef = mdef
 
-def open(file):
-    return T3Mdef(file)
+    def __len__(self):
+        return len(self.mdef.index)
+
+    def __contains__(self, triphone):
+        return self.mdef.lookup(*triphone) >= 0
+
+    def __getitem__(self, triphone):
+        n = self.mdef.lookup(*triphone)
+        if n < 0:
+            raise KeyError(triphone)
+        return n + 1
+
+    def __iter__(self):
+        m = self.mdef
+        for n in xrange(m.n_phone):
+            yield (m.symbols[m.left[n]], m.symbols[m.base[n]],
+                   m.symbols[m.right[n]], m.symbols[m.pos[n]])
 
 class T3Mdef:
     "Read Sphinx-III format model definition files as required by tcubed"
-    def __init__(self, filename):
+    COLUMNS = ("base", "left", "right", "pos", "attrib", "tmat", "states")
+
+    def __init__(self, filename, cache=None):
         self.info = {}
         if filename != None:
-            self.read(filename)
+            key = None
+            if cache != None:
+                key = file_hash(filename)
+            if key == None or not self.load(cache, key):
+                self.read(filename)
+                if key != None:
+                    self.save(cache, key)
+            self._make_index()
+        self.allfields = _Rows(self)
+        self.tiedlist = _TiedList(self)
 
     def read(self, filename):
         self.fh = file(filename)
@@ -52,19 +107,149 @@ class T3Mdef:
         self.n_ci_sen = info['n_tied_ci_state']
         self.n_sen = info['n_tied_state']
         self.n_tmat = info['n_tied_tmat']
-        self.tiedlist = {}
         # Skip field description lines
         spam = self.fh.readline().rstrip()
         spam = self.fh.readline().rstrip()
-        
+
         #tcubed doesn't require much mdef organization. we just want the mdef lines
-        self.allfields = []
-        while True:
-            spam = self.fh.readline().rstrip()
-            if spam == "":
+        self.symbols = []
+        self.symids = {}
+        for name in self.COLUMNS:
+            setattr(self, name, array('i'))
+        self.n_emit = 0
+        done = False
+        while not done:
+            # Fill the columns a block of lines at a time, up to a blank line
+            rows = [spam.split() for spam in self.fh.readlines(1 << 20)]
+            done = not rows or [] in rows
+            if [] in rows:
+                rows = rows[:rows.index([])]
+            if not rows:
                 break
-            fields = spam.split()
-            self.allfields.append(fields)
-            triphone = (fields[1],fields[0], fields[2], fields[3])
-            self.tiedlist[triphone] = len(self.allfields)
-            
+            self.n_emit = len(rows[0]) - 7
+            fields = zip(*rows)
+            for name, column in izip(self.COLUMNS[:5], fields):
+                for sym in set(column).difference(self.symids):
+                    self._intern(sym)
+                getattr(self, name).extend(map(self.symids.__getitem__, column))
+            self.tmat.extend(map(int, fields[5]))
+            self.states.extend(map(int, [i for row in rows for i in row[6:-1]]))
+        self.fh.close()
+        self.n_phone = len(self.base)
+
+    def _intern(self, sym):
+        if sym not in self.symids:
+            self.symids[sym] = len(self.symbols)
+            self.symbols.append(sym)
+        return self.symids[sym]
+
+    def _make_index(self):
+        """Hash the packed (lp, mp, rp, pos) symbol IDs of every line."""
+        self.index = {}
+        for n in xrange(self.n_phone):
+            self.index[self._key(self.left[n], self.base[n],
+                                 self.right[n], self.pos[n])] = n
+
+    def _key(self, lp, mp, rp, pos):
+        s = len(self.symbols)
+        return ((lp * s + mp) * s + rp) * s + pos
+
+    def save(self, filename, key=""):
+        """Write the columns to a binary cache file.
+
+        A one line header carries the 'key', the sizes and the model
+        counts, followed by the symbol list and the raw columns.
+        """
+        ofp = file(filename, "wb")
+        ofp.write("T3MDEF %s %d %d %d %d %d %d %d\n" % (
+            key, self.n_phone, len(self.symbols), self.n_emit,
+            self.n_ci, self.n_ci_sen, self.n_sen, self.n_tmat))
+        ofp.write("".join(s + "\n" for s in self.symbols))
+        for name in self.COLUMNS:
+            getattr(self, name).tofile(ofp)
+        ofp.close()
+
+    def load(self, filename, key=""):
+        """Load the columns written by save().
+
+        Returns False if the file does not exist or was written for an
+        mdef file with a different 'key'.
+        """
+        try:
+            ifp = file(filename, "rb")
+        except IOError:
+            return False
+        header = ifp.readline().split()
+        if len(header) != 9 or header[0] != "T3MDEF" or header[1] != key:
+            ifp.close()
+            return False
+        n_phone, n_sym, self.n_emit, self.n_ci, self.n_ci_sen, \
+            self.n_sen, self.n_tmat = [int(f) for f in header[2:]]
+        self.symbols = [ifp.readline().rstrip("\n") for i in xrange(n_sym)]
+        self.symids = dict(izip(self.symbols, xrange(n_sym)))
+        try:
+            for name in self.COLUMNS:
+                column = array('i')
+                column.fromfile(ifp, n_phone * (self.n_emit if name == "states" else 1))
+                setattr(self, name, column)
+        except EOFError:
+            ifp.close()
+            return False
+        ifp.close()
+        self.n_phone = n_phone
+        self.n_tri = n_phone - self.n_ci
+        return True
+
+    def fields(self, n):
+        """The fields of mdef line 'n' as strings, as they were read."""
+        s = self.symbols
+        return [s[self.base[n]], s[self.left[n]], s[self.right[n]],
+                s[self.pos[n]], s[self.attrib[n]], str(self.tmat[n])] \
+            + [str(i) for i in self.senones(n)] + ["N"]
+
+    def senones(self, n):
+        """The senone IDs of the states of mdef line 'n'."""
+        return tuple(self.states[n * self.n_emit:(n + 1) * self.n_emit])
+
+    def name(self, n):
+        """The model name of mdef line 'n', 'lp-mp_pos+rp' for triphones."""
+        s = self.symbols
+        if n < self.n_ci:
+            return s[self.base[n]]
+        return "%s-%s_%s+%s" % (s[self.left[n]], s[self.base[n]],
+                                s[self.pos[n]], s[self.right[n]])
+
+    def lookup(self, lp, mp, rp, pos):
+        """The 0-based mdef line of a context, or -1 if it has none."""
+        ids = self.symids
+        if lp not in ids or mp not in ids or rp not in ids or pos not in ids:
+            return -1
+        return self.index.get(self._key(ids[lp], ids[mp], ids[rp], ids[pos]), -1)
+
+    def context_index(self):
+        """Index the triphones by (left, base_position, right) context.
+
+        Each context maps to the name of its best position-resolved
+        model: the triphone with the requested word position if there
+        is one, else the first of the positions i, s, b, e that exists.
+        Contexts without any triphone are left out, and the base
+        phones of the context-independent models are returned as a
+        set for the back-off.
+        """
+        ranked = {}
+        ciphones = set()
+        s = self.symbols
+        for n in xrange(self.n_phone):
+            lp, mp, rp, pos = (s[self.left[n]], s[self.base[n]],
+                               s[self.right[n]], s[self.pos[n]])
+            if lp == '-':
+                ciphones.add(mp)
+                continue
+            name = "%s-%s_%s+%s" % (lp, mp, pos, rp)
+            for want in "bies":
+                rank = (want + "isbe".replace(want, "")).index(pos)
+                key = (lp, "%s_%s" % (mp, want), rp)
+                if key not in ranked or rank < ranked[key][0]:
+                    ranked[key] = (rank, name)
+        index = dict((key, name) for key, (rank, name) in ranked.iteritems())
+        return index, ciphones
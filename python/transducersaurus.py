@@ -34,6 +34,7 @@ from arpa2fst import ArpaLM
 from lexicon2fst import Lexicon
 from cd2fst import ContextDependency
 from cd2fstSphinx import ContextDependencySphinx
+from hc2fstSphinx import HCSphinx
 from hmm2wfst import hmm2wfst
 from regex2wfst import *
 
@@ -51,7 +52,7 @@ class GenerateCascade( ):
     
     def __init__( self, tiedlist, lexicon, arpa, buildcommand, hmmdefs=None, prefix="test",
                   amtype="htk", semiring="log", failure=None, auxout=3, basedir="",
-                  eps="<eps>", sil="sil", convert=None, order=0, regex=False ):
+                  eps="<eps>", sil="sil", convert=None, order=0, regex=False, jobs=1, exact=False, prune=0.0, cache=False, cachemdef=False, quantize=0, qmethod="kmeans", lmweights=None, normalize=False, minlex=False, reachable=False, auxclass=False, mincd=False, context="cross-word", condensed=False, directhc=False, sharedh=False ):
         
         self._grammar = re.compile(
              r"""\s*(?:
@@ -65,8 +66,25 @@ class GenerateCascade( ):
             )
         self.tiedlist       = tiedlist
         self.lexicon        = lexicon
+        if isinstance( arpa, basestring ):
+            arpa = [ arpa ]
         self.arpa           = arpa
+        self.lmweights      = lmweights
         self.order          = order
+        self.jobs           = jobs
+        self.exact          = exact
+        self.prune          = prune
+        self.cache          = cache
+        self.cachemdef      = cachemdef
+        self.minlex         = minlex
+        self.reachable      = reachable
+        self.mincd          = mincd
+        self.sharedh        = sharedh
+        self.wordbound      = None
+        if context=="word-internal":
+            self.wordbound  = "#wb"
+        self.quantize       = quantize
+        self.qmethod        = qmethod
         self.buildcommand   = buildcommand.replace(" ","")
         self.hmmdefs        = hmmdefs
         self.basedir        = basedir
@@ -77,21 +95,30 @@ class GenerateCascade( ):
         self.eps            = eps
         self.sil            = sil
         self.auxout         = self._set_aux( auxout )
+        self.auxclass       = self._set_auxclass( auxclass )
+        self.condensed      = self._set_condensed( condensed )
         self.wfsts          = set([])
         self.postfix        = self._toPostfix(self.buildcommand)
+        self.directhc       = self._set_directhc( directhc )
         self.convert        = convert
         self.regex          = regex
-        self.normalize       = self._set_normalize( False )
+        self.normalize      = self._set_normalize( normalize )
         self.word_osyms	    = None
+        self.vocab          = None
+        self.lastid         = 0
+        self.gvocab         = None
         self.am_isyms       = None
         
     def _set_normalize( self, normalizeG ):
         """
-          Run the WFST normalization program.
-          All this does is normalize the arc weights for each state.
-          Pass for now.
+          Select the semiring in which ArpaLM normalizes the
+          outgoing weights of each G state, or None to leave G as is.
         """
-        return ""
+        if not normalizeG:
+            return None
+        if self.semiring=="log":
+            return "log"
+        return "tropical"
         
     def _set_aux( self, auxout ):
         #this should work for now but is not very future proof.
@@ -106,6 +133,54 @@ class GenerateCascade( ):
             return 1
         return 
 
+    def _set_auxclass( self, auxclass ):
+        """
+           The aux loops of C can only share a class label if C maps 
+           the aux symbols to epsilon, that is with auxout 0.
+        """
+        if not auxclass:
+            return None
+        if self.auxout>0:
+            print "WARNING: --auxclass requires --auxout 0.  Using one loop per aux symbol."
+            return None
+        return "#aux"
+
+    def _set_condensed( self, condensed ):
+        """
+           The condensed Sphinx C is built over all the CI phone pairs.
+           It has no word-boundary marker, contexts file or minimization,
+           so those options need the deterministic C.
+        """
+        if not condensed:
+            return False
+        if not self.amtype=="sphinx":
+            print "WARNING: --condensed requires a Sphinx format AM.  Building the deterministic C."
+            return False
+        if self.wordbound:
+            print "WARNING: --condensed does not support --context word-internal.  Building the deterministic C."
+            return False
+        if self.reachable or self.mincd:
+            print "WARNING: --condensed cannot be combined with --reachable or --min_cd.  Building the deterministic C."
+            return False
+        return True
+
+    def _set_directhc( self, directhc ):
+        """
+           H and C are only built as one HC transducer for Sphinx 
+           models.  C then stands for PREFIX.hc.fst in the cascade 
+           and the compositions with H are dropped.
+        """
+        if not directhc:
+            return False
+        if not self.amtype=="sphinx":
+            print "WARNING: --direct_hc requires a Sphinx format AM.  Building H and C separately."
+            return False
+        if not ('H' in self.wfsts and 'C' in self.wfsts):
+            print "WARNING: --direct_hc requires both H and C in the build command.  Building H and C separately."
+            return False
+        self.postfix = [ "HC" if tok=="C" else tok for tok in self.postfix ]
+        return True
+
     def _set_prefix( self, prefix ):
         if self.basedir=="auto":
             self.basedir = self.buildcommand.replace("(","a").replace(")","b").replace("*","c").replace(".","o")
@@ -318,11 +393,39 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
 
         return
 		
+    def _relabel_aux( self, r ):
+        """
+           Relabel the input aux symbols of the right-hand operand of C 
+           to the class label that C loops on, using the PREFIX.auxmap 
+           side table written with C.
+        """
+        isyms = {}
+        for line in open("PREFIX.l.isyms".replace("PREFIX",self.prefix),"r"):
+            parts = line.split()
+            if len(parts)==2:
+                isyms[parts[0]] = parts[1]
+        pairs_ofp = open("PREFIX.auxmap.rlbl.txt".replace("PREFIX",self.prefix),"w")
+        for line in open("PREFIX.auxmap".replace("PREFIX",self.prefix),"r"):
+            aux, auxclass = line.split()
+            if aux in isyms:
+                pairs_ofp.write("%s %s\n" % (isyms[aux], isyms[auxclass]))
+        pairs_ofp.close()
+        command = "fstrelabel --relabel_ipairs=PREFIX.auxmap.rlbl.txt PREFIX.FST.fst | fstarcsort --sort_type=ilabel - > PREFIX.aFST.fst"
+        command = command.replace("PREFIX",self.prefix).replace("FST",r.lower())
+        print command
+        os.system( command )
+        return "aFST".replace("FST",r.lower())
+
     def _compose( self, l, r ):
         """
            Run standard composition on two input WFSTs.
         """
 
+        #The direct HC transducer already contains H.
+        if l=="H" and self.directhc:
+            self.final_fst = r.lower()
+            return self.final_fst
+
         #If the left-hand component is the HMM WFST we need to 
         # map the C-level symbols to the AM prior to composition.
         #This is a little bit nasty but should get the job done.
@@ -335,6 +438,8 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
             r = "dFST".replace("FST",r.lower())
             print command
             os.system( command )
+        elif l in ("C","HC") and self.auxclass:
+            r = self._relabel_aux( r )
 
         if (l.endswith("G") or l.endswith("g")) and (r.endswith("T") or r.endswith("t")):
             command = "fstcompose PREFIX.FST1.fst PREFIX.FST2.fst | fstproject --project_output=true - | fstarcsort --sort_type=ilabel - > PREFIX.FST1FST2.fst"
@@ -352,6 +457,11 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
            on two input WFSTs.
         """
 
+        #The direct HC transducer already contains H.
+        if l=="H" and self.directhc:
+            self.final_fst = r.lower()
+            return self.final_fst
+
         #If the left-hand component is the HMM WFST we need to 
         # map the C-level symbols to the AM prior to composition.
         #This is a little bit nasty but should get the job done.
@@ -364,6 +474,8 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
             r = "dFST".replace("FST",r.lower())
             print command
             os.system( command )
+        elif l in ("C","HC") and self.auxclass:
+            r = self._relabel_aux( r )
 
         print "Converting left-hand composition operand..."
         command = "fstconvert --fst_type=olabel_lookahead --save_relabel_opairs=PREFIX.FST1FST2.rlbl.txt PREFIX.FST1.fst > PREFIX.FST1.lkhd.fst"
@@ -530,38 +642,27 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
 
     def _checkVocab( self ):
         """
-           Check the input vocabulary and generate the global
-           output symbols table.
+           Load the lexicon vocabulary and generate the global
+           output symbols table.  The LM words are checked against
+           it while G is generated, so the LM is only read once.
         """
-        vocab, self.word_osyms, lastid = load_vocab_from_lexicon( self.lexicon, prefix=self.prefix, eps=self.eps, failure=self.failure )
-        
-        missing = check_arpa_vocab( self.arpa, vocab, self.word_osyms, lastid )
-        print "Missing LM words were added to %s: %s" % (self.word_osyms,missing)
+        self.vocab, self.word_osyms, self.lastid = load_vocab_from_lexicon( self.lexicon, prefix=self.prefix, eps=self.eps, failure=self.failure )
         return 
 		
     def compileFSTs( self ):
         """
            Generate, compile and register the basic component FSTs.
-           Build in a right-to-left fashion.
+           Build in a right-to-left fashion, except that G precedes T
+           as it completes the word symbols table T is built from.
         """
         if 'L' in self.wfsts and 'G' in self.wfsts:
             self._checkVocab( )
             
-        if 'T' in self.wfsts:
-            print "Building T: silence class transducer..."
-            silclass = Silclass( self.word_osyms, eps=self.eps, silperc=0.117, prefix=self.prefix, failure=self.failure )
-            silclass.read_vocab( )
-            silclass.generate_silclass( )
-            silclass.print_all_syms( )
-            print "Compiling T..."
-            command = "fstcompile --isymbols=WORDS --osymbols=WORDS --arc_type=SEMIRING PREFIX.t.fst.txt | fstarcsort --sort_type=ilabel - > PREFIX.t.fst"
-            command = command.replace("WORDS",self.word_osyms).replace("PREFIX",self.prefix).replace("SEMIRING",self.semiring)
-            os.system( command )
         if 'G' in self.wfsts:
             print "Building G: Grammar transducer..."
             if self.regex:
                 print "JFSG style grammar."
-                jfsg = Regex2WFST( self.arpa, prefix=self.prefix, eps=self.eps )
+                jfsg = Regex2WFST( self.arpa[0], prefix=self.prefix, eps=self.eps )
                 jfsg.re2post( )
                 jfsg.post2nfa( )
                 jfsg.fsaprint( )
@@ -569,41 +670,81 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
                 command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix).replace("WORDS",self.word_osyms)
             else:
                 print "ARPA format LM."
-                arpa = ArpaLM( self.arpa, "PREFIX.g.fst.txt".replace("PREFIX",self.prefix), prefix=self.prefix, eps=self.eps, boff=self.failure, maxorder=self.order )
+                arpa = ArpaLM( self.arpa, "PREFIX.g.fst.txt".replace("PREFIX",self.prefix), prefix=self.prefix, eps=self.eps, boff=self.failure, maxorder=self.order, jobs=self.jobs, exact=self.exact, prune=self.prune, cache=self.cache, quantize=self.quantize, qmethod=self.qmethod, lmweights=self.lmweights, normalize=self.normalize )
+                if self.vocab!=None:
+                    arpa.check_vocab( self.vocab, self.word_osyms, self.lastid )
                 arpa.arpa2fst( )
                 arpa.print_all_syms( )
+                #Only lexicon entries for G words can ever be used
+                self.gvocab = arpa.osyms
+                if self.vocab!=None:
+                    print "Missing LM words were added to %s: %s" % (self.word_osyms,len(arpa.oov)>0)
                 print "Compiling G..."
-                command = "fstcompile --arc_type=SEMIRING --acceptor=true --ssymbols=PREFIX.g.ssyms --isymbols=WORDS PREFIX.g.fst.txt | fstarcsort --sort_type=ilabel - NORMALIZE > PREFIX.g.fst"
-                command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix).replace("WORDS",self.word_osyms).replace("NORMALIZE", self.normalize)
-                #os.system(command)
-                #print "Normalizing G..."
-                #command = "./normalizeG -i PREFIXun.g.fst -o PREFIX.g.fst".replace("PREFIX",self.prefix)
+                command = "fstcompile --arc_type=SEMIRING --acceptor=true --isymbols=WORDS PREFIX.g.fst.txt | fstarcsort --sort_type=ilabel - > PREFIX.g.fst"
+                command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix).replace("WORDS",self.word_osyms)
+            os.system( command )
+        if 'T' in self.wfsts:
+            print "Building T: silence class transducer..."
+            silclass = Silclass( self.word_osyms, eps=self.eps, silperc=0.117, prefix=self.prefix, failure=self.failure )
+            silclass.read_vocab( )
+            silclass.generate_silclass( )
+            silclass.print_all_syms( )
+            print "Compiling T..."
+            command = "fstcompile --isymbols=WORDS --osymbols=WORDS --arc_type=SEMIRING PREFIX.t.fst.txt | fstarcsort --sort_type=ilabel - > PREFIX.t.fst"
+            command = command.replace("WORDS",self.word_osyms).replace("PREFIX",self.prefix).replace("SEMIRING",self.semiring)
             os.system( command )
         if 'L' in self.wfsts:
             print "Building L: lexicon transducer..."
-            L = Lexicon( self.lexicon, prefix=self.prefix, lextype=self.amtype, eps=self.eps, sil=self.sil, failure=self.failure )
-            L.generate_lexicon_transducer()
+            L = Lexicon( self.lexicon, prefix=self.prefix, lextype=self.amtype, eps=self.eps, sil=self.sil, failure=self.failure, vocab=self.gvocab, auxclass=self.auxclass, wordbound=self.wordbound )
+            if self.minlex:
+                L.generate_minimal_lexicon_transducer()
+            else:
+                L.generate_lexicon_transducer()
             L.print_all_syms()
             L.print_aux()
             L.print_phones()
+            L.print_contexts()
             print "Compiling L..."
-            command = "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.l.isyms --osymbols=WORDS PREFIX.l.fst.txt | fstclosure - | fstarcsort --sort_type=olabel - > PREFIX.l.fst"
+            if self.minlex:
+                #The minimal lexicon is already closed
+                command = "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.l.isyms --osymbols=WORDS PREFIX.l.fst.txt | fstarcsort --sort_type=olabel - > PREFIX.l.fst"
+            else:
+                command = "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.l.isyms --osymbols=WORDS PREFIX.l.fst.txt | fstclosure - | fstarcsort --sort_type=olabel - > PREFIX.l.fst"
             command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix).replace("WORDS",self.word_osyms)
             os.system( command )
         if 'C' in self.wfsts:
+            contexts = None
+            if self.reachable:
+                contexts = "PREFIX.ctx".replace("PREFIX",self.prefix)
             if self.amtype=="htk":
                 print "Building C: HTK-format context-dependency transducer..."
                 C = ContextDependency( 
                     "PREFIX.phons".replace("PREFIX",self.prefix), "PREFIX.aux".replace("PREFIX",self.prefix), 
-                    tiedlist=self.tiedlist, prefix=self.prefix, eps=self.eps, sil=self.sil, auxout=self.auxout )
+                    tiedlist=self.tiedlist, prefix=self.prefix, eps=self.eps, sil=self.sil, auxout=self.auxout, contexts=contexts, auxclass=self.auxclass, minimize=self.mincd, wordbound=self.wordbound )
                 C.generate_deterministic()
                 C.print_all_syms()
                 print "Generating HTK input symbols..."
                 make_hmmsyms( self.hmmdefs, self.eps, self.prefix, C.aux )
+            elif self.amtype=="sphinx" and self.directhc:
+                print "Building HC: Sphinx-format HMM and context-dependency transducer..."
+                HC = HCSphinx( self.tiedlist, "PREFIX.aux".replace("PREFIX",self.prefix), prefix=self.prefix, auxout=self.auxout, contexts=contexts, auxclass=self.auxclass, minimize=self.mincd, wordbound=self.wordbound, cache=self.cachemdef )
+                if self.condensed:
+                    HC.generate_nondeterministic_condensed()
+                else:
+                    HC.generate_deterministic()
+                HC.print_all_syms()
+                print "Compiling HC..."
+                command = "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.h.isyms --osymbols=PREFIX.l.isyms PREFIX.hc.fst.txt | fstarcsort --sort_type=olabel - > PREFIX.hc.fst"
+                command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix)
+                os.system( command )
+                return
             elif self.amtype=="sphinx":
                 print "Building C: Sphinx-format context-dependency transducer..."
-                C = ContextDependencySphinx( self.tiedlist, "PREFIX.aux".replace("PREFIX",self.prefix), prefix=self.prefix, auxout=self.auxout )
-                C.generate_deterministic()
+                C = ContextDependencySphinx( self.tiedlist, "PREFIX.aux".replace("PREFIX",self.prefix), prefix=self.prefix, auxout=self.auxout, contexts=contexts, auxclass=self.auxclass, minimize=self.mincd, wordbound=self.wordbound, cache=self.cachemdef )
+                if self.condensed:
+                    C.generate_nondeterministic_condensed()
+                else:
+                    C.generate_deterministic()
                 C.print_all_syms()
             print "Compiling C..."
             if self.auxout>0 or 'H' in self.wfsts:
@@ -613,13 +754,24 @@ fstcompose - PREFIX.FST.fst > PREFIX.dFST.fst"""
             command = command.replace("SEMIRING",self.semiring).replace("PREFIX",self.prefix) 
             os.system( command )
         if 'H' in self.wfsts:
-            print "Building H: Sphinx format HMM transducer..."
+            hmm_file = self.tiedlist
+            if self.amtype=="htk":
+                print "Building H: HTK format HMM transducer..."
+                hmm_file = self.hmmdefs
+            else:
+                print "Building H: Sphinx format HMM transducer..."
             H = hmm2wfst( 
-                self.tiedlist, amtype=self.amtype, 
+                hmm_file, amtype=self.amtype, 
                 eps=self.eps, aux_file="PREFIX.aux".replace("PREFIX",self.prefix), 
-                prefix=self.prefix, auxout=self.auxout, isyms_file="PREFIX.hmm.syms".replace("PREFIX",self.prefix)
+                prefix=self.prefix, auxout=self.auxout, isyms_file="PREFIX.hmm.syms".replace("PREFIX",self.prefix),
+                cache=self.cachemdef
                 )
-            H.mdef2wfst( )
+            if self.amtype=="htk":
+                H.hmmdefs2wfst( index="PREFIX.hmmdefs.idx".replace("PREFIX",self.prefix) )
+            elif self.sharedh:
+                H.mdef2wfst_shared( )
+            else:
+                H.mdef2wfst( )
             if self.auxout:
                 command = "fstcompile --arc_type=SEMIRING --isymbols=PREFIX.h.isyms --osymbols=PREFIX.hmm.syms PREFIX.h.fst.txt | fstarcsort --sort_type=olabel - > PREFIX.h.fst"
                 H.makemapper( )
@@ -736,19 +888,36 @@ Unbalanced parentheses will be caught:
     parser.add_argument('--amtype',     "-a", help='Acoustic model type.  May be set to "htk" or "sphinx".', default="htk" )
     parser.add_argument('--auxout',     "-o", help='Generate explicit input aux labels for the context-dependency transducer. Will automatically generate appropriate symbols based on cascade requirements.  Supported values are: "0"=No input aux symbols; "1"=Map c-level triphones to the AM, generate no input aux symbols; "2"=Generate input aux symbols for C, map arcs to AM, map arcs to H level; "3"=Determine behaviour automatically (recommended).', default=3, type=int )
     parser.add_argument('--basedir',    "-b", help='Base directory for model storage.', default="", required=False)
+    parser.add_argument('--cache',      "-C", help='Cache the parsed ARPA LM in PREFIX.g.cache and reuse it when G is rebuilt from the same LM and settings.  Requires --exact.', default=False, action="store_true" )
+    parser.add_argument('--cache_mdef', "-K", help='Cache the parsed Sphinx mdef in PREFIX.mdef.cache and reuse it when C and H are rebuilt from the same mdef.', default=False, action="store_true" )
     parser.add_argument('--command',    "-c", help='Build command specifying OpenFST composition and optimization operations.\nValid operators are\n\t"*" - composition,\n\t"." - static on-the-fly composition,\n\t"det" - determinization,\n\t"min" - minimization', required=True)
     parser.add_argument('--version',    "-V", help='Print Version information and exit.', action="version", version="transducersaurus.py: V%s"%(__version__) )
     parser.add_argument('--convert',    "-n", help='Convert the final cascade to either Juicer or TCubed format.  Valid values are "t" (tcubed), "j" (juicer) or "tj" for both.', default=None, required=False )
     parser.add_argument('--eps',        "-e", help='Epsilon symbol.', default="<eps>")
+    parser.add_argument('--exact',      "-x", help='Exact G construction.  Repairs missing back-off nodes and trims unreachable and dead-end states.  Holds the LM in memory.', default=False, action="store_true" )
     parser.add_argument('--failure',    "-f", help='Use failure transitions to represent back-off arcs in the LM.', default=None, required=False )
-    parser.add_argument('--grammar',    "-g", help='An input grammar file.  May be an ARPA format LM or a JFSG style grammar.', required=True)
+    parser.add_argument('--grammar',    "-g", help='An input grammar file.  May be an ARPA format LM or a JFSG style grammar.  Several ARPA LMs are interpolated into a single G.', required=True, nargs="+")
     parser.add_argument('--hmmdefs',    "-d", help='hmmdefs file.  Needed for HTK acoustic models.', default=None, required=False )
     parser.add_argument('--lexicon',    "-l", help='List of words to transcribe.', required=True)
+    parser.add_argument('--lmweights',  "-w", help='Interpolation weights, one per ARPA LM given to --grammar.  Defaults to equal weights.', default=None, nargs="+", type=float )
+    parser.add_argument('--normalize',  "-N", help='Normalize the outgoing weights of each G state in the build semiring while G is written.', default=False, action="store_true" )
+    parser.add_argument('--minlex',     "-M", help='Build L directly as a closed, deterministic and minimal transducer.  det(L) is then unnecessary.', default=False, action="store_true" )
+    parser.add_argument('--reachable',  "-R", help='Only build the C states and arcs for phone contexts that the lexicon can produce, read from PREFIX.ctx.', default=False, action="store_true" )
+    parser.add_argument('--auxclass',   "-A", help='Give C a single aux loop per state with a class label.  The aux symbols of the right-hand operand of C are relabeled to it before composition.  Requires --auxout 0.', default=False, action="store_true" )
+    parser.add_argument('--min_cd',     "-D", help='Minimize C while it is built, merging the states with identical outgoing arcs after the tiedlist mapping.', default=False, action="store_true" )
+    parser.add_argument('--context',    "-W", help='"cross-word" or "word-internal" triphones.  Word-internal cascades reset the context at a word-boundary marker emitted by L, using biphones or monophones at the word edges.', default="cross-word", choices=["cross-word","word-internal"] )
+    parser.add_argument('--condensed',  "-k", help='Build the condensed, non-deterministic Sphinx C, with states over the context-independent phones.', default=False, action="store_true" )
+    parser.add_argument('--direct_hc',  "-H", help='Build H and C as one HC transducer with a senone chain on every context arc, from a single mdef pass.  Skips the H*C composition and the PREFIX.d mapper.  Sphinx AMs only.', default=False, action="store_true" )
+    parser.add_argument('--shared_h',   "-S", help='Build H with one state chain per distinct senone sequence.  The logical models enter the shared chains on haux:model arcs.', default=False, action="store_true" )
     parser.add_argument('--no_compile', "-z", help='Specify whether or not to run the component compilation routines.  Set to false if you have already built your components and just want to combine and optimize them.', default=False, action="store_true")
     parser.add_argument('--prefix',     "-p", help='A file prefix.  Will be prepended to all model files created during cascade generation.', default="test")
+    parser.add_argument('--prune_threshold', "-P", help='Relative-entropy pruning threshold for the ARPA LM.  N-grams that raise the perplexity by less than this relative amount are pruned before G is built.  Implies --exact.  Defaults to 0, no pruning.', default=0.0, type=float )
+    parser.add_argument('--quantize',   "-q", help='Quantize the G probabilities and back-off weights to codebooks of this many levels, e.g. 256.  Gives encoded determinization and minimization more shared weights.  Defaults to 0, no quantization.', default=0, type=int )
+    parser.add_argument('--qmethod',    "-m", help='Codebook fitting method for --quantize, "kmeans" or "uniform".  Defaults to "kmeans".', default="kmeans" )
     parser.add_argument('--semiring',   "-r", help='Semiring to use during cascade construction. May be set to "log" or "standard" (tropical).  Use "standard" if your build command includes OTF composition.', default="log" )
     parser.add_argument('--order',      "-O", help='Build N-grams only up to "--order". Default behavior is to build *all* N-grams.', default=0, type=int )
     parser.add_argument('--sil',        "-s", help='Silence monophone symbol.', default="sil")
+    parser.add_argument('--jobs',       "-J", help='Number of processes used to convert the ARPA LM to G.  Requires an uncompressed LM.  Defaults to 1.', default=1, type=int )
     parser.add_argument('--jfsg',       "-j", help='The grammar is a regular expression/JFSG style grammar.', default=False, action="store_true" )
     parser.add_argument('--tiedlist',   "-t", help='Acoustic model tied list. mdef file for Sphinx, tiedlist file for HTK', required=True)
     parser.add_argument('--verbose',    "-v", help='Verbose mode.', default=False, action="store_true")
@@ -757,6 +926,9 @@ Unbalanced parentheses will be caught:
     if "version" in args.__dict__:
         print "Transducersaurus version:", __version__
         sys.exit()
+    if args.cache and not (args.exact or args.prune_threshold>0.0 or len(args.grammar)>1):
+        print "--cache stores the parsed trie of the exact G construction.  Please also specify --exact."
+        sys.exit()
     if args.amtype=="htk" and args.hmmdefs==None:
         print "HTK format AMs require an hmmdefs file.  Please specify one."
         sys.exit()
@@ -785,6 +957,23 @@ Unbalanced parentheses will be caught:
         basedir=args.basedir,
         convert=args.convert,
         regex=args.jfsg,
+        jobs=args.jobs,
+        exact=args.exact,
+        prune=args.prune_threshold,
+        cache=args.cache,
+        cachemdef=args.cache_mdef,
+        quantize=args.quantize,
+        qmethod=args.qmethod,
+        lmweights=args.lmweights,
+        normalize=args.normalize,
+        minlex=args.minlex,
+        reachable=args.reachable,
+        auxclass=args.auxclass,
+        mincd=args.min_cd,
+        context=args.context,
+        condensed=args.condensed,
+        directhc=args.direct_hc,
+        sharedh=args.shared_h,
     )
     if args.no_compile==False:
         cascade.compileFSTs( )